@@ -1,49 +1,282 @@
-from flask import Flask, request, jsonify, render_template
-from core.interpreter import parse_code, eval_program
-
-app = Flask(__name__)
-
-def ast_to_tree_string(ast, indent=0):
-    spacing = "  " * indent
-    if isinstance(ast, dict):
-        s = ""
-        for k, v in ast.items():
-            s += f"{spacing}{k}:\n"
-            s += ast_to_tree_string(v, indent + 1)
-        return s
-    elif isinstance(ast, list):
-        s = ""
-        for i, item in enumerate(ast):
-            s += f"{spacing}- item {i}:\n"
-            s += ast_to_tree_string(item, indent + 1)
-        return s
-    else:
-        return f"{spacing}{ast}\n"
-
-@app.route('/run', methods=['POST'])
-def run():
-    data = request.json
-    code = data.get("code", "")
-    try:
-        ast = parse_code(code)
-        output, hot_ops = eval_program(ast)
-
-        # Ensure output is always a list
-        if isinstance(output, str):
-            output = [output]
-
-        tree_str = ast_to_tree_string(ast)
-        return jsonify({
-            "output": output,
-            "ast_tree": tree_str,
-            "hot_ops": hot_ops
-        })
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-if __name__ == '__main__':
+import json
+import os
+import queue
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from core.executor import (
+    PREWARM, QueueFullError, get_pool, pool_stats, prewarm, run_batch_job, run_program_job, stream_inline,
+    stream_program_job,
+)
+from core.interpreter import BudgetExceeded
+from core.metrics import registry
+from core.runtime import OPT_LEVELS
+from core.session import SessionNotFound, SessionStoreFull, get_sessions, session_stats
+from core.tiering import TieringPolicy
+
+app = Flask(__name__)
+
+# "pool" runs jobs in worker processes; "inline" runs them in the request thread.
+EXECUTOR = os.environ.get("JIT_EXECUTOR", "pool")
+
+# Server-wide caps on the per-request "fuel" and "timeout" fields; 0 means no cap.
+MAX_FUEL = int(os.environ.get("JIT_MAX_FUEL", "0")) or None
+MAX_TIMEOUT = float(os.environ.get("JIT_TIMEOUT", "10")) or None
+# Largest "count" /run_batch accepts for functions without parameters.
+MAX_BATCH_COUNT = int(os.environ.get("JIT_MAX_BATCH_COUNT", str(1 << 20)))
+
+def execute(job, *args):
+    if EXECUTOR == "inline":
+        return job(*args)
+    return get_pool().run(job, *args)
+
+def execute_stream(job, *args):
+    if EXECUTOR == "inline":
+        return stream_inline(job, *args)
+    return get_pool().stream(job, *args)
+
+def merge_metrics(metrics):
+    if metrics is not None:
+        registry.merge(metrics)
+
+def get_limits(data):
+    fuel = data.get("fuel")
+    if fuel is not None and (not isinstance(fuel, int) or isinstance(fuel, bool) or fuel < 0):
+        raise Exception("fuel must be a non-negative integer")
+    timeout = data.get("timeout")
+    if timeout is not None and (not isinstance(timeout, (int, float)) or isinstance(timeout, bool)
+                                or timeout <= 0):
+        raise Exception("timeout must be a positive number of seconds")
+    if MAX_FUEL is not None:
+        fuel = MAX_FUEL if fuel is None else min(fuel, MAX_FUEL)
+    if MAX_TIMEOUT is not None:
+        timeout = MAX_TIMEOUT if timeout is None else min(timeout, MAX_TIMEOUT)
+    return fuel, timeout
+
+def get_count(data):
+    count = data.get("count")
+    if count is not None and (not isinstance(count, int) or isinstance(count, bool)
+                              or not 0 <= count <= MAX_BATCH_COUNT):
+        raise Exception(f"count must be an integer between 0 and {MAX_BATCH_COUNT}")
+    return count
+
+def get_opt_level(data):
+    opt_level = data.get("opt_level")
+    if opt_level is not None and (not isinstance(opt_level, int) or isinstance(opt_level, bool)
+                                  or opt_level not in OPT_LEVELS):
+        raise Exception(f"opt_level must be an integer between {OPT_LEVELS[0]} and {OPT_LEVELS[-1]}")
+    return opt_level
+
+def get_arrays(data):
+    # {"name": [...] or {"base64": ...}} sets those top-level variables to
+    # arrays before the program runs; the arrays it holds at the end come
+    # back in the same form array_format asks for.
+    arrays = data.get("arrays")
+    if arrays is not None and not isinstance(arrays, dict):
+        raise Exception("arrays must be an object mapping variable names to arrays")
+    array_format = data.get("array_format", "list")
+    if array_format not in ("list", "base64"):
+        raise Exception("array_format must be 'list' or 'base64'")
+    return arrays, array_format
+
+def get_tiering(data):
+    options = data.get("tiering")
+    return TieringPolicy.from_dict(options) if options is not None else None
+
+def budget_exceeded(e):
+    return jsonify({"error": str(e), "budget": e.to_dict()}), 400
+
+def queue_full(e):
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+def stream_records(future, sink):
+    # One JSON object per line: {"output": [...]} and {"ast_tree": ...}
+    # records as the job produces them, then a final record with either
+    # hot_ops/jit or the error.
+    while True:
+        try:
+            record = sink.get(timeout=0.1)
+        except queue.Empty:
+            if future.done():
+                break
+            continue
+        yield json.dumps(record) + "\n"
+    # The job has returned, so everything it put is already queued.
+    while True:
+        try:
+            record = sink.get_nowait()
+        except queue.Empty:
+            break
+        yield json.dumps(record) + "\n"
+    try:
+        hot_ops, jit_stats, arrays, metrics = future.result()
+        merge_metrics(metrics)
+        final = {"hot_ops": hot_ops, "jit": jit_stats, "arrays": arrays}
+    except BudgetExceeded as e:
+        final = {"error": str(e), "budget": e.to_dict()}
+    except Exception as e:
+        final = {"error": str(e)}
+    yield json.dumps(final) + "\n"
+
+@app.route('/run', methods=['POST'])
+def run():
+    data = request.json
+    code = data.get("code", "")
+    try:
+        opt_level = get_opt_level(data)
+        fuel, timeout = get_limits(data)
+        tiering = get_tiering(data)
+        arrays, array_format = get_arrays(data)
+        # The rendered AST can be much larger than the output, so it is only
+        # built when asked for.
+        render_ast = bool(data.get("ast", False))
+        if data.get("stream"):
+            future, sink = execute_stream(stream_program_job, code, opt_level, fuel, timeout, render_ast,
+                                          tiering, arrays, array_format)
+            return Response(stream_with_context(stream_records(future, sink)),
+                            mimetype="application/x-ndjson")
+
+        ast_tree, output, hot_ops, jit_stats, arrays, metrics = execute(run_program_job, code, opt_level,
+                                                                        fuel, timeout, render_ast, tiering,
+                                                                        arrays, array_format)
+        merge_metrics(metrics)
+
+        # Ensure output is always a list
+        if isinstance(output, str):
+            output = [output]
+
+        result = {
+            "output": output,
+            "hot_ops": hot_ops,
+            "jit": jit_stats,
+            "arrays": arrays
+        }
+        if ast_tree is not None:
+            result["ast_tree"] = ast_tree
+        return jsonify(result)
+    except BudgetExceeded as e:
+        return budget_exceeded(e)
+    except QueueFullError as e:
+        return queue_full(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/run_batch', methods=['POST'])
+def run_batch():
+    data = request.json
+    code = data.get("code", "")
+    try:
+        opt_level = get_opt_level(data)
+        func_name = data.get("function")
+        if not func_name:
+            raise Exception("Missing 'function' to run")
+        fuel, timeout = get_limits(data)
+        results, output, jit_stats, metrics = execute(run_batch_job, code, func_name, data.get("inputs", []),
+                                                      get_count(data), opt_level, fuel, timeout,
+                                                      get_tiering(data))
+        merge_metrics(metrics)
+        return jsonify({
+            "results": results,
+            "output": [output],
+            "jit": jit_stats
+        })
+    except BudgetExceeded as e:
+        return budget_exceeded(e)
+    except QueueFullError as e:
+        return queue_full(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+# Sessions keep an interpreter between requests, so they live in this
+# process rather than in the pool, whose workers any job may land on.
+
+@app.route('/compile', methods=['POST'])
+def compile_session():
+    # Runs the program once and keeps it, so /call can call its functions
+    # without sending, parsing or warming it up again.
+    data = request.json
+    code = data.get("code", "")
+    try:
+        fuel, timeout = get_limits(data)
+        session, output = get_sessions().create(code, get_opt_level(data), fuel, timeout, get_tiering(data))
+        return jsonify({
+            "session": session.id,
+            "functions": session.functions(),
+            "output": ["\n".join(output)],
+            "jit": session.interpreter.get_jit_stats()
+        })
+    except BudgetExceeded as e:
+        return budget_exceeded(e)
+    except SessionStoreFull as e:
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/call', methods=['POST'])
+def call_session():
+    data = request.json
+    try:
+        func_name = data.get("function")
+        if not func_name:
+            raise Exception("Missing 'function' to call")
+        args = data.get("args", [])
+        if not isinstance(args, list) or not all(isinstance(a, int) and not isinstance(a, bool) for a in args):
+            raise Exception("args must be a list of integers")
+        fuel, timeout = get_limits(data)
+        sessions = get_sessions()
+        session = sessions.get(data.get("session"))
+        result, output = sessions.call(session, func_name, args, fuel, timeout)
+        return jsonify({
+            "result": result,
+            "output": ["\n".join(output)],
+            "hot_ops": session.interpreter.get_hot_operations(),
+            "jit": session.interpreter.get_jit_stats()
+        })
+    except BudgetExceeded as e:
+        return budget_exceeded(e)
+    except SessionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/session/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    try:
+        get_sessions().close(session_id)
+        return jsonify({"closed": session_id})
+    except SessionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format. Worker processes report with each finished
+    # job, so a job's numbers appear once it returns.
+    gauges = []
+    stats = pool_stats()
+    if stats is not None:
+        gauges.append(("jit_pool_workers", "Worker processes in the execution pool.", stats["workers"]))
+        gauges.append(("jit_pool_pending_jobs", "Jobs running or queued in the pool.", stats["pending"]))
+    stats = session_stats()
+    if stats is not None:
+        gauges.append(("jit_sessions", "Open sessions.", stats["sessions"]))
+        gauges.append(("jit_session_bytes", "Estimated memory held by open sessions.", stats["bytes"]))
+    return Response(registry.render(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+def warm_up():
+    # Sessions and inline jobs run in this process; pool workers prewarm
+    # themselves as they start.
+    prewarm()
+    if EXECUTOR != "inline":
+        get_pool().start()
+
+# With the debug reloader, only the child process that serves requests
+# warms up, not the one watching files.
+if PREWARM and (__name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+    warm_up()
+
+if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
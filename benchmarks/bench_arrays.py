@@ -0,0 +1,127 @@
+import base64
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# In the request thread, so /run timings are about decoding and running
+# rather than the trip to a worker process.
+os.environ["JIT_EXECUTOR"] = "inline"
+os.environ["JIT_BACKGROUND_COMPILE"] = "0"
+os.environ["JIT_CACHE_DIR"] = ""
+
+import app
+from core.arrays import Array
+from core.interpreter import Interpreter, parse_code
+from core.tiering import TieringPolicy
+
+KERNELS = """
+    def dot(a, b) {
+        s = 0;
+        i = 0;
+        n = len(a);
+        while (i < n) {
+            s = s + a[i] * b[i];
+            i = i + 1;
+        }
+        return s;
+    }
+    def axpy(k, x, y) {
+        i = 0;
+        while (i < len(x)) {
+            y[i] = k * x[i] + y[i];
+            i = i + 1;
+        }
+        return 0;
+    }
+"""
+
+PROGRAM = KERNELS + """
+    r = 0;
+    t = 0;
+    while (r < 3) {
+        t = t + dot(xs, ys);
+        z = axpy(3, xs, ys);
+        r = r + 1;
+    }
+    print(t);
+"""
+
+TIERS = {
+    # Never hot, so every element goes through the interpreter.
+    "interpreted": TieringPolicy(min_calls=1 << 62, max_calls=1 << 62),
+    "jit": TieringPolicy(min_calls=1, max_calls=1),
+}
+
+def inputs(n):
+    return np.arange(n, dtype=np.int64) % 100, np.ones(n, dtype=np.int64)
+
+def run_tier(tiering, n):
+    xs, ys = inputs(n)
+    interpreter = Interpreter(parse_code(PROGRAM, True), tiering=tiering, background_compile=False,
+                              variables={"xs": Array(xs), "ys": Array(ys)})
+    if tiering.min_calls > 1:
+        interpreter.loop_threshold = float("inf")
+    start = time.perf_counter()
+    output = interpreter.run()
+    return time.perf_counter() - start, int(output[-1]), int(ys.sum())
+
+def run_numpy(n):
+    xs, ys = inputs(n)
+    start = time.perf_counter()
+    t = 0
+    for _ in range(3):
+        t += int(xs @ ys)
+        ys += 3 * xs
+    return time.perf_counter() - start, t, int(ys.sum())
+
+def run_request(client, n, array_format):
+    xs, ys = inputs(n)
+    if array_format == "base64":
+        arrays = {name: {"base64": base64.b64encode(a.astype("<i8").tobytes()).decode("ascii")}
+                  for name, a in (("xs", xs), ("ys", ys))}
+    else:
+        arrays = {"xs": xs.tolist(), "ys": ys.tolist()}
+    body = json.dumps({"code": PROGRAM, "arrays": arrays, "array_format": array_format,
+                       "tiering": {"min_calls": 1, "max_calls": 1}})
+    start = time.perf_counter()
+    response = client.post("/run", data=body, content_type="application/json")
+    elapsed = time.perf_counter() - start
+    data = response.get_json()
+    if "error" in data:
+        raise Exception(data["error"])
+    result = data["arrays"]["ys"]
+    if array_format == "base64":
+        result = np.frombuffer(base64.b64decode(result["base64"]), dtype="<i8")
+    return elapsed, len(body), int(data["output"][-1]), int(sum(result))
+
+def main(tier_size=1_000_000, request_size=1_000_000):
+    print(f"dot + axpy, 3 rounds over {tier_size:,} elements")
+    print(f"{'tier':<13}{'time (s)':>10}{'elements/s':>16}")
+    results = {}
+    for label, run in (("interpreted", lambda: run_tier(TIERS["interpreted"], tier_size)),
+                       ("jit", lambda: run_tier(TIERS["jit"], tier_size)),
+                       ("numpy", lambda: run_numpy(tier_size))):
+        elapsed, *results[label] = run()
+        print(f"{label:<13}{elapsed:>10.3f}{6 * tier_size / elapsed:>16,.0f}")
+    if len({tuple(r) for r in results.values()}) != 1:
+        raise Exception(f"Tiers disagree: {results}")
+
+    client = app.app.test_client()
+    print()
+    print(f"/run with two arrays of {request_size:,} elements")
+    print(f"{'array_format':<14}{'request (MB)':>14}{'time (s)':>10}")
+    outputs = set()
+    for array_format in ("list", "base64"):
+        elapsed, size, *result = run_request(client, request_size, array_format)
+        outputs.add(tuple(result))
+        print(f"{array_format:<14}{size / (1 << 20):>14.1f}{elapsed:>10.3f}")
+    if len(outputs) != 1:
+        raise Exception(f"Formats disagree: {outputs}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_interpreter import PROGRAMS, TreeWalker, best_of
+from bench_parser import generate_program
+from core.interpreter import Interpreter, Parser, tokenize
+from core.nodes import (
+    OP_NUMBER, OP_VARIABLE, OP_BINARY_OP, OP_FUNCTION_CALL, OP_ASSIGN, OP_PRINT, OP_IF, OP_WHILE,
+    OP_FUNCTION_DEF, OP_RETURN, to_dict,
+)
+
+# The TreeWalker evaluator with dict lookups swapped for slot reads and tag
+# compares, so the two tree forms are compared on the same algorithm.
+class NodeWalker(TreeWalker):
+    def eval_expr(self, expr, env):
+        t = expr.tag
+        if t == OP_NUMBER:
+            return expr.value
+        elif t == OP_VARIABLE:
+            return env.get(expr.name, 0)
+        elif t == OP_BINARY_OP:
+            left = self.eval_expr(expr.left, env)
+            right = self.eval_expr(expr.right, env)
+            op = expr.op
+            if op == "+":
+                return left + right
+            elif op == "-":
+                return left - right
+            elif op == "*":
+                return left * right
+            elif op == "/":
+                return left // right if right != 0 else 0
+            elif op == "==":
+                return 1 if left == right else 0
+            elif op == "!=":
+                return 1 if left != right else 0
+            elif op == "<":
+                return 1 if left < right else 0
+            elif op == ">":
+                return 1 if left > right else 0
+            elif op == "<=":
+                return 1 if left <= right else 0
+            elif op == ">=":
+                return 1 if left >= right else 0
+        elif t == OP_FUNCTION_CALL:
+            func = self.functions[expr.name]
+            args = [self.eval_expr(arg, env) for arg in expr.args]
+            new_env = dict(zip(func.params, args))
+            try:
+                for stmt in func.body:
+                    self.run_stmt(stmt, new_env)
+            except TreeWalker.ReturnException as r:
+                return r.value
+            return 0
+
+    def run_stmt(self, stmt, env):
+        t = stmt.tag
+        if t == OP_ASSIGN:
+            env[stmt.var] = self.eval_expr(stmt.expr, env)
+        elif t == OP_PRINT:
+            self.output.append(str(self.eval_expr(stmt.expr, env)))
+        elif t == OP_IF:
+            if self.eval_expr(stmt.cond, env) != 0:
+                self.run_block(stmt.body, env)
+            elif stmt.else_body is not None:
+                self.run_block(stmt.else_body, env)
+        elif t == OP_WHILE:
+            while self.eval_expr(stmt.cond, env) != 0:
+                self.run_block(stmt.body, env)
+        elif t == OP_FUNCTION_DEF:
+            self.functions[stmt.name] = stmt
+        elif t == OP_RETURN:
+            raise TreeWalker.ReturnException(self.eval_expr(stmt.expr, env))
+
+    def run(self):
+        self.run_block(self.ast.body, self.env)
+        return self.output
+
+def parse(code):
+    return Parser(tokenize(code), code).parse()
+
+def allocated(build):
+    tracemalloc.start()
+    try:
+        tree = build()
+        return tracemalloc.get_traced_memory()[0], tree
+    finally:
+        tracemalloc.stop()
+
+def main(repeat=3):
+    print(f"{'functions':>10}{'dicts (KiB)':>13}{'nodes (KiB)':>13}{'saving':>9}")
+    for functions in (100, 1000):
+        code = generate_program(functions)
+        node_bytes, tree = allocated(lambda: parse(code))
+        dict_bytes, _ = allocated(lambda: to_dict(tree))
+        print(f"{functions:>10}{dict_bytes / 1024:>13.1f}{node_bytes / 1024:>13.1f}"
+              f"{1 - node_bytes / dict_bytes:>8.0%}")
+
+    print()
+    print(f"{'program':<16}{'dict walk (s)':>15}{'node walk (s)':>15}{'speedup':>10}{'lower (ms)':>12}")
+    for name, code in PROGRAMS.items():
+        tree = parse(code)
+        tree_dict = to_dict(tree)
+        dict_time, dict_out = best_of(lambda: TreeWalker(tree_dict).run(), repeat)
+        node_time, node_out = best_of(lambda: NodeWalker(tree).run(), repeat)
+        if dict_out != node_out:
+            raise Exception(f"{name}: outputs differ ({dict_out} vs {node_out})")
+        lower_time, _ = best_of(lambda: Interpreter(tree).lower_block(tree.body), repeat)
+        print(f"{name:<16}{dict_time:>15.4f}{node_time:>15.4f}{dict_time / node_time:>9.2f}x"
+              f"{lower_time * 1000:>12.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import ctypes
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.engines import ENGINES
+from core.runtime import NativeState
+
+def make_program(functions):
+    # Distinct bodies, so every function is a fresh compile; each calls the
+    # one before it, so the engine has to link them to each other.
+    defs = ["def f0(a, b) { return a * b - 1; }"]
+    defs += [
+        f"def f{i}(a, b) {{ s = 0; i = 0; while (i < a) {{ s = s + i * {i} - b; i = i + 1; }} return s + f{i - 1}(b, a); }}"
+        for i in range(1, functions)
+    ]
+    return "\n".join(defs)
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+
+def measure(backend, functions, cache_dir):
+    # Runs in a fresh process so LLVM state and memory use start clean.
+    from core.interpreter import parse_code
+    from core.jit_compiler import JITCompiler
+
+    funcs = parse_code(make_program(functions)).body
+    state = NativeState()
+    def compile_all(jit):
+        compiled = {}
+        latencies = []
+        for func in funcs:
+            start = time.perf_counter()
+            compiled[func.name] = jit.compile_function(func, callees=compiled)
+            latencies.append(time.perf_counter() - start)
+        return compiled, latencies
+
+    jit = JITCompiler(cache_dir=cache_dir, max_cached_functions=functions, backend=backend)
+    before = rss_mb()
+    compiled, latencies = compile_all(jit)
+    grown = rss_mb() - before
+    result = compiled[funcs[-1].name].callable(ctypes.addressof(state), 3, 2)
+
+    # A second engine finds every object in the disk cache.
+    disk_jit = JITCompiler(cache_dir=cache_dir, max_cached_functions=functions, backend=backend)
+    disk_compiled, disk_latencies = compile_all(disk_jit)
+    if disk_compiled[funcs[-1].name].callable(ctypes.addressof(state), 3, 2) != result or disk_jit.disk_hits != functions:
+        raise Exception(f"{backend}: cached objects did not load")
+
+    # Compiling them all again into an engine that keeps only 16 shows
+    # what evicted code leaves behind.
+    churn = JITCompiler(cache_dir="", max_cached_functions=16, backend=backend)
+    before = rss_mb()
+    compile_all(churn)
+    leaked = rss_mb() - before
+    tail = latencies[-max(1, functions // 10):]
+    return {
+        "total_s": sum(latencies),
+        "mean_ms": sum(latencies) / functions * 1000,
+        "last10_ms": sum(tail) / len(tail) * 1000,
+        "disk_ms": sum(disk_latencies) / functions * 1000,
+        "rss_mb": grown,
+        "evicted_mb": leaked,
+        "result": result,
+    }
+
+def main(sizes=(1, 100, 1000)):
+    context = multiprocessing.get_context("spawn")
+    print(f"{'functions':>9}  {'backend':<7}{'total (s)':>10}{'mean (ms)':>11}{'last 10% (ms)':>15}"
+          f"{'disk hit (ms)':>15}{'RSS (MB)':>10}{'evicted (MB)':>14}")
+    for functions in sizes:
+        results = {}
+        for backend in ENGINES:
+            cache_dir = tempfile.mkdtemp(prefix="bench-backends-")
+            try:
+                with context.Pool(1) as pool:
+                    r = results[backend] = pool.apply(measure, (backend, functions, cache_dir))
+            finally:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            print(f"{functions:>9}  {backend:<7}{r['total_s']:>10.3f}{r['mean_ms']:>11.3f}{r['last10_ms']:>15.3f}"
+                  f"{r['disk_ms']:>15.3f}{r['rss_mb']:>10.1f}{r['evicted_mb']:>14.1f}")
+        if len({r["result"] for r in results.values()}) != 1:
+            raise Exception(f"Backends disagree: {results}")
+
+if __name__ == "__main__":
+    main()
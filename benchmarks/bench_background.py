@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.interpreter import Interpreter, parse_code
+from core.jit_compiler import JITCompiler
+from core.runtime import get_compile_executor
+from core.tiering import TieringPolicy
+
+def make_program(functions):
+    # Distinct bodies, so every function is a fresh compile.
+    return "".join(
+        f"""
+        def f{i}(n) {{
+            s = 0;
+            i = 0;
+            while (i < n) {{
+                if (i / 3 * 3 == i) {{ s = s + i * {i + 2}; }} else {{ s = s - {i + 1}; }}
+                i = i + 1;
+            }}
+            return s;
+        }}
+        """
+        for i in range(functions)
+    )
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run(ast, functions, rounds, background):
+    # Calls every function in turn and times each call as the caller sees
+    # it; with inline compiles the call that makes a function hot also
+    # waits for LLVM.
+    interp = Interpreter(ast, jit=JITCompiler(cache_dir=""), tiering=TieringPolicy(max_calls=10),
+                         background_compile=background)
+    interp.loop_threshold = float("inf")
+    latencies = []
+    with interp.jit.running(interp):
+        interp.lower_block(ast.body)(interp.env)
+        start = time.perf_counter()
+        for r in range(rounds):
+            for i in range(functions):
+                call_start = time.perf_counter()
+                interp.call_function(f"f{i}", [20])
+                latencies.append(time.perf_counter() - call_start)
+        total = time.perf_counter() - start
+    return total, latencies, interp
+
+def main(functions=20, rounds=1000):
+    ast = parse_code(make_program(functions))
+    # Start the compiler thread outside the measurement.
+    get_compile_executor().submit(lambda: None).result()
+    print(f"{functions} functions x {rounds} calls, {os.cpu_count()} CPU(s)")
+    print(f"{'compile':<12}{'total (s)':>11}{'p50 (us)':>11}{'p99 (us)':>11}{'max (ms)':>11}{'native':>8}")
+    for label, background in (("inline", False), ("background", True)):
+        total, latencies, interp = run(ast, functions, rounds, background)
+        print(f"{label:<12}{total:>11.3f}{percentile(latencies, 0.5) * 1e6:>11.1f}"
+              f"{percentile(latencies, 0.99) * 1e6:>11.1f}{max(latencies) * 1000:>11.2f}"
+              f"{len(interp.compiled_functions):>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.interpreter import Interpreter, parse_code
+from core.tiering import TieringPolicy
+
+CODE = """
+    def poly(x, y) {
+        if (x > y) {
+            return x * x - 3 * y + 7;
+        }
+        return y * y + 2 * x - 1;
+    }
+"""
+
+def main(count=1000000):
+    interp = Interpreter(parse_code(CODE), tiering=TieringPolicy(max_calls=10), background_compile=False)
+    interp.run()
+    rng = np.random.default_rng(0)
+    xs = rng.integers(-1000, 1000, count, dtype=np.int64)
+    ys = rng.integers(-1000, 1000, count, dtype=np.int64)
+
+    # Warm up so both paths use compiled code.
+    interp.run_batch("poly", [xs[:10], ys[:10]])
+    for i in range(200):
+        interp.call_function("poly", [i, i + 1])
+    native = interp.compiled_functions["poly"].callable
+
+    start = time.perf_counter()
+    batch = interp.run_batch("poly", [xs, ys])
+    batch_time = time.perf_counter() - start
+
+    per_call_count = count // 10
+    x_list, y_list = xs[:per_call_count].tolist(), ys[:per_call_count].tolist()
+    start = time.perf_counter()
+    state = interp.state_address
+    single = [native(state, x, y) for x, y in zip(x_list, y_list)]
+    per_call_time = (time.perf_counter() - start) * (count / per_call_count)
+
+    if single != batch[:per_call_count].tolist():
+        raise Exception("batch and per-call results differ")
+    print(f"{'path':<24}{'elements/s':>16}")
+    print(f"{'one ctypes call each':<24}{count / per_call_time:>16,.0f}")
+    print(f"{'run_batch':<24}{count / batch_time:>16,.0f}")
+
+if __name__ == "__main__":
+    main()
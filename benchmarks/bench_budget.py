@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_interpreter import PROGRAMS
+from core.interpreter import Interpreter, parse_code
+
+CALLS = """
+    def add(a, b) {
+        def unused() { return 0; }
+        return a + b;
+    }
+    i = 0;
+    s = 0;
+    while (i < 50000) {
+        s = add(s, i);
+        i = i + 1;
+    }
+    print(s);
+"""
+
+def run(ast, tier, limits):
+    interp = Interpreter(ast, **limits)
+    if tier == "interpreted":
+        interp.loop_threshold = float("inf")
+    return interp.run()
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def main(repeat=7):
+    # Loose limits that never trigger, so only the cost of checking shows.
+    limits = {"fuel": 1 << 40, "timeout": 3600}
+    programs = dict(PROGRAMS, calls=CALLS)
+    print(f"{'program':<16}{'tier':<13}{'no limits (s)':>15}{'limits (s)':>12}{'overhead':>10}")
+    for name, code in programs.items():
+        ast = parse_code(code)
+        for tier in ("interpreted", "native"):
+            run(ast, tier, {})
+            base = limited = float("inf")
+            # Alternate the two configurations so drift hits both equally.
+            for _ in range(repeat):
+                elapsed, base_out = timed(lambda: run(ast, tier, {}))
+                base = min(base, elapsed)
+                elapsed, limited_out = timed(lambda: run(ast, tier, limits))
+                limited = min(limited, elapsed)
+            if base_out != limited_out:
+                raise Exception(f"{name}: outputs differ ({base_out} vs {limited_out})")
+            overhead = (limited / base - 1) * 100
+            print(f"{name:<16}{tier:<13}{base:>15.4f}{limited:>12.4f}{overhead:>9.1f}%")
+
+if __name__ == "__main__":
+    main()
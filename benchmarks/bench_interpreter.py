@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.interpreter import Interpreter, parse_code
+from core.nodes import to_dict
+
+# Reference copy of the original dict-walking evaluator, kept only so the
+# lowered interpreter has something to be measured against.
+class TreeWalker:
+    class ReturnException(Exception):
+        def __init__(self, value):
+            self.value = value
+
+    def __init__(self, ast):
+        self.ast = ast
+        self.env = {}
+        self.output = []
+        self.functions = {}
+
+    def eval_expr(self, expr, env):
+        t = expr["type"]
+        if t == "number":
+            return expr["value"]
+        elif t == "variable":
+            return env.get(expr["name"], 0)
+        elif t == "binary_op":
+            left = self.eval_expr(expr["left"], env)
+            right = self.eval_expr(expr["right"], env)
+            op = expr["op"]
+            if op == "+":
+                return left + right
+            elif op == "-":
+                return left - right
+            elif op == "*":
+                return left * right
+            elif op == "/":
+                return left // right if right != 0 else 0
+            elif op == "==":
+                return 1 if left == right else 0
+            elif op == "!=":
+                return 1 if left != right else 0
+            elif op == "<":
+                return 1 if left < right else 0
+            elif op == ">":
+                return 1 if left > right else 0
+            elif op == "<=":
+                return 1 if left <= right else 0
+            elif op == ">=":
+                return 1 if left >= right else 0
+        elif t == "function_call":
+            func = self.functions[expr["name"]]
+            args = [self.eval_expr(arg, env) for arg in expr["args"]]
+            new_env = dict(zip(func["params"], args))
+            try:
+                for stmt in func["body"]:
+                    self.run_stmt(stmt, new_env)
+            except TreeWalker.ReturnException as r:
+                return r.value
+            return 0
+
+    def run_stmt(self, stmt, env):
+        t = stmt["type"]
+        if t == "assign":
+            env[stmt["var"]] = self.eval_expr(stmt["expr"], env)
+        elif t == "print":
+            self.output.append(str(self.eval_expr(stmt["expr"], env)))
+        elif t == "if":
+            if self.eval_expr(stmt["cond"], env) != 0:
+                self.run_block(stmt["body"], env)
+            elif stmt.get("else_body") is not None:
+                self.run_block(stmt["else_body"], env)
+        elif t == "while":
+            while self.eval_expr(stmt["cond"], env) != 0:
+                self.run_block(stmt["body"], env)
+        elif t == "function_def":
+            self.functions[stmt["name"]] = stmt
+        elif t == "return":
+            raise TreeWalker.ReturnException(self.eval_expr(stmt["expr"], env))
+
+    def run_block(self, stmts, env):
+        for stmt in stmts:
+            self.run_stmt(stmt, env)
+
+    def run(self):
+        self.run_block(self.ast["body"], self.env)
+        return self.output
+
+PROGRAMS = {
+    "counting_loop": """
+        i = 0;
+        s = 0;
+        while (i < 200000) {
+            s = s + i;
+            i = i + 1;
+        }
+        print(s);
+    """,
+    "nested_loops": """
+        i = 0;
+        total = 0;
+        while (i < 300) {
+            j = 0;
+            while (j < 300) {
+                if (j / 2 * 2 == j) {
+                    total = total + i * j;
+                } else {
+                    total = total - 1;
+                }
+                j = j + 1;
+            }
+            i = i + 1;
+        }
+        print(total);
+    """,
+    "arithmetic": """
+        i = 0;
+        acc = 7;
+        while (i < 100000) {
+            acc = (acc * 31 + i * 17 - 5) / 3 + (i - acc) * 2;
+            acc = acc - acc / 1000 * 1000;
+            i = i + 1;
+        }
+        print(acc);
+    """,
+}
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def run_cold(ast):
+    # Keep loops in the interpreted tier so only the lowering is measured.
+    interp = Interpreter(ast)
+    interp.loop_threshold = float("inf")
+    return interp.run()
+
+def main(repeat=3):
+    print(f"{'program':<16}{'tree walk (s)':>15}{'lowered (s)':>15}{'speedup':>10}")
+    for name, code in PROGRAMS.items():
+        ast = parse_code(code)
+        tree = to_dict(ast)
+        walk_time, walk_out = best_of(lambda: TreeWalker(tree).run(), repeat)
+        lowered_time, lowered_out = best_of(lambda: run_cold(ast), repeat)
+        if walk_out != lowered_out:
+            raise Exception(f"{name}: outputs differ ({walk_out} vs {lowered_out})")
+        print(f"{name:<16}{walk_time:>15.4f}{lowered_time:>15.4f}{walk_time / lowered_time:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
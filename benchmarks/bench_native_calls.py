@@ -0,0 +1,59 @@
+import ctypes
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.interpreter import Interpreter, parse_code
+
+CODE = """
+    def add1(x) {
+        return x + 1;
+    }
+"""
+
+def calls_per_second(fn, calls):
+    start = time.perf_counter()
+    fn(calls)
+    return calls / (time.perf_counter() - start)
+
+def main(calls=300000):
+    interp = Interpreter(parse_code(CODE), background_compile=False)
+    interp.run()
+    # Warm up past the hot threshold and the timing samples.
+    for i in range(1000):
+        interp.call_function("add1", [i])
+    compiled = interp.compiled_functions["add1"]
+    func_ptr = ctypes.cast(compiled.callable, ctypes.c_void_p).value
+
+    state = interp.state_address
+
+    # The previous call path: a 5-argument prototype whatever the arity,
+    # with the argument list padded with zeros on every call.
+    padded = ctypes.CFUNCTYPE(ctypes.c_longlong, ctypes.c_void_p, *([ctypes.c_longlong] * 5))(func_ptr)
+    def padded_calls(n):
+        for i in range(n):
+            args = [i]
+            while len(args) < 5:
+                args.append(0)
+            padded(state, *args[:5])
+
+    exact = compiled.callable
+    def exact_calls(n):
+        for i in range(n):
+            exact(state, i)
+
+    call = interp.call_function
+    def interpreter_calls(n):
+        for i in range(n):
+            call("add1", [i])
+
+    print(f"{'call path':<28}{'calls/s':>14}")
+    for name, fn in (("padded 5-arg shim", padded_calls),
+                     ("interpreter -> native", interpreter_calls),
+                     ("exact-arity prototype", exact_calls)):
+        print(f"{name:<28}{calls_per_second(fn, calls):>14,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import ctypes
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.interpreter import parse_code
+from core.jit_compiler import OPT_LEVELS, JITCompiler
+from core.runtime import NativeState
+
+KERNELS = {
+    "sum_of_squares": ("""
+        def kernel(n) {
+            i = 0;
+            s = 0;
+            while (i < n) {
+                s = s + i * i;
+                i = i + 1;
+            }
+            return s;
+        }
+    """, 1000000),
+    "collatz_steps": ("""
+        def kernel(n) {
+            total = 0;
+            k = 1;
+            while (k < n) {
+                x = k;
+                while (x != 1) {
+                    if (x / 2 * 2 == x) {
+                        x = x / 2;
+                    } else {
+                        x = 3 * x + 1;
+                    }
+                    total = total + 1;
+                }
+                k = k + 1;
+            }
+            return total;
+        }
+    """, 20000),
+    "mixed_arith": ("""
+        def kernel(n) {
+            i = 0;
+            acc = 7;
+            while (i < n) {
+                acc = (acc * 31 + i * 17 - 5) / 3 + (i - acc) * 2;
+                acc = acc - acc / 1000 * 1000;
+                i = i + 1;
+            }
+            return acc;
+        }
+    """, 1000000),
+}
+
+def main(repeat=5):
+    state = NativeState()
+    print(f"{'kernel':<16}{'level':>6}{'compile (ms)':>14}{'run (ms)':>12}{'result':>16}")
+    for name, (code, n) in KERNELS.items():
+        func_ast = parse_code(code).body[0]
+        for level in OPT_LEVELS:
+            jit = JITCompiler(opt_level=level, cache_dir=None)
+            compiled = jit.compile_function(func_ast)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = compiled.callable(ctypes.addressof(state), n)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:<16}{'O' + str(level):>6}{compiled.compile_time * 1000:>14.2f}"
+                  f"{best * 1000:>12.3f}{result:>16}")
+
+if __name__ == "__main__":
+    main()
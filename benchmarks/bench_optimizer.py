@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.interpreter import Interpreter, parse_code
+from core.jit_compiler import JITCompiler
+from core.optimizer import optimize
+from core.tiering import TieringPolicy
+
+PROGRAMS = {
+    "invariant_arith": """
+        def f(n, k) {
+            i = 0;
+            s = 0;
+            while (i < n) {
+                seconds = 2 * 60 * 60;
+                s = s + seconds + i * (k * k + 1) - (k * 3 + 7) / 2;
+                i = i + 1;
+            }
+            return s;
+        }
+        print(f(200000, 12));
+    """,
+    "dead_branches": """
+        debug = 0;
+        scale = 4;
+        i = 0;
+        s = 0;
+        while (i < 200000) {
+            if (debug) { print(i); }
+            unused = i * i;
+            s = s + i * scale * 1 + 0;
+            i = i + 1;
+        }
+        print(s);
+    """,
+    "nested_loops": """
+        n = 300;
+        i = 0;
+        s = 0;
+        while (i < n) {
+            j = 0;
+            while (j < n) {
+                s = s + j * (i * 2 + 1) + (n - 1) / 3;
+                j = j + 1;
+            }
+            i = i + 1;
+        }
+        print(s);
+    """,
+}
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best, result
+
+def run(ast, jit):
+    interp = Interpreter(ast, jit=jit, background_compile=False)
+    if jit is None:
+        interp.tiering = TieringPolicy(min_calls=1 << 62, max_calls=1 << 62)
+        interp.loop_threshold = float("inf")
+    return list(interp.run())
+
+def main(repeat=3):
+    print(f"{'program':<18}{'tier':<13}{'as parsed (s)':>15}{'optimized (s)':>15}{'speedup':>10}")
+    for name, code in PROGRAMS.items():
+        ast = parse_code(code)
+        optimized = optimize(ast)
+        for tier in ("interpreted", "jit"):
+            # A fresh engine per run, so both pay for their own compiles.
+            jit = (lambda: JITCompiler(cache_dir="")) if tier == "jit" else (lambda: None)
+            before, expected = best_of(lambda: run(ast, jit()), repeat)
+            after, output = best_of(lambda: run(optimized, jit()), repeat)
+            if output != expected:
+                raise Exception(f"{name}: outputs differ ({output} vs {expected})")
+            print(f"{name:<18}{tier:<13}{before:>15.4f}{after:>15.4f}{before / after:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
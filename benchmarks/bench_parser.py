@@ -0,0 +1,244 @@
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import interpreter
+from core.interpreter import Parser, parse_code, tokenize
+from core.nodes import to_dict
+
+# Reference copy of the original regex tokenizer and string-comparing
+# parser, kept only so the current one has something to be measured against.
+def reference_tokenize(code):
+    token_spec = r'\d+|[a-zA-Z_]\w*|==|!=|<=|>=|[+\-*/(){}<>=;,]|.'
+    tokens = re.findall(token_spec, code)
+    tokens = [t for t in tokens if t.strip() != '']
+    return tokens
+
+class ReferenceParser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def current(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def eat(self, token=None):
+        cur = self.current()
+        if token and cur != token:
+            raise Exception(f"Expected '{token}', got '{cur}'")
+        self.pos += 1
+        return cur
+
+    def parse(self):
+        stmts = []
+        while self.current() is not None:
+            stmts.append(self.parse_stmt())
+        return {
+            "type": "program",
+            "body": stmts
+        }
+
+    def parse_stmt(self):
+        cur = self.current()
+        if cur == "if":
+            return self.parse_if()
+        elif cur == "def":
+            return self.parse_function_def()
+        elif cur == "return":
+            return self.parse_return()
+        elif cur == "while":
+            return self.parse_while()
+        elif cur == "print":
+            return self.parse_print()
+        else:
+            return self.parse_assign()
+
+    def parse_if(self):
+        self.eat("if")
+        self.eat("(")
+        cond = self.parse_expr()
+        self.eat(")")
+        self.eat("{")
+        body = []
+        while self.current() != "}":
+            body.append(self.parse_stmt())
+        self.eat("}")
+
+        else_body = None
+        if self.current() == "else":
+            self.eat("else")
+            self.eat("{")
+            else_body = []
+            while self.current() != "}":
+                else_body.append(self.parse_stmt())
+            self.eat("}")
+
+        return {"type": "if", "cond": cond, "body": body, "else_body": else_body}
+
+    def parse_function_def(self):
+        self.eat("def")
+        name = self.eat()
+        self.eat("(")
+        params = []
+        while self.current() != ")":
+            params.append(self.eat())
+            if self.current() == ",":
+                self.eat(",")
+        self.eat(")")
+        self.eat("{")
+        body = []
+        while self.current() != "}":
+            body.append(self.parse_stmt())
+        self.eat("}")
+        return {"type": "function_def", "name": name, "params": params, "body": body}
+
+    def parse_return(self):
+        self.eat("return")
+        expr = self.parse_expr()
+        self.eat(";")
+        return {"type": "return", "expr": expr}
+
+    def parse_while(self):
+        self.eat("while")
+        self.eat("(")
+        cond = self.parse_expr()
+        self.eat(")")
+        self.eat("{")
+        body = []
+        while self.current() != "}":
+            body.append(self.parse_stmt())
+        self.eat("}")
+        return {"type": "while", "cond": cond, "body": body}
+
+    def parse_print(self):
+        self.eat("print")
+        self.eat("(")
+        expr = self.parse_expr()
+        self.eat(")")
+        self.eat(";")
+        return {"type": "print", "expr": expr}
+
+    def parse_assign(self):
+        var = self.eat()
+        if not re.match(r"[a-zA-Z_]\w*", var):
+            raise Exception(f"Invalid variable name {var}")
+        self.eat("=")
+        expr = self.parse_expr()
+        self.eat(";")
+        return {
+            "type": "assign",
+            "var": var,
+            "expr": expr
+        }
+
+
+    def parse_expr(self):
+        return self.parse_rel()
+
+    def parse_rel(self):
+        node = self.parse_add()
+        while self.current() in ("==", "!=", "<", ">", "<=", ">="):
+            op = self.eat()
+            right = self.parse_add()
+            node = {"type": "binary_op", "op": op, "left": node, "right": right}
+        return node
+
+    def parse_add(self):
+        node = self.parse_mul()
+        while self.current() in ("+", "-"):
+            op = self.eat()
+            right = self.parse_mul()
+            node = {"type": "binary_op", "op": op, "left": node, "right": right}
+        return node
+
+    def parse_mul(self):
+        node = self.parse_factor()
+        while self.current() in ("*", "/"):
+            op = self.eat()
+            right = self.parse_factor()
+            node = {"type": "binary_op", "op": op, "left": node, "right": right}
+        return node
+
+    def parse_factor(self):
+        cur = self.current()
+        if cur == "(":
+            self.eat("(")
+            node = self.parse_expr()
+            self.eat(")")
+            return node
+        elif cur is not None and cur.isdigit():
+            val = int(self.eat())
+            return {"type": "number", "value": val}
+        elif cur is not None and re.match(r"[a-zA-Z_]\w*", cur):
+            name = self.eat()
+            if self.current() == "(":  
+                self.eat("(")
+                args = []
+                while self.current() != ")":
+                    args.append(self.parse_expr())
+                    if self.current() == ",":
+                        self.eat(",")
+                self.eat(")")
+                return {"type": "function_call", "name": name, "args": args}
+            else:
+                return {"type": "variable", "name": name}
+        else:
+            raise Exception(f"Unexpected token {cur}")
+
+def generate_program(functions, seed=0):
+    rng = random.Random(seed)
+
+    def expr(depth):
+        if depth == 0 or rng.random() < 0.3:
+            return rng.choice(["a", "b", "total", "i", str(rng.randint(0, 999))])
+        op = rng.choice(["+", "-", "*", "/", "<", "=="])
+        return f"({expr(depth - 1)} {op} {expr(depth - 1)})"
+
+    lines = []
+    for n in range(functions):
+        lines.append(f"def f{n}(a, b) {{")
+        lines.append("    total = 0;")
+        lines.append("    i = 0;")
+        lines.append(f"    while (i < {rng.randint(1, 50)}) {{")
+        lines.append(f"        if ({expr(2)}) {{")
+        lines.append(f"            total = total + {expr(3)};")
+        lines.append("        } else {")
+        lines.append(f"            print({expr(2)});")
+        lines.append("        }")
+        lines.append("        i = i + 1;")
+        lines.append("    }")
+        lines.append(f"    return total + f{max(n - 1, 0)}(a, {expr(1)});")
+        lines.append("}")
+    lines.append(f"print(f{functions - 1}(1, 2));")
+    return "\n".join(lines)
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def main(repeat=5):
+    print(f"{'functions':>10}{'KiB':>8}{'reference (ms)':>16}{'scanner (ms)':>14}{'speedup':>9}{'cached (us)':>13}")
+    for functions in (10, 100, 1000):
+        code = generate_program(functions)
+        ref_time, ref_ast = best_of(lambda: ReferenceParser(reference_tokenize(code)).parse(), repeat)
+        new_time, new_ast = best_of(lambda: Parser(tokenize(code), code).parse(), repeat)
+        if ref_ast != to_dict(new_ast):
+            raise Exception(f"{functions} functions: ASTs differ")
+        interpreter.parse_cache.clear()
+        parse_code(code)
+        cached_time, _ = best_of(lambda: parse_code(code), repeat)
+        print(f"{functions:>10}{len(code) / 1024:>8.1f}{ref_time * 1000:>16.2f}{new_time * 1000:>14.2f}"
+              f"{ref_time / new_time:>8.2f}x{cached_time * 1e6:>13.1f}")
+
+if __name__ == "__main__":
+    main()
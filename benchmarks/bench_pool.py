@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.executor import ExecutionPool, run_program_job
+
+# The nested def keeps step() from being compiled, so every job spends its
+# time in the pure-Python interpreter and holds the GIL.
+CODE = """
+    def step(x) {
+        def unused() { return 0; }
+        return x + 1;
+    }
+    i = 0;
+    while (i < 20000) {
+        i = step(i);
+    }
+    print(i);
+"""
+
+def run_inline(jobs, threads):
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(run_program_job, CODE) for _ in range(jobs)]
+        return [f.result() for f in futures]
+
+def run_pool(jobs, workers):
+    pool = ExecutionPool(workers=workers, max_pending=jobs)
+    try:
+        # Let every worker finish starting up before timing.
+        for f in [pool.submit(run_program_job, "print(1);") for _ in range(workers)]:
+            f.result()
+        start = time.perf_counter()
+        futures = [pool.submit(run_program_job, CODE) for _ in range(jobs)]
+        results = [f.result() for f in futures]
+        return time.perf_counter() - start, results
+    finally:
+        pool.shutdown()
+
+def main(jobs=16):
+    cores = os.cpu_count() or 1
+    print(f"{jobs} concurrent jobs, {cores} CPU(s)")
+
+    start = time.perf_counter()
+    run_inline(jobs, cores)
+    inline_time = time.perf_counter() - start
+    print(f"{'inline threads':<16} {inline_time:8.2f} s  {jobs / inline_time:7.2f} jobs/s")
+
+    workers = 1
+    while workers <= cores:
+        elapsed, results = run_pool(jobs, workers)
+        assert all(r[1] == "20000" for r in results)
+        print(f"{f'pool x{workers}':<16} {elapsed:8.2f} s  {jobs / elapsed:7.2f} jobs/s  "
+              f"({inline_time / elapsed:.2f}x vs inline)")
+        workers *= 2
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 16)
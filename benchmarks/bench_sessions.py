@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Both ways in the request thread, so the comparison is about the work each
+# request does rather than the trip to a worker process.
+os.environ["JIT_EXECUTOR"] = "inline"
+os.environ["JIT_BACKGROUND_COMPILE"] = "0"
+
+import app
+
+LIBRARY = """
+    def score(a, b) {
+        s = 0;
+        i = 0;
+        while (i < 200) {
+            s = s + (a * i - b) / (i + 1);
+            i = i + 1;
+        }
+        return s;
+    }
+    def fib(n) {
+        if (n < 2) { return n; }
+        return fib(n - 1) + fib(n - 2);
+    }
+"""
+
+CALLS = [("score", [7, 3]), ("fib", [15])]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run_each_time(client, func_name, args):
+    # What clients do without sessions: send the whole program every time.
+    code = LIBRARY + f"print({func_name}({', '.join(map(str, args))}));"
+    response = client.post("/run", json={"code": code})
+    return int(response.get_json()["output"][0])
+
+def main(requests=200):
+    client = app.app.test_client()
+    session = client.post("/compile", json={"code": LIBRARY}).get_json()["session"]
+    def call(func_name, args):
+        response = client.post("/call", json={"session": session, "function": func_name, "args": args})
+        return response.get_json()["result"]
+    print(f"{requests} requests per function")
+    print(f"{'function':<10}{'api':<8}{'total (s)':>11}{'p50 (ms)':>11}{'p99 (ms)':>11}{'first (ms)':>12}")
+    for func_name, args in CALLS:
+        results = {}
+        for label, request in (("/run", lambda: run_each_time(client, func_name, args)),
+                               ("/call", lambda: call(func_name, args))):
+            latencies = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                results.setdefault(label, request())
+                latencies.append(time.perf_counter() - start)
+            print(f"{func_name:<10}{label:<8}{sum(latencies):>11.3f}{percentile(latencies, 0.5) * 1000:>11.3f}"
+                  f"{percentile(latencies, 0.99) * 1000:>11.3f}{latencies[0] * 1000:>12.3f}")
+        if results["/run"] != results["/call"]:
+            raise Exception(f"{func_name}: /call returned {results['/call']}, /run {results['/run']}")
+    client.delete(f"/session/{session}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REQUESTS = {
+    # Never gets hot: should not need LLVM at all.
+    "short": "x = 6; y = x * 7; print(y);",
+    "hot_fib": """
+        def fib(n) {
+            if (n < 2) { return n; }
+            return fib(n - 1) + fib(n - 2);
+        }
+        print(fib(22));
+    """,
+}
+
+CORPUS = """
+    def fib(n) {
+        if (n < 2) { return n; }
+        return fib(n - 1) + fib(n - 2);
+    }
+"""
+
+# Runs in a fresh interpreter, so imports and LLVM start from nothing.
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+client = app.app.test_client()
+start = time.perf_counter()
+response = client.post("/run", json={"code": sys.argv[1]}).get_json()
+first = time.perf_counter() - start
+print(json.dumps({"import_s": imported, "first_s": first, "output": response["output"],
+                  "llvm": "llvmlite" in sys.modules}))
+"""
+
+def measure(mode, code, corpus):
+    env = dict(os.environ, JIT_EXECUTOR="inline", JIT_BACKGROUND_COMPILE="0", JIT_CACHE_DIR="")
+    if mode == "prewarm":
+        env.update(JIT_PREWARM="1", JIT_PREWARM_CORPUS=corpus)
+    result = subprocess.run([sys.executable, "-c", CHILD, code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(repeat=5):
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write(CORPUS)
+    try:
+        print(f"best of {repeat} fresh processes")
+        print(f"{'request':<10}{'mode':<9}{'import (ms)':>13}{'first request (ms)':>20}{'LLVM loaded':>13}")
+        for name, code in REQUESTS.items():
+            outputs = set()
+            for mode in ("lazy", "prewarm"):
+                runs = [measure(mode, code, f.name) for _ in range(repeat)]
+                outputs.update(json.dumps(r["output"]) for r in runs)
+                imported = min(r["import_s"] for r in runs)
+                first = min(r["first_s"] for r in runs)
+                print(f"{name:<10}{mode:<9}{imported * 1000:>13.1f}{first * 1000:>20.1f}{str(runs[0]['llvm']):>13}")
+            if len(outputs) != 1:
+                raise Exception(f"{name}: outputs differ between modes: {outputs}")
+    finally:
+        os.unlink(f.name)
+
+if __name__ == "__main__":
+    main()
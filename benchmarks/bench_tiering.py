@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.interpreter import Interpreter, parse_code
+from core.jit_compiler import JITCompiler
+from core.tiering import TieringPolicy
+
+def many_small(functions=40, calls=12):
+    # Lots of cheap functions called a few times each: compiling them costs
+    # more than it saves.
+    defs = "".join(f"def f{i}(x) {{ return x * {i} + 1; }}\n" for i in range(functions))
+    calls = "".join(f"k = 0; while (k < {calls}) {{ s = s + f{i}(k); k = k + 1; }}\n"
+                    for i in range(functions))
+    return defs + "s = 0;\n" + calls + "print(s);"
+
+PROGRAMS = {
+    "many_small": many_small(),
+    "fib": """
+        def fib(n) {
+            if (n < 2) { return n; }
+            return fib(n - 1) + fib(n - 2);
+        }
+        print(fib(22));
+    """,
+    "constant_arg": """
+        def power(x, e) {
+            r = 1;
+            i = 0;
+            while (i < e) {
+                r = r * x;
+                i = i + 1;
+            }
+            return r;
+        }
+        k = 0;
+        s = 0;
+        while (k < 20000) {
+            s = s + power(k / 1000, 12);
+            k = k + 1;
+        }
+        print(s);
+    """,
+}
+
+POLICIES = {
+    # The old rule: every function is compiled on its tenth call.
+    "fixed 10 calls": TieringPolicy(min_calls=10, max_calls=10, specialize_calls=0),
+    "adaptive": TieringPolicy(specialize_calls=0),
+    "adaptive+spec": TieringPolicy(),
+}
+
+def run(ast, policy):
+    # A fresh engine without the object cache, so every run pays for its
+    # compiles.
+    interp = Interpreter(ast, jit=JITCompiler(cache_dir=""), tiering=policy)
+    interp.loop_threshold = float("inf")
+    start = time.perf_counter()
+    output = interp.run()
+    return time.perf_counter() - start, output, interp
+
+def main(repeat=3):
+    print(f"{'program':<14}{'policy':<16}{'total (s)':>11}{'compile (s)':>13}{'compiled':>10}"
+          f"{'specialized':>13}")
+    for name, code in PROGRAMS.items():
+        ast = parse_code(code)
+        expected = None
+        for label, policy in POLICIES.items():
+            best = None
+            for _ in range(repeat):
+                elapsed, output, interp = run(ast, policy)
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, interp)
+                if expected is None:
+                    expected = output
+                elif output != expected:
+                    raise Exception(f"{name}: outputs differ ({output} vs {expected})")
+            elapsed, interp = best
+            print(f"{name:<14}{label:<16}{elapsed:>11.4f}{interp.compile_time:>13.4f}"
+                  f"{len(interp.compiled_functions):>10}{len(interp.specializations):>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llvmlite
+
+from core.interpreter import Interpreter, Parser, tokenize
+from core.jit_compiler import COMPILER_VERSION, JITCompiler
+from core.nodes import Program
+from core.tiering import TieringPolicy
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+def generated_program(functions=300):
+    # Lots of distinct small functions, each called a few times: parse,
+    # lowering and compile decisions dominate.
+    defs = "".join(
+        f"def g{i}(a, b) {{ if (a < b) {{ return a * {i} + b; }} return a - b / {i + 1}; }}\n"
+        for i in range(functions)
+    )
+    calls = "".join(f"s = s + g{i}(k, {i});\n" for i in range(functions))
+    return defs + "s = 0;\nk = 0;\nwhile (k < 3) {\n" + calls + "k = k + 1;\n}\nprint(s);\n"
+
+def call_chain(depth=60):
+    # c0 calls c1 calls ... c{depth}, from a loop.
+    defs = "".join(f"def c{i}(x) {{ return c{i + 1}(x + 1) - 1; }}\n" for i in range(depth))
+    defs += f"def c{depth}(x) {{ return x * 2; }}\n"
+    return defs + "k = 0;\ns = 0;\nwhile (k < 400) { s = s + c0(k); k = k + 1; }\nprint(s);\n"
+
+WORKLOADS = {
+    "fib": """
+        def fib(n) {
+            if (n < 2) { return n; }
+            return fib(n - 1) + fib(n - 2);
+        }
+        print(fib(20));
+    """,
+    "nested_loops": """
+        i = 0;
+        s = 0;
+        while (i < 300) {
+            j = 0;
+            while (j < 300) {
+                s = s + i * j - (i + j) / 3;
+                j = j + 1;
+            }
+            i = i + 1;
+        }
+        print(s);
+    """,
+    "arith_kernel": """
+        def kernel(n) {
+            i = 0;
+            acc = 7;
+            while (i < n) {
+                acc = (acc * 31 + i * 17 - 5) / 3 + (i - acc) * 2;
+                acc = acc - acc / 1000 * 1000;
+                i = i + 1;
+            }
+            return acc;
+        }
+        k = 0;
+        while (k < 20) { print(kernel(5000 + k)); k = k + 1; }
+    """,
+    "call_chain": call_chain(),
+    "generated": generated_program(),
+}
+
+METRICS = ("parse_ms", "interpreted_ms", "compile_ms", "native_ms", "jit_ms", "run_ms")
+
+def parse_uncached(code):
+    ast = Parser(tokenize(code), code).parse()
+    return Program(ast) if isinstance(ast, list) else ast
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+def run_interpreter(ast, jit, tiering, loop_threshold=1000):
+    interp = Interpreter(ast, jit=jit, tiering=tiering, background_compile=False)
+    interp.loop_threshold = loop_threshold
+    elapsed, output = timed(interp.run)
+    return elapsed, list(output), interp
+
+def measure(name, code, client, repeat):
+    # Every metric is the median of repeat runs, in milliseconds:
+    #   parse_ms        tokenize + parse, without the parse cache
+    #   interpreted_ms  run with the JIT turned off
+    #   jit_ms          run on a fresh engine, with inline compiles
+    #   compile_ms      the part of jit_ms spent compiling
+    #   native_ms       the rest of jit_ms: interpreted warm-up and native code
+    #   run_ms          POST /run through the Flask test client, warm
+    samples = {metric: [] for metric in METRICS}
+    never = TieringPolicy(min_calls=1 << 62, max_calls=1 << 62)
+    expected = None
+    for _ in range(repeat):
+        elapsed, ast = timed(lambda: parse_uncached(code))
+        samples["parse_ms"].append(elapsed)
+
+        elapsed, expected, _ = run_interpreter(ast, JITCompiler(cache_dir=""), never, float("inf"))
+        samples["interpreted_ms"].append(elapsed)
+
+        elapsed, output, interp = run_interpreter(ast, JITCompiler(cache_dir=""), TieringPolicy())
+        if output != expected:
+            raise Exception(f"{name}: JIT output {output} differs from interpreted {expected}")
+        samples["jit_ms"].append(elapsed)
+        samples["compile_ms"].append(interp.compile_time * 1000)
+        samples["native_ms"].append(elapsed - interp.compile_time * 1000)
+
+    client.post("/run", json={"code": code})
+    for _ in range(repeat):
+        elapsed, response = timed(lambda: client.post("/run", json={"code": code}))
+        data = response.get_json()
+        if response.status_code != 200 or data["output"] != ["\n".join(expected)]:
+            raise Exception(f"{name}: /run returned {response.status_code} {data}")
+        samples["run_ms"].append(elapsed)
+    return {metric: round(statistics.median(values), 3) for metric, values in samples.items()}
+
+def compare(results, baseline, threshold, min_delta):
+    # A metric regresses when it is more than threshold (a fraction) slower
+    # than the baseline and by at least min_delta ms, so sub-millisecond
+    # noise is not reported.
+    regressions = []
+    comparison = {}
+    for name, metrics in results.items():
+        before = baseline.get(name, {})
+        for metric, value in metrics.items():
+            old = before.get(metric)
+            if old is None:
+                continue
+            ratio = value / old if old else None
+            status = "ok"
+            if ratio is not None and ratio > 1 + threshold and value - old >= min_delta:
+                status = "regression"
+                regressions.append(f"{name}.{metric}")
+            elif ratio is not None and ratio < 1 / (1 + threshold) and old - value >= min_delta:
+                status = "improvement"
+            comparison.setdefault(name, {})[metric] = {
+                "baseline": old,
+                "ratio": round(ratio, 3) if ratio is not None else None,
+                "status": status,
+            }
+    return comparison, regressions
+
+def environment(executor):
+    return {
+        "python": platform.python_version(),
+        "llvmlite": llvmlite.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "executor": executor,
+        "compiler_version": COMPILER_VERSION,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare it to a baseline.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", action="append", choices=sorted(WORKLOADS),
+                        help="run just this workload (can be given more than once)")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="slowdown, as a fraction, that counts as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.5,
+                        help="smallest slowdown in ms that counts as a regression")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    import app
+    client = app.app.test_client()
+    results = {}
+    try:
+        for name in args.only or WORKLOADS:
+            results[name] = measure(name, WORKLOADS[name], client, args.repeat)
+            print(f"{name:<14}" + "".join(f"{metric}={value:<10}" for metric, value in results[name].items()),
+                  file=sys.stderr)
+    finally:
+        if app.EXECUTOR != "inline":
+            from core.executor import get_pool
+            get_pool().shutdown()
+
+    report = {"environment": environment(app.EXECUTOR), "repeat": args.repeat, "results": results}
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"environment": report["environment"], "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline_environment"] = baseline.get("environment")
+        recorded = (baseline.get("environment") or {}).get("compiler_version")
+        if recorded != COMPILER_VERSION:
+            # Numbers from other generated code say nothing about this one.
+            report["comparison_skipped"] = (f"baseline was recorded with compiler version {recorded}, "
+                                            f"this is {COMPILER_VERSION}; record a new one with --save-baseline")
+            print(f"Not comparing: {report['comparison_skipped']}", file=sys.stderr)
+        else:
+            report["comparison"], regressions = compare(results, baseline["results"], args.threshold,
+                                                        args.min_delta)
+    report["regressions"] = regressions
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(text + "\n")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
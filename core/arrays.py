@@ -0,0 +1,111 @@
+import array
+import base64
+import binascii
+import ctypes
+import os
+import sys
+
+# Longest array a program may allocate with array(n); arrays passed in as
+# input data are not limited.
+MAX_ARRAY_LENGTH = int(os.environ.get("JIT_MAX_ARRAY_LENGTH", str(1 << 24)))
+
+class ArrayDescriptor(ctypes.Structure):
+    # What native code gets for an array, by address as one i64: a pointer
+    # to the first element and the length.
+    _fields_ = [("data", ctypes.c_void_p), ("length", ctypes.c_int64)]
+
+class Array:
+    # A fixed-size array of int64 over a contiguous, writable buffer: an
+    # array.array for arrays the program allocates, or whatever buffer the
+    # caller handed in (a NumPy array, decoded base64 bytes). The
+    # interpreter, native code and numpy() all work on that same memory.
+    __slots__ = ("data", "length", "descriptor")
+
+    def __init__(self, buffer):
+        data = memoryview(buffer)
+        if data.readonly:
+            raise Exception("Arrays need a writable buffer")
+        if data.ndim != 1 or not data.c_contiguous:
+            raise Exception("Arrays must be one-dimensional and contiguous")
+        if data.format != "q":
+            if data.itemsize != 8 or data.format.lstrip("@=") not in ("q", "l"):
+                raise Exception(f"Arrays hold int64 values, not '{data.format}'")
+            data = data.cast("B").cast("q")
+        self.data = data
+        self.length = len(data)
+        self.descriptor = None
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return "[" + ", ".join(map(str, self.data.tolist())) + "]"
+
+    def __repr__(self):
+        return f"Array({self})"
+
+    def address(self):
+        # The buffer never moves or changes size, so one descriptor serves
+        # every native call.
+        if self.descriptor is None:
+            data = ctypes.addressof(ctypes.c_char.from_buffer(self.data)) if self.length else None
+            self.descriptor = ArrayDescriptor(data, self.length)
+        return ctypes.addressof(self.descriptor)
+
+    def numpy(self):
+        # A view, not a copy: writes show up in the array and vice versa.
+        import numpy as np
+
+        return np.frombuffer(self.data, dtype=np.int64)
+
+    def tolist(self):
+        return self.data.tolist()
+
+def new_array(size):
+    # array(size) in a program: size zeros.
+    if size.__class__ is not int or size < 0:
+        raise Exception(f"Array size must be a non-negative integer, got {size}")
+    if size > MAX_ARRAY_LENGTH:
+        raise Exception(f"Array size {size} is over the limit of {MAX_ARRAY_LENGTH}")
+    return Array(array.array("q", [0]) * size)
+
+def index_error(index, length):
+    return Exception(f"Index {index} out of bounds for array of length {length}")
+
+def store_error(value):
+    if value.__class__ is int:
+        return Exception(f"Value {value} does not fit in an int64 array")
+    return Exception("Arrays can only hold integers")
+
+def from_json(value):
+    # An array sent as input data: a list of integers, or {"base64": ...}
+    # holding their bytes (int64, little-endian), which is used as the
+    # array's buffer as-is.
+    if isinstance(value, list):
+        try:
+            return Array(array.array("q", value))
+        except (TypeError, OverflowError):
+            raise Exception("Array elements must be 64-bit integers")
+    if isinstance(value, dict) and isinstance(value.get("base64"), str):
+        try:
+            data = bytearray(base64.b64decode(value["base64"], validate=True))
+        except binascii.Error as e:
+            raise Exception(f"Invalid base64 array data: {e}")
+        if len(data) % 8:
+            raise Exception("base64 array data must be a whole number of 8-byte integers")
+        if sys.byteorder != "little":
+            swapped = array.array("q", data)
+            swapped.byteswap()
+            return Array(swapped)
+        return Array(memoryview(data).cast("q"))
+    raise Exception('Arrays must be lists of integers or {"base64": ...} objects')
+
+def to_json(value, encoding="list"):
+    # The opposite of from_json, in the form encoding asks for.
+    if encoding == "base64":
+        data = value.data
+        if sys.byteorder != "little":
+            data = array.array("q", data.tobytes())
+            data.byteswap()
+        return {"base64": base64.b64encode(data).decode("ascii")}
+    return value.tolist()
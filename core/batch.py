@@ -0,0 +1,58 @@
+import array
+import ctypes
+import numpy as np
+
+from core.runtime import INT64_MAX, INT64_MIN
+
+INT64_PTR = ctypes.POINTER(ctypes.c_int64)
+
+def as_column(values):
+    # Contiguous int64 arrays are used in place; other arrays (other dtypes,
+    # strided views) are converted once here. Lists (from JSON) are checked
+    # first: NumPy's own errors for big or non-integer values say little.
+    if isinstance(values, np.ndarray):
+        return np.ascontiguousarray(values, dtype=np.int64)
+    try:
+        return np.frombuffer(array.array("q", values), dtype=np.int64)
+    except (TypeError, OverflowError):
+        raise Exception("Batch inputs must be arrays of 64-bit integers")
+
+def as_results(func_name, results):
+    try:
+        return np.frombuffer(array.array("q", results), dtype=np.int64)
+    except (TypeError, OverflowError):
+        pass
+    for i, value in enumerate(results):
+        if value.__class__ is not int:
+            raise Exception(f"'{func_name}' returned {value} for row {i}, not an integer")
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise Exception(f"'{func_name}' returned {value} for row {i}, which does not fit in 64 bits")
+    raise Exception(f"'{func_name}' returned results that do not fit in 64 bits")
+
+def as_columns(inputs, nargs, count=None):
+    columns = [as_column(values) for values in inputs]
+    if len(columns) != nargs:
+        raise Exception(f"Expected {nargs} input arrays, got {len(columns)}")
+    for column in columns:
+        if column.ndim != 1:
+            raise Exception("Batch inputs must be one-dimensional arrays")
+    if columns:
+        count = len(columns[0])
+        if any(len(column) != count for column in columns):
+            raise Exception("Batch input arrays must all have the same length")
+    elif count is None:
+        raise Exception("A count is required for functions without parameters")
+    return columns, count
+
+def run_batch(compiled, columns, count, state):
+    # state: the address of the running interpreter's NativeState.
+    out = np.empty(count, dtype=np.int64)
+    pointers = (INT64_PTR * max(len(columns), 1))(*[column.ctypes.data_as(INT64_PTR) for column in columns])
+    compiled.callable(state, pointers, out.ctypes.data_as(INT64_PTR), count)
+    return out
+
+def run_batch_interpreted(call, func_name, columns, count):
+    if not columns:
+        return as_results(func_name, [call(func_name, []) for _ in range(count)])
+    rows = zip(*[column.tolist() for column in columns])
+    return as_results(func_name, [call(func_name, list(row)) for row in rows])
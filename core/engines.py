@@ -0,0 +1,109 @@
+import os
+
+from llvmlite import binding
+
+# "orc" links every compiled function into its own library of an LLJIT
+# instance; "mcjit" adds it to one growing MCJIT engine.
+BACKEND = os.environ.get("JIT_BACKEND", "orc")
+
+class MCJITEngine:
+    # Object code reaches store through MCJIT's object cache hooks, and
+    # cached objects are loaded by handing them back for an empty module.
+    name = "mcjit"
+    unmaps_code = False
+
+    def __init__(self, target_machine, symbols, store=None):
+        for symbol, address in symbols.items():
+            binding.add_symbol(symbol, address)
+        self.engine = binding.create_mcjit_compiler(binding.parse_assembly(""), target_machine)
+        self.store = store
+        self.pending_objects = {}
+        if store is not None:
+            self.engine.set_object_cache(self.store_object, self.find_object)
+
+    def store_object(self, mod, data):
+        # MCJIT calls this after generating code for a module.
+        self.store(mod.name, data)
+
+    def find_object(self, mod):
+        # MCJIT calls this before generating code; returning bytes skips codegen.
+        return self.pending_objects.get(mod.name)
+
+    def add_module(self, mod, symbol, links):
+        # Calls into linked functions resolve by symbol within the engine.
+        self.engine.add_module(mod)
+        self.engine.finalize_object()
+        self.engine.run_static_constructors()
+        return mod
+
+    def add_object(self, name, data, symbol, links):
+        mod = binding.parse_assembly("")
+        mod.name = name
+        self.pending_objects[name] = data
+        try:
+            self.engine.add_module(mod)
+            self.engine.finalize_object()
+        finally:
+            del self.pending_objects[name]
+        if self.engine.get_function_address(symbol) == 0:
+            self.engine.remove_module(mod)
+            raise Exception(f"'{symbol}' missing from object")
+        return mod
+
+    def address(self, handle, symbol):
+        return self.engine.get_function_address(symbol)
+
+    def remove(self, handle):
+        # MCJIT forgets the module but keeps its code mapped, so removing
+        # it is safe even while it runs.
+        self.engine.remove_module(handle)
+
+class OrcEngine:
+    # Each module is compiled to an object and linked as a library of its
+    # own, which exports just its symbol and can be unloaded on its own.
+    name = "orc"
+    unmaps_code = True
+
+    def __init__(self, target_machine, symbols, store=None):
+        self.target_machine = target_machine
+        self.lljit = binding.create_lljit_compiler(target_machine)
+        self.symbols = symbols
+        self.store = store
+        # Library names cannot be reused, even once unloaded.
+        self.libraries = 0
+
+    def add_module(self, mod, symbol, links):
+        data = self.target_machine.emit_object(mod)
+        if self.store is not None:
+            self.store(mod.name, data)
+        return self.add_object(mod.name, data, symbol, links)
+
+    def add_object(self, name, data, symbol, links):
+        # links: handles of the libraries whose functions this one calls.
+        builder = binding.JITLibraryBuilder().add_object_img(data).add_current_process()
+        for handle in links:
+            builder.add_jit_library(handle.name)
+        for runtime_symbol, address in self.symbols.items():
+            builder.import_symbol(runtime_symbol, address)
+        builder.export_symbol(symbol)
+        self.libraries += 1
+        handle = builder.link(self.lljit, f"{name}.{self.libraries}")
+        if not handle[symbol]:
+            handle.close()
+            raise Exception(f"'{symbol}' missing from object")
+        return handle
+
+    def address(self, handle, symbol):
+        return handle[symbol]
+
+    def remove(self, handle):
+        # Unmaps the code; nothing may still be running it.
+        handle.close()
+
+ENGINES = {engine.name: engine for engine in (MCJITEngine, OrcEngine)}
+
+def create_engine(backend, target_machine, symbols, store=None):
+    engine = ENGINES.get(backend)
+    if engine is None:
+        raise Exception(f"Unknown JIT backend '{backend}', expected one of {sorted(ENGINES)}")
+    return engine(target_machine, symbols, store)
@@ -0,0 +1,201 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from core.arrays import from_json, to_json
+from core.interpreter import called_functions, parse_code, eval_program, eval_batch, stream_program
+from core.metrics import registry
+from core.optimizer import OPTIMIZE
+from core.nodes import FunctionDef, iter_tree_lines, render_tree
+from core.runtime import get_shared_jit
+
+# Lines of rendered AST per streamed {"ast_tree": ...} record.
+AST_CHUNK_LINES = 1000
+
+# JIT_PREWARM=1 starts LLVM and the shared engine before a worker takes
+# jobs, and compiles the functions of the program in JIT_PREWARM_CORPUS if
+# set. Otherwise LLVM is only loaded once some function gets hot.
+PREWARM = os.environ.get("JIT_PREWARM", "0") != "0"
+PREWARM_CORPUS = os.environ.get("JIT_PREWARM_CORPUS", "")
+
+class QueueFullError(Exception):
+    pass
+
+# True in pool worker processes, whose metrics travel back with each job.
+in_worker = False
+
+def prewarm(corpus=PREWARM_CORPUS):
+    # Returns the number of corpus functions compiled. Callees go first, as
+    # they would get hot first, so callers link to them natively and match
+    # what requests running the same functions compile.
+    jit = get_shared_jit()
+    if not corpus:
+        return 0
+    with open(corpus) as f:
+        code = f.read()
+    pending = [stmt for stmt in parse_code(code, OPTIMIZE).body if isinstance(stmt, FunctionDef)]
+    compiled = {}
+    while pending:
+        ready = [func for func in pending if called_functions(func.body) - {func.name} <= compiled.keys()]
+        for func in ready or pending[:1]:
+            pending.remove(func)
+            try:
+                compiled[func.name] = jit.compile_function(func, callees=dict(compiled))
+            except Exception as e:
+                print(f"[Prewarm Error] Failed to compile '{func.name}': {e}")
+    return len(compiled)
+
+def warm_worker():
+    global in_worker
+    in_worker = True
+    if PREWARM:
+        prewarm()
+
+def collect_metrics():
+    # What this worker recorded since its last job (including compiles that
+    # finished in the background since), for the web process to merge.
+    # Inline jobs record straight into the web process's registry.
+    return registry.drain() if in_worker else None
+
+def load_arrays(arrays):
+    # Input arrays arrive as JSON and become Arrays here, in the process
+    # that runs the program, so their buffers are decoded only once.
+    return {name: from_json(value) for name, value in (arrays or {}).items()}
+
+def dump_arrays(arrays, array_format):
+    return {name: to_json(value, array_format) for name, value in arrays.items()}
+
+def run_program_job(code, opt_level=None, fuel=None, timeout=None, render_ast=False, tiering=None,
+                    arrays=None, array_format="list"):
+    # The AST is rendered here, when asked for, so the tree itself never has
+    # to be sent back from a worker. It shows the program as written; what
+    # runs is the optimized copy.
+    ast = parse_code(code)
+    output, hot_ops, jit_stats, arrays = eval_program(parse_code(code, OPTIMIZE), opt_level=opt_level,
+                                                      fuel=fuel, timeout=timeout, tiering=tiering,
+                                                      variables=load_arrays(arrays))
+    return (render_tree(ast) if render_ast else None, output, hot_ops, jit_stats,
+            dump_arrays(arrays, array_format), collect_metrics())
+
+def stream_program_job(sink, code, opt_level=None, fuel=None, timeout=None, render_ast=False,
+                       tiering=None, arrays=None, array_format="list"):
+    # Puts {"output": [...]} records on sink while the program runs, then
+    # {"ast_tree": ...} chunks if asked for.
+    ast = parse_code(code)
+    hot_ops, jit_stats, arrays = stream_program(parse_code(code, OPTIMIZE), sink, opt_level=opt_level,
+                                                fuel=fuel, timeout=timeout, tiering=tiering,
+                                                variables=load_arrays(arrays))
+    if render_ast:
+        chunk = []
+        for line in iter_tree_lines(ast):
+            chunk.append(line)
+            if len(chunk) == AST_CHUNK_LINES:
+                sink.put({"ast_tree": "".join(chunk)})
+                chunk = []
+        if chunk:
+            sink.put({"ast_tree": "".join(chunk)})
+    return hot_ops, jit_stats, dump_arrays(arrays, array_format), collect_metrics()
+
+def stream_inline(fn, *args):
+    # ExecutionPool.stream() for callers without a pool: fn runs on a thread.
+    sink = queue.Queue()
+    future = Future()
+    def target():
+        try:
+            future.set_result(fn(sink, *args))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=target, daemon=True).start()
+    return future, sink
+
+def run_batch_job(code, func_name, inputs, count=None, opt_level=None, fuel=None, timeout=None,
+                  tiering=None):
+    ast = parse_code(code, OPTIMIZE)
+    results, output, jit_stats = eval_batch(ast, func_name, inputs, count, opt_level=opt_level,
+                                            fuel=fuel, timeout=timeout, tiering=tiering)
+    return results.tolist(), output, jit_stats, collect_metrics()
+
+class ExecutionPool:
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        # spawn, not fork: the parent is a threaded web server and may hold
+        # LLVM or lock state that must not be copied into children.
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_worker,
+        )
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.manager = None
+
+    def submit(self, fn, *args):
+        # Jobs beyond max_pending (running + queued) are rejected rather than
+        # queued without bound, so callers can shed load.
+        if not self.slots.acquire(blocking=False):
+            raise QueueFullError(f"Execution queue is full ({self.max_pending} jobs pending)")
+        try:
+            future = self.pool.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending += 1
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, future):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def run(self, fn, *args, timeout=None):
+        return self.submit(fn, *args).result(timeout)
+
+    def stream(self, fn, *args):
+        # Like submit, but fn gets a queue as its first argument on which it
+        # can put partial results for the caller while it runs.
+        with self.lock:
+            if self.manager is None:
+                self.manager = multiprocessing.get_context("spawn").Manager()
+        sink = self.manager.Queue()
+        return self.submit(fn, sink, *args), sink
+
+    def start(self):
+        # Starts every worker, and waits for them to finish warm_worker, so
+        # the first requests do not pay for it. Returns the worker count.
+        futures = [self.pool.submit(os.getpid) for _ in range(self.workers)]
+        return len({future.result() for future in futures})
+
+    def stats(self):
+        with self.lock:
+            pending = self.pending
+        return {"workers": self.workers, "pending": pending, "max_pending": self.max_pending}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        if self.manager is not None:
+            self.manager.shutdown()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool_stats():
+    # None until the first job has started the pool.
+    with _pool_lock:
+        return _pool.stats() if _pool is not None else None
+
+def get_pool():
+    # Created on first use so importing the app (or the debug reloader's
+    # watcher process) does not start workers.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get("JIT_WORKERS", "0")) or None
+            max_pending = int(os.environ.get("JIT_MAX_PENDING", "0")) or None
+            _pool = ExecutionPool(workers, max_pending)
+        return _pool
@@ -1,197 +1,184 @@
+import ctypes
+import hashlib
+import operator
 import re
-from core.jit_compiler import JITCompiler
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from core.arrays import Array, index_error, new_array, store_error
+from core.runtime import (
+    BACKGROUND_COMPILE, DEFAULT_OPT_LEVEL, NATIVE_BUDGET_INTERVAL, OPT_LEVELS, Deoptimized, NativeState,
+    estimate_compile_time, get_compile_executor, get_shared_jit, running,
+)
+from core.metrics import registry
+from core.tiering import FunctionProfile, TieringPolicy
+from core.nodes import (
+    Node, Number, Variable, BinaryOp, Assign, Print, If, While, FunctionDef, FunctionCall, Return, Program,
+    NewArray, Index, IndexAssign, Length,
+    OP_NUMBER, OP_VARIABLE, OP_BINARY_OP, OP_FUNCTION_CALL, OP_ASSIGN, OP_PRINT, OP_IF, OP_WHILE,
+    OP_FUNCTION_DEF, OP_RETURN, OP_NEW_ARRAY, OP_INDEX, OP_INDEX_ASSIGN, OP_LENGTH, to_dict, walk,
+)
+
+NUMBER, NAME, SYMBOL, UNKNOWN, END = 1, 2, 3, 4, 0
+
+TOKEN_PATTERN = re.compile(r"\d+|[a-zA-Z_]\w*|==|!=|<=|>=|[+\-*/(){}\[\]<>=;,]|\S")
+
+# Every token kind except the odd ones out ("!=" and non-ASCII digits) can
+# be told from its first character.
+FIRST_CHAR_KINDS = {}
+for c in "0123456789":
+    FIRST_CHAR_KINDS[c] = NUMBER
+for c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_":
+    FIRST_CHAR_KINDS[c] = NAME
+for c in "+-*/(){}[]<>=;,":
+    FIRST_CHAR_KINDS[c] = SYMBOL
+
+def token_kind(token):
+    if token == "!=":
+        return SYMBOL
+    if token.isdigit():
+        return NUMBER
+    return UNKNOWN
 
 def tokenize(code):
-    token_spec = r'\d+|[a-zA-Z_]\w*|==|!=|<=|>=|[+\-*/(){}<>=;,]|.'
-    tokens = re.findall(token_spec, code)
-    tokens = [t for t in tokens if t.strip() != '']
-    return tokens
+    # One findall over the source; whitespace never matches. Returns
+    # parallel lists of kinds and texts. Source offsets are only needed for
+    # error messages, so token_offset() recovers them on demand.
+    values = TOKEN_PATTERN.findall(code)
+    get_kind = FIRST_CHAR_KINDS.get
+    kinds = [get_kind(value[0]) or token_kind(value) for value in values]
+    return kinds, values
 
-class Number:
-    def __init__(self, value):
-        self.value = value
-    def __repr__(self):
-        return f"Number({self.value})"
-
-class Variable:
-    def __init__(self, name):
-        self.name = name
-    def __repr__(self):
-        return f"Variable({self.name})"
-
-class BinaryOp:
-    def __init__(self, op, left, right):
-        self.op = op
-        self.left = left
-        self.right = right
-    def __repr__(self):
-        return f"BinaryOp({self.op}, {self.left}, {self.right})"
-
-class Assign:
-    def __init__(self, var, expr):
-        self.var = var
-        self.expr = expr
-    def __repr__(self):
-        return f"Assign({self.var}, {self.expr})"
-
-class Print:
-    def __init__(self, expr):
-        self.expr = expr
-    def __repr__(self):
-        return f"Print({self.expr})"
-
-class If:
-    def __init__(self, cond, body, else_body=None):
-        self.cond = cond
-        self.body = body
-        self.else_body = else_body
-    def __repr__(self):
-        return f"If({self.cond}, {self.body}, Else: {self.else_body})"
-
-class While:
-    def __init__(self, cond, body):
-        self.cond = cond
-        self.body = body
-    def __repr__(self):
-        return f"While({self.cond}, {self.body})"
-
-class FunctionDef:
-    def __init__(self, name, params, body):
-        self.name = name
-        self.params = params
-        self.body = body
-    def __repr__(self):
-        return f"FunctionDef({self.name}, {self.params}, {self.body})"
-
-class FunctionCall:
-    def __init__(self, name, args):
-        self.name = name
-        self.args = args
-    def __repr__(self):
-        return f"FunctionCall({self.name}, {self.args})"
-
-class Return:
-    def __init__(self, expr):
-        self.expr = expr
-    def __repr__(self):
-        return f"Return({self.expr})"
+def token_offset(code, index):
+    for i, match in enumerate(TOKEN_PATTERN.finditer(code)):
+        if i == index:
+            return match.start()
+    return len(code)
 
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
+    def __init__(self, tokens, source=""):
+        kinds, values = tokens
+        # A sentinel END token saves a bounds check on every lookahead.
+        self.kinds = kinds + [END]
+        self.values = values + [None]
+        self.source = source
         self.pos = 0
 
     def current(self):
-        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        return self.values[self.pos]
 
     def eat(self, token=None):
-        cur = self.current()
+        cur = self.values[self.pos]
         if token and cur != token:
-            raise Exception(f"Expected '{token}', got '{cur}'")
+            if cur is None:
+                raise self.error(f"Expected '{token}', got end of input")
+            raise self.error(f"Expected '{token}', got '{cur}'")
+        if cur is None:
+            raise self.error("Unexpected end of input")
         self.pos += 1
         return cur
 
+    def error(self, message):
+        offset = token_offset(self.source, self.pos)
+        line = self.source.count("\n", 0, offset) + 1
+        column = offset - self.source.rfind("\n", 0, offset)
+        return Exception(f"{message} at line {line}, column {column}")
+
     def parse(self):
         stmts = []
-        while self.current() is not None:
+        while self.kinds[self.pos] != END:
             stmts.append(self.parse_stmt())
-        return {
-            "type": "program",
-            "body": stmts
-        }
+        return Program(stmts)
 
     def parse_stmt(self):
-        cur = self.current()
-        if cur == "if":
-            return self.parse_if()
-        elif cur == "def":
-            return self.parse_function_def()
-        elif cur == "return":
-            return self.parse_return()
-        elif cur == "while":
-            return self.parse_while()
-        elif cur == "print":
-            return self.parse_print()
-        else:
-            return self.parse_assign()
+        if self.kinds[self.pos] == NAME:
+            parse = STATEMENT_PARSERS.get(self.values[self.pos])
+            if parse is not None:
+                return parse(self)
+        return self.parse_assign()
+
+    def parse_block(self):
+        self.eat("{")
+        body = []
+        values = self.values
+        while values[self.pos] != "}":
+            body.append(self.parse_stmt())
+        self.pos += 1
+        return body
 
     def parse_if(self):
-        self.eat("if")
+        self.pos += 1
         self.eat("(")
         cond = self.parse_expr()
         self.eat(")")
-        self.eat("{")
-        body = []
-        while self.current() != "}":
-            body.append(self.parse_stmt())
-        self.eat("}")
+        body = self.parse_block()
 
         else_body = None
-        if self.current() == "else":
-            self.eat("else")
-            self.eat("{")
-            else_body = []
-            while self.current() != "}":
-                else_body.append(self.parse_stmt())
-            self.eat("}")
+        if self.values[self.pos] == "else":
+            self.pos += 1
+            else_body = self.parse_block()
 
-        return {"type": "if", "cond": cond, "body": body, "else_body": else_body}
+        return If(cond, body, else_body)
 
     def parse_function_def(self):
-        self.eat("def")
+        self.pos += 1
         name = self.eat()
+        if name in BUILTIN_FUNCTIONS:
+            raise self.error(f"'{name}' is a built-in function")
         self.eat("(")
         params = []
-        while self.current() != ")":
+        while self.values[self.pos] != ")":
             params.append(self.eat())
-            if self.current() == ",":
-                self.eat(",")
-        self.eat(")")
-        self.eat("{")
-        body = []
-        while self.current() != "}":
-            body.append(self.parse_stmt())
-        self.eat("}")
-        return {"type": "function_def", "name": name, "params": params, "body": body}
+            if self.values[self.pos] == ",":
+                self.pos += 1
+        self.pos += 1
+        body = self.parse_block()
+        return FunctionDef(name, params, body)
 
     def parse_return(self):
-        self.eat("return")
+        self.pos += 1
         expr = self.parse_expr()
         self.eat(";")
-        return {"type": "return", "expr": expr}
+        return Return(expr)
 
     def parse_while(self):
-        self.eat("while")
+        self.pos += 1
         self.eat("(")
         cond = self.parse_expr()
         self.eat(")")
-        self.eat("{")
-        body = []
-        while self.current() != "}":
-            body.append(self.parse_stmt())
-        self.eat("}")
-        return {"type": "while", "cond": cond, "body": body}
+        body = self.parse_block()
+        return While(cond, body)
 
     def parse_print(self):
-        self.eat("print")
+        self.pos += 1
         self.eat("(")
         expr = self.parse_expr()
         self.eat(")")
         self.eat(";")
-        return {"type": "print", "expr": expr}
+        return Print(expr)
 
     def parse_assign(self):
-        var = self.eat()
-        if not re.match(r"[a-zA-Z_]\w*", var):
-            raise Exception(f"Invalid variable name {var}")
+        if self.kinds[self.pos] != NAME:
+            if self.kinds[self.pos] == END:
+                raise self.error("Unexpected end of input")
+            raise self.error(f"Invalid variable name {self.values[self.pos]}")
+        var = self.values[self.pos]
+        self.pos += 1
+        if self.values[self.pos] == "[":
+            self.pos += 1
+            index = self.parse_expr()
+            self.eat("]")
+            self.eat("=")
+            expr = self.parse_expr()
+            self.eat(";")
+            return IndexAssign(var, index, expr)
         self.eat("=")
         expr = self.parse_expr()
         self.eat(";")
-        return {
-            "type": "assign",
-            "var": var,
-            "expr": expr
-        }
+        return Assign(var, expr)
 
 
     def parse_expr(self):
@@ -199,184 +186,1152 @@ class Parser:
 
     def parse_rel(self):
         node = self.parse_add()
-        while self.current() in ("==", "!=", "<", ">", "<=", ">="):
-            op = self.eat()
+        values = self.values
+        while values[self.pos] in REL_OPS:
+            op = values[self.pos]
+            self.pos += 1
             right = self.parse_add()
-            node = {"type": "binary_op", "op": op, "left": node, "right": right}
+            node = BinaryOp(op, node, right)
         return node
 
     def parse_add(self):
         node = self.parse_mul()
-        while self.current() in ("+", "-"):
-            op = self.eat()
+        values = self.values
+        while values[self.pos] in ADD_OPS:
+            op = values[self.pos]
+            self.pos += 1
             right = self.parse_mul()
-            node = {"type": "binary_op", "op": op, "left": node, "right": right}
+            node = BinaryOp(op, node, right)
         return node
 
     def parse_mul(self):
         node = self.parse_factor()
-        while self.current() in ("*", "/"):
-            op = self.eat()
+        values = self.values
+        while values[self.pos] in MUL_OPS:
+            op = values[self.pos]
+            self.pos += 1
             right = self.parse_factor()
-            node = {"type": "binary_op", "op": op, "left": node, "right": right}
+            node = BinaryOp(op, node, right)
         return node
 
     def parse_factor(self):
-        cur = self.current()
-        if cur == "(":
-            self.eat("(")
+        pos = self.pos
+        kind = self.kinds[pos]
+        cur = self.values[pos]
+        if kind == NUMBER:
+            self.pos = pos + 1
+            return Number(int(cur))
+        elif kind == NAME:
+            self.pos = pos + 1
+            after = self.values[pos + 1]
+            if after == "[":
+                self.pos += 1
+                index = self.parse_expr()
+                self.eat("]")
+                return Index(cur, index)
+            if after == "(":
+                self.pos += 1
+                builtin = BUILTIN_FUNCTIONS.get(cur)
+                if builtin is not None:
+                    arg = self.parse_expr()
+                    self.eat(")")
+                    return builtin(arg)
+                args = []
+                while self.values[self.pos] != ")":
+                    args.append(self.parse_expr())
+                    if self.values[self.pos] == ",":
+                        self.pos += 1
+                self.pos += 1
+                return FunctionCall(cur, args)
+            return Variable(cur)
+        elif cur == "(":
+            self.pos = pos + 1
             node = self.parse_expr()
             self.eat(")")
             return node
-        elif cur is not None and cur.isdigit():
-            val = int(self.eat())
-            return {"type": "number", "value": val}
-        elif cur is not None and re.match(r"[a-zA-Z_]\w*", cur):
-            name = self.eat()
-            if self.current() == "(":  
-                self.eat("(")
-                args = []
-                while self.current() != ")":
-                    args.append(self.parse_expr())
-                    if self.current() == ",":
-                        self.eat(",")
-                self.eat(")")
-                return {"type": "function_call", "name": name, "args": args}
+        elif kind == END:
+            raise self.error("Unexpected end of input")
+        else:
+            raise self.error(f"Unexpected token {cur}")
+
+STATEMENT_PARSERS = {
+    "if": Parser.parse_if,
+    "def": Parser.parse_function_def,
+    "return": Parser.parse_return,
+    "while": Parser.parse_while,
+    "print": Parser.parse_print,
+}
+
+# array(n) allocates n zeros and len(a) is a's length. Their names are
+# reserved: a program cannot define functions called that.
+BUILTIN_FUNCTIONS = {"array": NewArray, "len": Length}
+
+REL_OPS = frozenset(("==", "!=", "<", ">", "<=", ">="))
+ADD_OPS = frozenset(("+", "-"))
+MUL_OPS = frozenset(("*", "/"))
+
+# Native calls are timed for the speedup report until this many have been
+# made; after that they go through the untimed fast path.
+NATIVE_SAMPLE_CALLS = 100
+
+# A function whose native code bails out this many times goes back to the
+# interpreter for good.
+MAX_DEOPTS = 10
+
+# Interpreted work between two fuel/deadline checks.
+BUDGET_CHECK_INTERVAL = 1024
+
+# An interpreted call nests about six Python frames (the block, statement
+# and expression closures, call_function and dispatch_call) where the tree
+# walker before it took three, so the recursion limit is raised to keep the
+# call depth programs had then: some 400 calls deep, more for simple bodies.
+# Calls between Python frames use no C stack, and native code has its own
+# limit (NATIVE_STACK_BYTES).
+RECURSION_LIMIT = 3000
+if sys.getrecursionlimit() < RECURSION_LIMIT:
+    sys.setrecursionlimit(RECURSION_LIMIT)
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+def loop_variables(stmt):
+    names = set()
+    assigned = set()
+    for node in walk(stmt):
+        t = node.tag
+        if t == OP_VARIABLE:
+            names.add(node.name)
+        elif t == OP_ASSIGN:
+            names.add(node.var)
+            assigned.add(node.var)
+        elif t == OP_INDEX or t == OP_INDEX_ASSIGN:
+            # Writing an element leaves the variable itself as it was.
+            names.add(node.var)
+    return sorted(names), assigned
+
+def fits_int64(values):
+    # ctypes wraps larger ints silently, so they must not reach native code
+    # (nor must arrays, unless native code takes one there).
+    for value in values:
+        if value.__class__ is not int or not INT64_MIN <= value <= INT64_MAX:
+            return False
+    return True
+
+def native_arguments(args, compiled):
+    # args as compiled code takes them, or None if they do not fit. Missing
+    # arguments are 0 and extra ones are dropped, as in the interpreter;
+    # arrays go where the code takes them, as their descriptor's address.
+    nargs = compiled.nargs
+    if len(args) != nargs:
+        args = (args + [0] * nargs)[:nargs]
+    arrays = compiled.arrays
+    if not arrays:
+        return args if fits_int64(args) else None
+    native = []
+    for i, value in enumerate(args):
+        if i in arrays:
+            if value.__class__ is not Array:
+                return None
+            native.append(value.address())
+        elif value.__class__ is not int or not INT64_MIN <= value <= INT64_MAX:
+            return None
+        else:
+            native.append(value)
+    return native
+
+class Scope:
+    # Resolver pass: a fixed frame slot for every variable of a function
+    # body (or the top level), so frames are plain lists. Parameters come
+    # first, in order, so a call's argument list is the start of its frame;
+    # the last slot holds the return value. Nested function definitions are
+    # scopes of their own.
+    def __init__(self, params, body):
+        slots = {}
+        for i, param in enumerate(params):
+            slots[param] = i
+        size = len(params)
+        stack = [body]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+                continue
+            t = node.tag
+            if t == OP_FUNCTION_DEF:
+                continue
+            if t == OP_VARIABLE:
+                name = node.name
+            elif t == OP_ASSIGN or t == OP_INDEX or t == OP_INDEX_ASSIGN:
+                name = node.var
             else:
-                return {"type": "variable", "name": name}
+                name = None
+            if name is not None and name not in slots:
+                slots[name] = size
+                size += 1
+            for field in reversed(node.__slots__):
+                value = getattr(node, field)
+                if isinstance(value, (list, Node)):
+                    stack.append(value)
+        self.slots = slots
+        self.params = len(params)
+        self.return_slot = size
+        self.size = size + 1
+        # Appended to a call's arguments to make its frame.
+        self.padding = [0] * (self.size - self.params)
+
+    def new_frame(self, args):
+        n = self.params
+        if len(args) == n:
+            return args + self.padding
+        # Missing parameters are 0 and extra arguments are ignored.
+        frame = args[:n]
+        frame += [0] * (self.size - len(frame))
+        return frame
+
+def called_functions(node):
+    return {n.name for n in walk(node) if n.tag == OP_FUNCTION_CALL}
+
+def divide(a, b):
+    return a // b if b != 0 else 0
+
+BINARY_OPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    "==": lambda a, b: 1 if a == b else 0,
+    "!=": lambda a, b: 1 if a != b else 0,
+    "<": lambda a, b: 1 if a < b else 0,
+    ">": lambda a, b: 1 if a > b else 0,
+    "<=": lambda a, b: 1 if a <= b else 0,
+    ">=": lambda a, b: 1 if a >= b else 0,
+}
+
+# Closure factories with the operator already bound, one table per operand
+# shape: (closure, closure), (closure, constant) and (variable slot,
+# constant).
+BINARY_CLOSURES = {
+    "+": lambda l, r: lambda frame: l(frame) + r(frame),
+    "-": lambda l, r: lambda frame: l(frame) - r(frame),
+    "*": lambda l, r: lambda frame: l(frame) * r(frame),
+    "/": lambda l, r: lambda frame: divide(l(frame), r(frame)),
+    "==": lambda l, r: lambda frame: 1 if l(frame) == r(frame) else 0,
+    "!=": lambda l, r: lambda frame: 1 if l(frame) != r(frame) else 0,
+    "<": lambda l, r: lambda frame: 1 if l(frame) < r(frame) else 0,
+    ">": lambda l, r: lambda frame: 1 if l(frame) > r(frame) else 0,
+    "<=": lambda l, r: lambda frame: 1 if l(frame) <= r(frame) else 0,
+    ">=": lambda l, r: lambda frame: 1 if l(frame) >= r(frame) else 0,
+}
+
+BINARY_CONST_CLOSURES = {
+    "+": lambda l, c: lambda frame: l(frame) + c,
+    "-": lambda l, c: lambda frame: l(frame) - c,
+    "*": lambda l, c: lambda frame: l(frame) * c,
+    "/": lambda l, c: (lambda frame: l(frame) // c) if c != 0 else (lambda frame: divide(l(frame), c)),
+    "==": lambda l, c: lambda frame: 1 if l(frame) == c else 0,
+    "!=": lambda l, c: lambda frame: 1 if l(frame) != c else 0,
+    "<": lambda l, c: lambda frame: 1 if l(frame) < c else 0,
+    ">": lambda l, c: lambda frame: 1 if l(frame) > c else 0,
+    "<=": lambda l, c: lambda frame: 1 if l(frame) <= c else 0,
+    ">=": lambda l, c: lambda frame: 1 if l(frame) >= c else 0,
+}
+
+VAR_CONST_CLOSURES = {
+    "+": lambda n, c: lambda frame: frame[n] + c,
+    "-": lambda n, c: lambda frame: frame[n] - c,
+    "*": lambda n, c: lambda frame: frame[n] * c,
+    "/": lambda n, c: (lambda frame: frame[n] // c) if c != 0 else (lambda frame: 0),
+    "==": lambda n, c: lambda frame: 1 if frame[n] == c else 0,
+    "!=": lambda n, c: lambda frame: 1 if frame[n] != c else 0,
+    "<": lambda n, c: lambda frame: 1 if frame[n] < c else 0,
+    ">": lambda n, c: lambda frame: 1 if frame[n] > c else 0,
+    "<=": lambda n, c: lambda frame: 1 if frame[n] <= c else 0,
+    ">=": lambda n, c: lambda frame: 1 if frame[n] >= c else 0,
+}
+
+class BudgetExceeded(Exception):
+    def __init__(self, limit, value, used):
+        super().__init__(limit, value, used)
+        self.limit = limit
+        self.value = value
+        self.used = used
+
+    def __str__(self):
+        if self.limit == "fuel":
+            return f"Execution budget exceeded: used {self.used} of {self.value} fuel"
+        return f"Execution timed out after {self.used:.3f}s (limit {self.value}s)"
+
+    def to_dict(self):
+        return {"limit": self.limit, "value": self.value, "used": self.used}
+
+class OutputStream:
+    # Stands in for Interpreter.output when lines should reach the caller
+    # while the program runs: they are buffered and handed to sink.put() as
+    # {"output": [...]} once enough accumulate or max_delay has passed.
+    def __init__(self, sink, max_lines=256, max_delay=0.05):
+        self.sink = sink
+        self.max_lines = max_lines
+        self.max_delay = max_delay
+        self.lines = []
+        self.flushed = 0
+        # Lines to drop because they were sent before a rewind and the
+        # rerun prints them again.
+        self.skip = 0
+        self.last_flush = time.perf_counter()
+
+    def __len__(self):
+        return self.flushed + len(self.lines) - self.skip
+
+    def append(self, line):
+        if self.skip:
+            self.skip -= 1
+            return
+        self.lines.append(line)
+        if len(self.lines) >= self.max_lines:
+            self.flush()
+
+    def tick(self):
+        if self.lines and time.perf_counter() - self.last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.sink.put({"output": self.lines})
+            self.flushed += len(self.lines)
+            self.lines = []
+        self.last_flush = time.perf_counter()
+
+    def rewind(self, count):
+        # Forgets the lines after the first count.
+        if count >= self.flushed:
+            del self.lines[count - self.flushed:]
         else:
-            raise Exception(f"Unexpected token {cur}")
+            self.lines = []
+            self.skip = self.flushed - count
 
 class Interpreter:
-    def __init__(self, ast):
+    def __init__(self, ast, jit=None, opt_level=None, fuel=None, timeout=None, output_sink=None,
+                 tiering=None, background_compile=None, variables=None):
+        if opt_level is not None and opt_level not in OPT_LEVELS:
+            raise Exception(f"Invalid optimization level {opt_level}, expected one of {OPT_LEVELS}")
+        if fuel is not None and fuel < 0:
+            raise Exception("fuel must not be negative")
+        if timeout is not None and timeout <= 0:
+            raise Exception("timeout must be positive")
         self.ast = ast
-        self.env = {}
+        # Frame of the top-level code; function frames are made per call.
+        self.scope = Scope((), ast.body)
+        self.env = [0] * self.scope.size
+        # Top-level variables set before the program runs (input arrays);
+        # names the program never mentions are ignored.
+        for name, value in (variables or {}).items():
+            slot = self.scope.slots.get(name)
+            if slot is not None:
+                self.env[slot] = value
         self.output = []
+        self.output_stream = None
+        if output_sink is not None:
+            self.output = self.output_stream = OutputStream(output_sink)
         self.functions = {}
-        self.call_counts = {}  
-        self.hot_threshold = 10 
-        self.jit = JITCompiler()
+        self.profiles = {}
+        self.tiering = tiering if tiering is not None else TieringPolicy()
+        # Without a jit, the process's shared one, which is only started
+        # (LLVM and all) once something gets hot: see load_jit.
+        self.jit = jit if jit is not None else get_shared_jit(create=False)
         self.compiled_functions = {}
+        # name -> [(arg index, value)] for functions compiled with constant
+        # arguments.
+        self.specializations = {}
+        # name -> (future, guards, function_generation) for compiles that
+        # have been started but not installed yet.
+        self.pending_compiles = {}
+        self.background_compile = BACKGROUND_COMPILE if background_compile is None else background_compile
+        self.native_functions = {}
+        self.lowered_functions = {}
+        self.jit_failures = set()
+        self.native_error = None
+        # Native code run for this interpreter gets the state's address.
+        self.native_state = NativeState()
+        self.state_address = ctypes.addressof(self.native_state)
+        self.function_generation = 0
+        self.opt_level = opt_level
+        self.lowering_function = None
+        self.compile_time = 0.0
+        self.loop_threshold = 1000
+        self.compiled_loops = 0
+        self.deopts = 0
+        # What record_metrics() has already reported: name -> (profile,
+        # interpreted calls, interpreted time, native calls), then deopts
+        # and compiled loops.
+        self.reported = {}
+        self.reported_deopts = 0
+        self.reported_loops = 0
+        self.reset_budget(fuel, timeout)
 
-    class ReturnException(Exception):
-        def __init__(self, value):
-            self.value = value
-
-    def eval_expr(self, expr, env):
-        t = expr["type"]
-        if t == "number":
-            return expr["value"]
-        elif t == "variable":
-            return env.get(expr["name"], 0)
-        elif t == "binary_op":
-            left = self.eval_expr(expr["left"],env)
-            right = self.eval_expr(expr["right"],env)
-            op = expr["op"]
-            if op == "+":
-                return left + right
-            elif op == "-":
-                return left - right
-            elif op == "*":
-                return left * right
-            elif op == "/":
-                return left // right if right != 0 else 0
-            elif op == "==":
-                return 1 if left == right else 0
-            elif op == "!=":
-                return 1 if left != right else 0
-            elif op == "<":
-                return 1 if left < right else 0
-            elif op == ">":
-                return 1 if left > right else 0
-            elif op == "<=":
-                return 1 if left <= right else 0
-            elif op == ">=":
-                return 1 if left >= right else 0
+    def reset_budget(self, fuel, timeout):
+        # Fuel is spent one unit per loop iteration and per interpreted call.
+        # budget_ticks counts down to the next check_budget(), which settles
+        # the fuel used so far and looks at the clock.
+        self.fuel = fuel
+        self.fuel_used = 0
+        self.timeout = timeout
+        self.started = time.perf_counter()
+        self.deadline = self.started + timeout if timeout is not None else None
+        self.budget_window = self.budget_ticks = 1
+        self.check_budget()
+
+    def lower_expr(self, expr):
+        t = expr.tag
+        if t == OP_NUMBER:
+            value = expr.value
+            return lambda frame: value
+        elif t == OP_VARIABLE:
+            slot = self.scope.slots[expr.name]
+            return lambda frame: frame[slot]
+        elif t == OP_BINARY_OP:
+            return self.lower_binary_op(expr)
+        elif t == OP_FUNCTION_CALL:
+            name = expr.name
+            args = tuple(self.lower_expr(arg) for arg in expr.args)
+            call = self.call_function
+            if len(args) == 0:
+                return lambda frame: call(name, [])
+            elif len(args) == 1:
+                arg0 = args[0]
+                return lambda frame: call(name, [arg0(frame)])
+            elif len(args) == 2:
+                arg0, arg1 = args
+                return lambda frame: call(name, [arg0(frame), arg1(frame)])
+            return lambda frame: call(name, [arg(frame) for arg in args])
+        elif t == OP_INDEX:
+            name = expr.var
+            slot = self.scope.slots[name]
+            index = self.lower_expr(expr.index)
+            def load(frame):
+                i = index(frame)
+                array = frame[slot]
+                if array.__class__ is not Array:
+                    raise Exception(f"'{name}' is not an array")
+                if 0 <= i < array.length:
+                    return array.data[i]
+                raise index_error(i, array.length)
+            return load
+        elif t == OP_LENGTH:
+            value = self.lower_expr(expr.expr)
+            def length(frame):
+                array = value(frame)
+                if array.__class__ is not Array:
+                    raise Exception(f"len() needs an array, got {array}")
+                return array.length
+            return length
+        elif t == OP_NEW_ARRAY:
+            size = self.lower_expr(expr.size)
+            return lambda frame: new_array(size(frame))
+        else:
+            raise Exception(f"Unknown expr type {expr.type}")
+
+    def lower_binary_op(self, expr):
+        op = expr.op
+        if op not in BINARY_OPS:
+            raise Exception(f"Unknown op {op}")
+        left, right = expr.left, expr.right
+        # Leaf operands are read inline so the common `i < n`, `i + 1`
+        # shapes cost one closure call per evaluation instead of three.
+        if right.tag == OP_NUMBER:
+            if left.tag == OP_VARIABLE:
+                return VAR_CONST_CLOSURES[op](self.scope.slots[left.name], right.value)
+            return BINARY_CONST_CLOSURES[op](self.lower_expr(left), right.value)
+        if left.tag == OP_VARIABLE and right.tag == OP_VARIABLE:
+            fn = BINARY_OPS[op]
+            slot, other = self.scope.slots[left.name], self.scope.slots[right.name]
+            return lambda frame: fn(frame[slot], frame[other])
+        return BINARY_CLOSURES[op](self.lower_expr(left), self.lower_expr(right))
+
+    # Lowered statements return None, or True once a return statement has
+    # stored the function's result in its frame's return slot, which tells
+    # the enclosing blocks and loops to stop.
+    def lower_stmt(self, stmt):
+        t = stmt.tag
+        if t == OP_ASSIGN:
+            slot = self.scope.slots[stmt.var]
+            value = self.lower_expr(stmt.expr)
+            def assign(frame):
+                frame[slot] = value(frame)
+            return assign
+        elif t == OP_INDEX_ASSIGN:
+            # The index is evaluated before the value, as native code does.
+            name = stmt.var
+            slot = self.scope.slots[name]
+            index = self.lower_expr(stmt.index)
+            value = self.lower_expr(stmt.expr)
+            def index_assign(frame):
+                i = index(frame)
+                v = value(frame)
+                array = frame[slot]
+                if array.__class__ is not Array:
+                    raise Exception(f"'{name}' is not an array")
+                if not 0 <= i < array.length:
+                    raise index_error(i, array.length)
+                try:
+                    array.data[i] = v
+                except (TypeError, ValueError):
+                    raise store_error(v)
+            return index_assign
+        elif t == OP_PRINT:
+            value = self.lower_expr(stmt.expr)
+            append = self.output.append
+            def print_stmt(frame):
+                append(str(value(frame)))
+            return print_stmt
+        elif t == OP_IF:
+            cond = self.lower_expr(stmt.cond)
+            body = self.lower_block(stmt.body)
+            else_body = None
+            if stmt.else_body is not None:
+                else_body = self.lower_block(stmt.else_body)
+            def if_stmt(frame):
+                if cond(frame):
+                    return body(frame)
+                elif else_body is not None:
+                    return else_body(frame)
+            return if_stmt
+        elif t == OP_WHILE:
+            cond = self.lower_expr(stmt.cond)
+            body = self.lower_block(stmt.body)
+            owner = self.lowering_function
+            callees = called_functions(stmt)
+            backedges = 0
+            native = None
+            if any(node.tag == OP_FUNCTION_DEF or node.tag == OP_RETURN for node in walk(stmt.body)):
+                # The JIT compiles neither definitions nor returns out of a
+                # loop, so such loops stay interpreted.
+                native = False
             else:
-                raise Exception(f"Unknown op {op}")
-        elif t == "function_call":
-            func_name = expr["name"]
-            func = self.functions.get(func_name)
-            if not func:
-                raise Exception(f"Function {func_name} not defined")
-
-            self.call_counts[func_name] = self.call_counts.get(func_name, 0) + 1
-            if self.call_counts[func_name] == self.hot_threshold:
-                func_ptr = self.jit.compile_function(func)
-                callable_fn = self.jit.get_callable(func_name)
-                self.compiled_functions[func_name] = callable_fn
-            if func_name in self.compiled_functions:
-                args = [self.eval_expr(arg, env) for arg in expr["args"]]
-                while len(args) < 5:
-                    args.append(0)
-                result = self.compiled_functions[func_name](*args[:5])
+                names, assigned = loop_variables(stmt)
+                slots = self.scope.slots
+                loop_slots = [slots[name] for name in names]
+                writeback = [(i, slots[name]) for i, name in enumerate(names) if name in assigned]
+            def while_stmt(frame):
+                nonlocal backedges, native
+                if native is not None:
+                    if native is not False and native[3] != self.function_generation:
+                        # A function was redefined; the loop may link to
+                        # the old native code, so compile it again.
+                        native = self.compile_loop(stmt, names, loop_slots, writeback)
+                    native = self.poll_loop(native)
+                    ran = self.run_native_loop(native, frame)
+                    if ran:
+                        return
+                    if ran is None:
+                        native = False
+                # Stop at whichever comes first, the OSR threshold or the
+                # next budget check, so the loop still tests one counter.
+                hot = self.loop_threshold - backedges if native is None else 0
+                ticks = self.budget_ticks
+                stop = hot if 0 < hot < ticks else ticks
+                n = charged = 0
+                returned = None
+                while cond(frame):
+                    if body(frame):
+                        returned = True
+                        break
+                    n += 1
+                    if n == stop:
+                        self.budget_ticks -= n - charged
+                        charged = n
+                        if self.budget_ticks <= 0:
+                            self.check_budget()
+                        if native is None and n >= hot and not self.compiles_pending(callees):
+                            # Hot loop: compile it with the live variables as
+                            # inputs and continue from the loop header natively
+                            # as soon as the code is ready.
+                            native = self.compile_loop(stmt, names, loop_slots, writeback)
+                        if native is not None:
+                            native = self.poll_loop(native)
+                            ran = self.run_native_loop(native, frame)
+                            if ran:
+                                backedges += n
+                                return
+                            if ran is None:
+                                # It bailed out; this loop stays interpreted.
+                                native = False
+                        stop = n + self.budget_ticks
+                        if native is None and n < hot < stop:
+                            stop = hot
+                backedges += n
+                if owner is not None:
+                    profile = self.profiles.get(owner)
+                    if profile is not None:
+                        profile.loop_iterations += n
+                self.budget_ticks -= n - charged
+                if self.budget_ticks <= 0:
+                    self.check_budget()
+                return returned
+            return while_stmt
+        elif t == OP_FUNCTION_DEF:
+            name = stmt.name
+            # The body gets its own frame layout, and its loops count
+            # towards this function's profile.
+            outer = self.lowering_function, self.scope
+            self.lowering_function = name
+            self.scope = scope = Scope(stmt.params, stmt.body)
+            try:
+                body = self.lower_block(stmt.body)
+            finally:
+                self.lowering_function, self.scope = outer
+            lowered = (body, scope)
+            def function_def(frame):
+                previous = self.functions.get(name)
+                if previous is stmt:
+                    return
+                if previous is not None:
+                    self.function_generation += 1
+                self.functions[name] = stmt
+                self.lowered_functions[name] = lowered
+                self.profiles.pop(name, None)
+                self.forget_compiled(name)
+                self.jit_failures.discard(name)
+            return function_def
+        elif t == OP_RETURN:
+            value = self.lower_expr(stmt.expr)
+            slot = self.scope.return_slot
+            def return_stmt(frame):
+                frame[slot] = value(frame)
+                return True
+            return return_stmt
+        else:
+            raise Exception(f"Unknown stmt type {stmt.type}")
+
+    def lower_block(self, stmts):
+        stmts = tuple(self.lower_stmt(stmt) for stmt in stmts)
+        if len(stmts) == 1:
+            return stmts[0]
+        def block(frame):
+            for stmt in stmts:
+                if stmt(frame):
+                    return True
+        return block
+
+    def call_function(self, func_name, args):
+        # Fast path for functions that are native and done being sampled:
+        # one dict lookup and a direct call to the exact-arity prototype.
+        compiled = self.native_functions.get(func_name)
+        if compiled is not None:
+            native = compiled.callable
+            if native is not None and fits_int64(args):
+                mark = len(self.output)
+                if self.fuel is not None:
+                    self.settle_native()
+                try:
+                    result = native(self.state_address, *args)
+                except TypeError:
+                    # Too few arguments for the prototype; pad them below.
+                    return self.dispatch_call(func_name, args)
+                self.profiles[func_name].calls += 1
+                if self.native_error is not None:
+                    return self.deoptimize(func_name, args, mark)
+                if self.fuel is not None:
+                    self.settle_native()
                 return result
-            args = [self.eval_expr(arg, env) for arg in expr["args"]]
-            new_env = dict(zip(func["params"], args))
-            saved_env = env
-            env = new_env
+        return self.dispatch_call(func_name, args)
+
+    def dispatch_call(self, func_name, args):
+        func = self.functions.get(func_name)
+        if not func:
+            raise Exception(f"Function {func_name} not defined")
+
+        profile = self.profiles.get(func_name)
+        if profile is None:
+            profile = self.profiles[func_name] = FunctionProfile(func)
+        profile.calls += 1
+        compiled = self.compiled_functions.get(func_name)
+        if compiled is None:
+            if func_name in self.pending_compiles:
+                compiled = self.poll_compile(func_name)
+            elif profile.calls >= self.tiering.min_calls and func_name not in self.jit_failures:
+                # Decided on the way in, so the calls a deep recursion makes
+                # from here on find the native code (or the pending compile).
+                estimate = self.estimate_compile_time(profile.size)
+                if self.tiering.should_compile(profile, estimate) and not self.compiles_pending(profile.callees):
+                    self.tier_up(func_name, func, profile)
+                    compiled = self.compiled_functions.get(func_name)
+        if compiled is not None and compiled.callable is not None:
+            native_args = native_arguments(args, compiled)
+            if native_args is None:
+                return self.interpret_call(func_name, func, args, profile)
+            result = self.call_native(func_name, compiled, native_args, args, profile)
+            # The fast path only passes integers.
+            if profile.sampled_calls >= NATIVE_SAMPLE_CALLS and func_name in self.compiled_functions \
+                    and not compiled.arrays:
+                self.native_functions[func_name] = compiled
+            return result
+
+        # interpret_call, inlined: this is the path every interpreted call
+        # takes, and a Python frame less matters for deep recursion.
+        self.budget_ticks -= 1
+        if self.budget_ticks <= 0:
+            self.check_budget()
+        profile.record_args(args)
+        start = time.perf_counter()
+        body, scope = self.lowered_functions[func_name]
+        frame = args + scope.padding if len(args) == scope.params else scope.new_frame(args)
+        profile.depth += 1
+        try:
+            body(frame)
+        finally:
+            profile.depth -= 1
+        result = frame[-1]
+        profile.interpreted_calls += 1
+        profile.interpreted_time += time.perf_counter() - start
+        return result
+
+    def interpret_call(self, func_name, func, args, profile):
+        self.budget_ticks -= 1
+        if self.budget_ticks <= 0:
+            self.check_budget()
+        profile.record_args(args)
+        start = time.perf_counter()
+        body, scope = self.lowered_functions[func_name]
+        frame = scope.new_frame(args)
+        profile.depth += 1
+        try:
+            body(frame)
+        finally:
+            profile.depth -= 1
+        result = frame[-1]
+        profile.interpreted_calls += 1
+        profile.interpreted_time += time.perf_counter() - start
+        return result
+
+    def call_native(self, func_name, compiled, native_args, args, profile):
+        # native_args: args as native_arguments() passes them.
+        mark = len(self.output)
+        if self.fuel is not None:
+            self.settle_native()
+        if profile.sampled_calls >= NATIVE_SAMPLE_CALLS:
+            result = compiled.callable(self.state_address, *native_args)
+        else:
+            start = time.perf_counter()
+            result = compiled.callable(self.state_address, *native_args)
+            profile.sampled_calls += 1
+            profile.sampled_time += time.perf_counter() - start
+        if self.native_error is not None:
+            return self.deoptimize(func_name, args, mark)
+        if self.fuel is not None:
+            self.settle_native()
+        return result
+
+    def deoptimize(self, func_name, args, mark):
+        # The native call bailed out part way through; redo it in the
+        # interpreter, which has big integers.
+        self.recover(mark)
+        profile = self.profiles[func_name]
+        profile.deopts += 1
+        if profile.deopts >= MAX_DEOPTS and func_name in self.compiled_functions:
+            self.forget_compiled(func_name)
+            self.jit_failures.add(func_name)
+        return self.interpret_call(func_name, self.functions[func_name], args, profile)
+
+    def recover(self, mark):
+        # Drops what native code printed after mark, once it has failed a
+        # guard, so the interpreter can redo the work from there. Any other
+        # error is raised.
+        if self.native_error.__class__ is not Deoptimized:
+            self.raise_native_error()
+        self.native_error = None
+        self.native_state.clear(self.native_allowance())
+        self.deopts += 1
+        if self.output_stream is not None:
+            self.output_stream.rewind(mark)
+        else:
+            del self.output[mark:]
+
+    def tier_up(self, func_name, func, profile):
+        # Arguments that have always had the same value are compiled in as
+        # constants behind a guard; calls that miss it run a generic copy of
+        # the body in the same native function.
+        guards = profile.constant_args(self.tiering.specialize_calls)
+        if guards:
+            cond = None
+            for i, value in guards:
+                test = BinaryOp("==", Variable(func.params[i]), Number(value))
+                cond = test if cond is None else BinaryOp("*", cond, test)
+            constants = [Assign(func.params[i], Number(value)) for i, value in guards]
+            func = FunctionDef(func_name, func.params, [If(cond, constants + list(func.body), func.body)])
+        future = self.submit_compile("compile_function", func, self.opt_level, dict(self.compiled_functions))
+        self.pending_compiles[func_name] = (future, guards, self.function_generation)
+        self.poll_compile(func_name)
+
+    def load_jit(self):
+        if self.jit is None:
+            self.jit = get_shared_jit()
+        return self.jit
+
+    def estimate_compile_time(self, size):
+        if self.jit is None:
+            return estimate_compile_time(size)
+        return self.jit.estimate_compile_time(size, self.opt_level)
+
+    def submit_compile(self, method, *args):
+        # Runs the jit's method(*args) on the compiler thread, or right away
+        # when background compilation is off; the first one loads LLVM
+        # there. The future's result is (compiled or None, seconds spent).
+        def job():
             try:
-                for stmt in func["body"]:
-                    self.run_stmt(stmt, env)
-            except Interpreter.ReturnException as r:
-                env = saved_env
-                return r.value
-            env = saved_env
-            return 0
-        
-    def get_hot_operations(self):
+                compile = getattr(self.load_jit(), method)
+            except Exception:
+                return None, 0.0
+            start = time.perf_counter()
+            try:
+                compiled = compile(*args)
+            except Exception:
+                compiled = None
+            return compiled, time.perf_counter() - start
+        if self.background_compile:
+            return get_compile_executor().submit(job)
+        future = Future()
+        future.set_result(job())
+        return future
+
+    def compiles_pending(self, names):
+        # Code compiled while one of its callees is still compiling would
+        # reach that callee through the trampoline for good, so it waits.
+        pending = self.pending_compiles
+        return bool(pending) and any(name in pending for name in names)
+
+    def poll_compile(self, func_name):
+        # Installs a finished compile; until then calls stay interpreted.
+        future, guards, generation = self.pending_compiles[func_name]
+        if not future.done():
+            return None
+        del self.pending_compiles[func_name]
+        compiled, elapsed = future.result()
+        self.compile_time += elapsed
+        if compiled is None:
+            # Not compilable: keep running it in the interpreter.
+            self.jit_failures.add(func_name)
+            return None
+        if generation != self.function_generation:
+            # Something was redefined meanwhile and the code may link to
+            # it; the profile will ask for a fresh compile.
+            return None
+        self.compiled_functions[func_name] = compiled
+        if guards:
+            self.specializations[func_name] = guards
+        return compiled
+
+    def forget_compiled(self, name):
+        compiled = self.compiled_functions.pop(name, None)
+        self.native_functions.pop(name, None)
+        self.specializations.pop(name, None)
+        self.pending_compiles.pop(name, None)
+        if compiled is None:
+            return
+        # Native code that calls the old definition directly is stale too.
+        for other_name, other in list(self.compiled_functions.items()):
+            if compiled in other.links:
+                self.forget_compiled(other_name)
+
+    def spend_budget(self, amount):
+        self.budget_ticks -= amount
+        if self.budget_ticks <= 0:
+            self.check_budget()
+
+    def native_allowance(self):
+        # Iterations native loops may run before they check in: one more
+        # than the fuel left makes the one that would go over check in.
+        if self.fuel is None:
+            return NATIVE_BUDGET_INTERVAL
+        left = self.fuel - self.fuel_used - (self.budget_window - self.budget_ticks)
+        return min(NATIVE_BUDGET_INTERVAL, left + 1)
+
+    def settle_native(self):
+        # Charges the iterations native loops ran since the countdown was
+        # seeded, and seeds it again from the fuel that is left now.
+        state = self.native_state
+        ran = state.seed - state.budget
+        state.seed = state.budget
+        if ran:
+            self.spend_budget(ran)
+        state.reseed(self.native_allowance())
+
+    def check_budget(self):
+        self.fuel_used += self.budget_window - self.budget_ticks
+        if self.fuel is not None and self.fuel_used > self.fuel:
+            # The unit that went over is refused, not spent.
+            self.fuel_used = self.fuel
+            self.budget_window = self.budget_ticks = 1
+            raise BudgetExceeded("fuel", self.fuel, self.fuel_used)
+        if self.deadline is not None:
+            now = time.perf_counter()
+            if now > self.deadline:
+                raise BudgetExceeded("timeout", self.timeout, round(now - self.started, 3))
+        window = BUDGET_CHECK_INTERVAL
+        if self.fuel is not None:
+            window = min(window, self.fuel - self.fuel_used + 1)
+        self.budget_window = self.budget_ticks = window
+        if self.output_stream is not None:
+            self.output_stream.tick()
+
+    def raise_native_error(self):
+        error = self.native_error
+        self.native_error = None
+        self.native_state.clear(self.native_allowance())
+        raise error
+
+    def run_batch(self, func_name, inputs, count=None):
+        from core.batch import as_columns, run_batch, run_batch_interpreted
+
+        func = self.functions.get(func_name)
+        if not func:
+            raise Exception(f"Function {func_name} not defined")
+        columns, count = as_columns(inputs, len(func.params), count)
+        start = time.perf_counter()
+        try:
+            compiled = self.load_jit().compile_batch(func, self.opt_level, self.compiled_functions)
+        except Exception:
+            compiled = None
+        finally:
+            self.compile_time += time.perf_counter() - start
+        with running(self):
+            if compiled is None:
+                return run_batch_interpreted(self.call_function, func_name, columns, count)
+            mark = len(self.output)
+            if self.fuel is not None:
+                self.settle_native()
+            results = run_batch(compiled, columns, count, self.state_address)
+            if self.native_error is not None:
+                self.recover(mark)
+                return run_batch_interpreted(self.call_function, func_name, columns, count)
+        return results
+
+    def compile_loop(self, stmt, names, slots, writeback):
+        future = self.submit_compile("compile_loop", stmt, names, self.opt_level, dict(self.compiled_functions))
+        return self.poll_loop((future, slots, writeback, self.function_generation))
+
+    def poll_loop(self, native):
+        # A loop's native state is False (not compilable) or (code, slots,
+        # writeback, function_generation), where code is a Future until the
+        # compile finishes. slots are the frame slots of the loop's
+        # variables in the order the native code takes them, writeback the
+        # (position, slot) pairs of those it assigns.
+        if native is False or native[0].__class__ is not Future or not native[0].done():
+            return native
+        compiled, elapsed = native[0].result()
+        self.compile_time += elapsed
+        if compiled is None:
+            return False
+        self.compiled_loops += 1
+        return (compiled,) + native[1:]
+
+    def run_native_loop(self, native, frame):
+        if native is False or native[0].__class__ is Future or native[0].callable is None:
+            return False
+        # Returns None if the native loop bailed out, leaving frame as it was
+        # (or, for a loop that writes arrays, as at the start of the
+        # iteration that failed), ready to go on from the loop header.
+        compiled, slots, writeback, _ = native
+        values = native_arguments([frame[slot] for slot in slots], compiled)
+        if values is None:
+            return False
+        mark = len(self.output)
+        printed = self.native_state.printed
+        if self.fuel is not None:
+            self.settle_native()
+        results = compiled.callable(self.state_address, values)
+        if self.native_error is not None:
+            if not compiled.writes_arrays:
+                self.recover(mark)
+                return None
+            # The loop undid the iteration that failed and handed back the
+            # variables as they were at its start, along with how many lines
+            # had been printed by then; the interpreter takes over there.
+            self.recover(mark + results[-1] - printed)
+            for i, slot in writeback:
+                frame[slot] = results[i]
+            return None
+        for i, slot in writeback:
+            frame[slot] = results[i]
+        if self.fuel is not None:
+            self.settle_native()
+        return True
+
+    def get_jit_stats(self):
+        functions = {}
+        for name, compiled in self.compiled_functions.items():
+            profile = self.profiles[name]
+            info = {
+                "opt_level": compiled.opt_level,
+                "compile_ms": round(compiled.compile_time * 1000, 3),
+            }
+            guards = self.specializations.get(name)
+            if guards:
+                info["specialized"] = {profile.params[i]: value for i, value in guards}
+            if profile.interpreted_calls and profile.sampled_calls:
+                interp_us = profile.interpreted_time / profile.interpreted_calls * 1e6
+                native_us = profile.sampled_time / profile.sampled_calls * 1e6
+                info["interpreted_us_per_call"] = round(interp_us, 3)
+                info["native_us_per_call"] = round(native_us, 3)
+                info["speedup"] = round(interp_us / native_us, 2) if native_us else None
+            functions[name] = info
         return {
-            name: count
-            for name, count in self.call_counts.items()
-            if count >= self.hot_threshold
+            "opt_level": self.opt_level if self.opt_level is not None else
+                         self.jit.opt_level if self.jit is not None else DEFAULT_OPT_LEVEL,
+            "compile_ms": round(self.compile_time * 1000, 3),
+            "loops_compiled": self.compiled_loops,
+            "deopts": self.deopts,
+            "compiles_pending": len(self.pending_compiles),
+            "tiering": self.tiering.to_dict(),
+            "functions": functions,
         }
 
-    def run_stmt(self, stmt, env):
-        t = stmt["type"]
-        if t == "assign":
-            val = self.eval_expr(stmt["expr"], env)
-            env[stmt["var"]] = val
-        elif t == "print":
-            val = self.eval_expr(stmt["expr"], env)
-            self.output.append(str(val))
-        elif t == "if":
-            cond = self.eval_expr(stmt["cond"], env)
-            if cond != 0:
-                self.run_block(stmt["body"], env)
-            elif stmt.get("else_body") is not None:
-                self.run_block(stmt["else_body"], env)
-        elif t == "while":
-            while self.eval_expr(stmt["cond"], env) != 0:
-                self.run_block(stmt["body"], env)
-        elif t == "function_def":
-            self.functions[stmt["name"]] = stmt
-        elif t == "return":
-            val = self.eval_expr(stmt["expr"], env)
-            raise Interpreter.ReturnException(val)
-        else:
-            raise Exception(f"Unknown stmt type {t}")
+    def get_arrays(self):
+        # The top-level variables holding arrays, by name.
+        return {name: self.env[slot] for name, slot in self.scope.slots.items()
+                if self.env[slot].__class__ is Array}
 
-    def run_block(self, stmts, env):
-        for stmt in stmts:
-            self.run_stmt(stmt, env)
+    def get_hot_operations(self):
+        hot = {}
+        for name, profile in self.profiles.items():
+            if profile.calls < self.tiering.min_calls:
+                continue
+            if name in self.specializations:
+                tier = "specialized"
+            elif name in self.compiled_functions:
+                tier = "native"
+            else:
+                tier = "interpreted"
+            hot[name] = profile.to_dict(tier)
+        return hot
+
+    @contextmanager
+    def metered(self, kind):
+        # Adds this run to the process-wide metrics, however it ends.
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        except BudgetExceeded as e:
+            outcome = e.limit
+            raise
+        finally:
+            self.record_metrics(kind, outcome, time.perf_counter() - start)
+
+    def record_metrics(self, kind, outcome, elapsed):
+        # Session interpreters run many times, so only what happened since
+        # the last report is added.
+        registry.inc("jit_runs_total", kind=kind, outcome=outcome)
+        registry.inc("jit_run_seconds_total", elapsed)
+        interpreted = native = 0
+        for name, profile in self.profiles.items():
+            before = self.reported.get(name)
+            if before is None or before[0] is not profile:
+                before = (profile, 0, 0.0, 0)
+            native_calls = profile.calls - profile.interpreted_calls
+            self.reported[name] = (profile, profile.interpreted_calls, profile.interpreted_time, native_calls)
+            calls = profile.interpreted_calls - before[1]
+            interpreted += calls
+            if calls:
+                registry.observe("jit_function_call_seconds", (profile.interpreted_time - before[2]) / calls,
+                                 calls, function=name, tier="interpreted")
+            calls = native_calls - before[3]
+            native += calls
+            if calls and profile.sampled_calls:
+                registry.observe("jit_function_call_seconds", profile.sampled_time / profile.sampled_calls,
+                                 calls, function=name, tier="native")
+        registry.inc("jit_calls_total", interpreted, tier="interpreted")
+        registry.inc("jit_calls_total", native, tier="native")
+        if self.deopts > self.reported_deopts:
+            registry.inc("jit_deopts_total", self.deopts - self.reported_deopts)
+            self.reported_deopts = self.deopts
+        if self.compiled_loops > self.reported_loops:
+            registry.inc("jit_loops_compiled_total", self.compiled_loops - self.reported_loops)
+            self.reported_loops = self.compiled_loops
 
     def run(self):
-        self.run_block(self.ast["body"], self.env)
+        program = self.lower_block(self.ast.body)
+        with running(self):
+            program(self.env)
         return self.output
 
-def parse_code(code_str):
-    tokens = tokenize(code_str)
-    parser = Parser(tokens)
-    ast = parser.parse()
-    if isinstance(ast, list):
-        ast = {"body": ast}  
-    return ast
-
-def eval_program(ast):
-    interpreter = Interpreter(ast)  
-    output = interpreter.run()
+    def call(self, func_name, args):
+        # Calls a function the program defined, from outside it (sessions),
+        # with the profiles and native code earlier calls left behind.
+        if func_name not in self.functions:
+            raise Exception(f"Function {func_name} not defined")
+        with running(self):
+            return self.call_function(func_name, list(args))
+
+PARSE_CACHE_SIZE = 128
+parse_cache = OrderedDict()
+parse_cache_lock = threading.Lock()
+parse_cache_stats = {"hits": 0, "misses": 0}
+
+def parse_code(code_str, optimize=False):
+    # ASTs of recent submissions are cached by source hash and shared, so
+    # callers must treat the returned AST as read-only. With optimize, the
+    # copy core.optimizer made of it, cached alongside.
+    key = hashlib.sha256(code_str.encode("utf-8")).digest()
+    with parse_cache_lock:
+        entry = parse_cache.get(key)
+        if entry is not None:
+            parse_cache.move_to_end(key)
+            parse_cache_stats["hits"] += 1
+            registry.inc("jit_parse_cache_total", result="hit")
+        else:
+            parse_cache_stats["misses"] += 1
+    if entry is None:
+        registry.inc("jit_parse_cache_total", result="miss")
+        start = time.perf_counter()
+        tokens = tokenize(code_str)
+        parser = Parser(tokens, code_str)
+        ast = parser.parse()
+        if isinstance(ast, list):
+            ast = Program(ast)
+        registry.inc("jit_parse_seconds_total", time.perf_counter() - start)
+        entry = [ast, None]
+        with parse_cache_lock:
+            parse_cache[key] = entry
+            while len(parse_cache) > PARSE_CACHE_SIZE:
+                parse_cache.popitem(last=False)
+    if not optimize:
+        return entry[0]
+    if entry[1] is None:
+        from core.optimizer import optimize as optimize_program
+
+        start = time.perf_counter()
+        entry[1] = optimize_program(entry[0])
+        registry.inc("jit_optimize_seconds_total", time.perf_counter() - start)
+    return entry[1]
+
+def eval_program(ast, opt_level=None, fuel=None, timeout=None, tiering=None, variables=None):
+    # Also returns the arrays the program's top level holds when it ends.
+    interpreter = Interpreter(ast, opt_level=opt_level, fuel=fuel, timeout=timeout, tiering=tiering,
+                              variables=variables)
+    with interpreter.metered("program"):
+        output = interpreter.run()
     hot_ops = interpreter.get_hot_operations()
-    return "\n".join(output), hot_ops
+    return "\n".join(output), hot_ops, interpreter.get_jit_stats(), interpreter.get_arrays()
+
+def stream_program(ast, sink, opt_level=None, fuel=None, timeout=None, tiering=None, variables=None):
+    # Like eval_program, but printed lines go to sink as they are produced.
+    interpreter = Interpreter(ast, opt_level=opt_level, fuel=fuel, timeout=timeout, output_sink=sink,
+                              tiering=tiering, variables=variables)
+    try:
+        with interpreter.metered("program"):
+            interpreter.run()
+    finally:
+        interpreter.output.flush()
+    return interpreter.get_hot_operations(), interpreter.get_jit_stats(), interpreter.get_arrays()
+
+def eval_batch(ast, func_name, inputs, count=None, opt_level=None, fuel=None, timeout=None,
+               tiering=None):
+    interpreter = Interpreter(ast, opt_level=opt_level, fuel=fuel, timeout=timeout, tiering=tiering)
+    with interpreter.metered("batch"):
+        interpreter.run()
+        results = interpreter.run_batch(func_name, inputs, count)
+    return results, "\n".join(interpreter.output), interpreter.get_jit_stats()
 
 def print_ast_tree(ast, indent=0):
     spacing = "  " * indent
@@ -405,15 +1360,18 @@ if __name__ == "__main__":
 
     import json
     print("\nAST (as JSON):")
-    print(json.dumps(ast, indent=2))
+    print(json.dumps(to_dict(ast), indent=2))
 
     print("\nAST (as Tree):")
-    print_ast_tree(ast) 
+    print_ast_tree(to_dict(ast)) 
 
-    output, hot_ops = eval_program(ast)
+    output, hot_ops, jit_stats, _ = eval_program(ast)
 
     print("\nOutput:")
     print(output)
 
     print("\nHot Operations:")
     print(hot_ops)
+
+    print("\nJIT:")
+    print(jit_stats)
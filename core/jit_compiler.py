@@ -1,158 +1,1002 @@
 from llvmlite import ir, binding
+from collections import OrderedDict
+from core.engines import BACKEND, create_engine
+from core.metrics import registry
+from core.nodes import (
+    OP_NUMBER, OP_VARIABLE, OP_BINARY_OP, OP_FUNCTION_CALL, OP_ASSIGN, OP_PRINT, OP_IF, OP_WHILE,
+    OP_RETURN, OP_NEW_ARRAY, OP_INDEX, OP_INDEX_ASSIGN, OP_LENGTH, to_dict, walk,
+)
+from core.object_cache import ObjectCache, default_cache_dir
+from core.runtime import (
+    BUDGET_CHECK_SYMBOL, CALL_SYMBOL, DEFAULT_OPT_LEVEL, DEOPT_SYMBOL, FAILED_DEOPT, INDEX_ERROR_SYMBOL,
+    INT64_MAX, INT64_MIN, NATIVE_BUDGET_INTERVAL, NATIVE_STACK_BYTES, OPT_LEVELS, PRINT_SYMBOL,
+    STACK_OVERFLOW_SYMBOL, estimate_compile_time, retire, running, runtime_symbols,
+)
 import ctypes
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Bump whenever generated code changes so stale on-disk objects are dropped.
+COMPILER_VERSION = 10
+
+DEFAULT_CACHE_DIR = os.environ.get("JIT_CACHE_DIR", default_cache_dir())
+
+def ast_hash(node):
+    data = json.dumps(node, sort_keys=True, separators=(",", ":"), default=to_dict)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+# core.arrays.ArrayDescriptor: {i64* data, i64 length}.
+ARRAY_DESCRIPTOR = ir.LiteralStructType([ir.IntType(64).as_pointer(), ir.IntType(64)])
+# core.runtime.NativeState: {i64 budget, i64 failed, i64 printed, i64
+# stack_limit}. Every native function takes a pointer to one as its first
+# argument.
+NATIVE_STATE = ir.LiteralStructType([ir.IntType(64)] * 4)
+STATE_BUDGET, STATE_FAILED, STATE_PRINTED, STATE_STACK_LIMIT = range(4)
+
+native_function_types = {}
+
+def native_function_type(nargs):
+    # One ctypes prototype per arity, matching the i64(state*, i64, ...)
+    # signature that build_function emits. The state goes in by address.
+    func_type = native_function_types.get(nargs)
+    if func_type is None:
+        func_type = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_void_p, *([ctypes.c_int64] * nargs))
+        native_function_types[nargs] = func_type
+    return func_type
+
+class CompiledFunction:
+    def __init__(self, key, name, symbol, nargs, module, opt_level, compile_time):
+        self.key = key
+        self.name = name
+        self.symbol = symbol
+        self.nargs = nargs
+        self.module = module
+        self.opt_level = opt_level
+        self.compile_time = compile_time
+        self.links = []
+        # Positions of the arguments that are arrays, and whether the code
+        # may store into them (only loops do: see build_loop).
+        self.arrays = ()
+        self.writes_arrays = False
+        self.callable = None
+
+class ResumableLoop:
+    # Codegen state of an OSR loop that writes to arrays (see build_loop):
+    # where each iteration's checkpoint is taken, the block every bail-out
+    # leaves through, and a (pointer, old value) pair of allocas per store.
+    def __init__(self, loop, checkpoint, resume, scratch):
+        self.loop = loop
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.scratch = scratch
+        self.iteration = None
+        self.stores = []
 
 class JITCompiler:
-    def __init__(self):
+    def __init__(self, max_cached_functions=256, opt_level=DEFAULT_OPT_LEVEL, cache_dir=DEFAULT_CACHE_DIR,
+                 max_cache_bytes=64 * 1024 * 1024, backend=BACKEND):
+        if opt_level not in OPT_LEVELS:
+            raise Exception(f"Invalid optimization level {opt_level}, expected one of {OPT_LEVELS}")
         try:
             binding.initialize()
             binding.initialize_native_target()
             binding.initialize_native_asmprinter()
 
             self.module = ir.Module(name="jit_module")
+            self.target_machine = binding.Target.from_default_triple().create_target_machine()
+            self.backend = backend
+            self.object_cache = None
+            if cache_dir:
+                self.open_object_cache(cache_dir, max_cache_bytes)
             self.engine = self.create_execution_engine()
             self.func_protos = {}
+            self.links = {}
+            self.array_params = ()
+            self.array_vars = {}
+            self.current_function = None
+            self.deopt_blocks = {}
+            self.resumable = None
+            self.budgets = []
+            self.cache = OrderedDict()
+            self.failed = OrderedDict()
+            self.max_cached_functions = max_cached_functions
+            self.opt_level = opt_level
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.disk_hits = 0
+            self.compile_cost_scale = {}
+            self.lock = threading.RLock()
         except Exception as e:
             print(f"[Init Error] Failed to initialize LLVM: {e}")
             raise
 
     def create_execution_engine(self):
         try:
-            target = binding.Target.from_default_triple()
-            target_machine = target.create_target_machine()
-            backing_mod = binding.parse_assembly("")
-            engine = binding.create_mcjit_compiler(backing_mod, target_machine)
-            return engine
+            store = self.store_object if self.object_cache is not None else None
+            return create_engine(self.backend, self.target_machine, runtime_symbols(), store)
         except Exception as e:
             print(f"[Engine Error] Failed to create execution engine: {e}")
             raise
 
-    def compile_ir(self):
+    def compile_ir(self, symbol, links, opt_level=None):
+        # Returns the engine's handle for the module; symbol is the function
+        # that will be looked up in it.
         try:
+            self.module.triple = self.target_machine.triple
+            self.module.data_layout = str(self.target_machine.target_data)
             llvm_ir = str(self.module)
             mod = binding.parse_assembly(llvm_ir)
+            mod.name = self.module.name
             mod.verify()
-            self.engine.add_module(mod)
-            self.engine.finalize_object()
-            self.engine.run_static_constructors()
-            self.module = ir.Module(name="jit_module") 
+            self.optimize(mod, self.opt_level if opt_level is None else opt_level)
+            return self.engine.add_module(mod, symbol, [linked.module for linked in links.values()])
         except Exception as e:
             print(f"[IR Compile Error] Failed to compile LLVM IR: {e}")
             raise
+        finally:
+            self.module = ir.Module(name="jit_module")
+
+    def optimize(self, mod, opt_level):
+        if opt_level == 0:
+            return
+        pm = binding.ModulePassManager()
+        self.target_machine.add_analysis_passes(pm)
+        # Every variable is an alloca, so promoting them to SSA registers
+        # (SROA does mem2reg) comes first at any level above O0.
+        pm.add_sroa_pass()
+        pm.add_instruction_combining_pass()
+        pm.add_cfg_simplification_pass()
+        if opt_level >= 2:
+            pm.add_function_inlining_pass(225 if opt_level == 2 else 275)
+            pm.add_reassociate_expressions_pass()
+            pm.add_gvn_pass()
+            pm.add_loop_rotate_pass()
+            pm.add_licm_pass()
+            pm.add_loop_unroll_pass()
+            pm.add_instruction_combining_pass()
+            pm.add_dead_code_elimination_pass()
+        pmb = binding.PassManagerBuilder()
+        pmb.opt_level = opt_level
+        pmb.loop_vectorize = opt_level >= 2
+        pmb.slp_vectorize = opt_level >= 3
+        pmb.populate(pm)
+        pm.run(mod)
+
+    def open_object_cache(self, cache_dir, max_cache_bytes):
+        llvm_version = ".".join(str(v) for v in binding.llvm_version_info)
+        version = f"v{COMPILER_VERSION}-llvm{llvm_version}"
+        try:
+            self.object_cache = ObjectCache(cache_dir, version, max_cache_bytes)
+        except OSError as e:
+            print(f"[Cache Error] Disabling on-disk object cache: {e}")
+
+    def object_key(self, key):
+        # The engines may not generate interchangeable objects.
+        triple = self.target_machine.triple
+        return "jit-" + hashlib.sha256(f"{key}|{triple}|{self.backend}".encode("utf-8")).hexdigest()
 
-    def compile_function(self, func_ast):
+    def store_object(self, name, data):
+        # Called by the engine with the object code it generated for a module.
+        if not name.startswith("jit-"):
+            return
         try:
-            func_name = func_ast["name"]
-            params = func_ast["params"]
+            self.object_cache.store(name, data)
+        except OSError as e:
+            print(f"[Cache Error] Failed to write object for '{name}': {e}")
+
+    def load_object(self, key, symbol, links):
+        if self.object_cache is None:
+            return None
+        disk_key = self.object_key(key)
+        data = self.object_cache.load(disk_key)
+        if data is None:
+            return None
+        try:
+            handle = self.engine.add_object(disk_key, data, symbol, [linked.module for linked in links.values()])
+        except Exception as e:
+            print(f"[Cache Error] Failed to load cached object for '{symbol}': {e}")
+            return None
+        self.disk_hits += 1
+        return handle
+
+    def compile_function(self, func_ast, opt_level=None, callees=None):
+        # callees maps names to already compiled functions; calls to them are
+        # linked natively, everything else goes through the trampoline.
+        # A call that bails out is redone from the start, which must not
+        # store into an array twice, so functions that write arrays stay
+        # interpreted; their loops are compiled on their own (build_loop).
+        if self.writes_arrays(func_ast.body):
+            raise Exception(f"'{func_ast.name}' writes to arrays")
+        links = self.find_links(func_ast.body, callees, func_ast.name)
+        key = ast_hash({"ast": func_ast, "links": {n: c.symbol for n, c in links.items()}})
+        arrays = self.find_arrays(func_ast.body, func_ast.params, links, func_ast.name)
+        return self.compile_cached(key, func_ast.name, opt_level, len(func_ast.params),
+                                   links, self.get_callable, self.build_function, func_ast,
+                                   size=sum(1 for _ in walk(func_ast.body)), arrays=arrays)
+
+    def compile_loop(self, loop_ast, var_names, opt_level=None, callees=None):
+        links = self.find_links(loop_ast, callees)
+        key = ast_hash({"type": "osr_loop", "loop": loop_ast, "vars": var_names,
+                        "links": {n: c.symbol for n, c in links.items()}})
+        return self.compile_cached(key, "osr_loop", opt_level, len(var_names), links,
+                                   self.get_loop_callable, self.build_loop, loop_ast, var_names,
+                                   arrays=self.find_arrays(loop_ast, var_names, links),
+                                   writes_arrays=self.writes_arrays(loop_ast))
+
+    def compile_batch(self, func_ast, opt_level=None, callees=None):
+        links = self.find_links(func_ast.body, callees, func_ast.name)
+        key = ast_hash({"type": "batch", "ast": func_ast,
+                        "links": {n: c.symbol for n, c in links.items()}})
+        return self.compile_cached(key, f"batch_{func_ast.name}", opt_level, len(func_ast.params),
+                                   links, self.get_batch_callable, self.build_batch, func_ast)
+
+    def find_links(self, node, callees, own_name=None):
+        links = {}
+        if not callees:
+            return links
+        for node in walk(node):
+            if node.tag == OP_FUNCTION_CALL:
+                name = node.name
+                compiled = callees.get(name)
+                if name != own_name and compiled is not None and compiled.callable is not None:
+                    links[name] = compiled
+        return links
+
+    def find_arrays(self, code, params, links, own_name=None):
+        # Positions of the params the code uses as arrays: indexed, passed
+        # to len(), or passed on where a linked function (or this one, for
+        # recursive calls) takes an array.
+        arrays = set()
+        while True:
+            found = set(arrays)
+            for node in walk(code):
+                t = node.tag
+                if t == OP_INDEX or t == OP_INDEX_ASSIGN:
+                    found.add(node.var)
+                elif t == OP_LENGTH and node.expr.tag == OP_VARIABLE:
+                    found.add(node.expr.name)
+                elif t == OP_FUNCTION_CALL:
+                    if node.name == own_name:
+                        takes = [i for i, param in enumerate(params) if param in arrays]
+                    elif node.name in links:
+                        takes = links[node.name].arrays
+                    else:
+                        continue
+                    for i in takes:
+                        if i < len(node.args) and node.args[i].tag == OP_VARIABLE:
+                            found.add(node.args[i].name)
+            if found == arrays:
+                return tuple(i for i, param in enumerate(params) if param in arrays)
+            arrays = found
+
+    def writes_arrays(self, node):
+        # Compiled functions never do, so neither do linked callees.
+        return any(n.tag == OP_INDEX_ASSIGN for n in walk(node))
+
+    def estimate_compile_time(self, size, opt_level=None):
+        # Seconds to compile a function of size AST nodes.
+        if opt_level is None:
+            opt_level = self.opt_level
+        scale = self.compile_cost_scale.get(opt_level, 1.0)
+        return estimate_compile_time(size, scale)
+
+    def compile_cached(self, key, name, opt_level, nargs, links, make_callable, build, *args, size=None,
+                       arrays=(), writes_arrays=False):
+        if opt_level is None:
+            opt_level = self.opt_level
+        if opt_level not in OPT_LEVELS:
+            raise Exception(f"Invalid optimization level {opt_level}, expected one of {OPT_LEVELS}")
+        key = f"{key}-O{opt_level}"
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                registry.inc("jit_compile_cache_total", result="memory")
+                return entry
+            if key in self.failed:
+                raise Exception(f"'{name}' previously failed to compile")
+            self.cache_misses += 1
+            # Different programs may define different functions under the
+            # same name, so the native symbol carries the AST hash.
+            symbol = f"{name}_{key[:16]}_O{opt_level}"
+            start = time.perf_counter()
+            mod = self.load_object(key, symbol, links)
+            built = mod is None
+            if built:
+                try:
+                    self.module.name = self.object_key(key)
+                    self.links = links
+                    self.array_params = arrays
+                    build(symbol, *args)
+                    mod = self.compile_ir(symbol, links, opt_level)
+                except Exception as e:
+                    self.module = ir.Module(name="jit_module")
+                    self.failed[key] = True
+                    while len(self.failed) > self.max_cached_functions:
+                        self.failed.popitem(last=False)
+                    print(f"[Function Compile Error] Failed to compile function '{name}': {e}")
+                    registry.inc("jit_compile_failures_total")
+                    raise
+                finally:
+                    self.links = {}
+                    self.array_params = ()
+                    self.array_vars = {}
+                    self.current_function = None
+                    self.deopt_blocks = {}
+                    self.resumable = None
+                    self.budgets = []
+
+            compile_time = time.perf_counter() - start
+            registry.inc("jit_compile_cache_total", result="built" if built else "disk")
+            registry.observe("jit_compile_seconds", compile_time)
+            if built and size is not None:
+                ratio = compile_time / estimate_compile_time(size)
+                scale = self.compile_cost_scale.get(opt_level)
+                self.compile_cost_scale[opt_level] = ratio if scale is None else 0.8 * scale + 0.2 * ratio
+            entry = CompiledFunction(key, name, symbol, nargs, mod, opt_level, compile_time)
+            entry.links = list(links.values())
+            entry.arrays = arrays
+            entry.writes_arrays = writes_arrays
+            address = self.engine.address(mod, symbol)
+            if not address:
+                print(f"[Callable Error] '{symbol}' not found in JIT")
+                raise Exception(f"'{symbol}' not found in JIT")
+            entry.callable = make_callable(address, nargs)
+            self.cache[key] = entry
+            self.evict()
+            return entry
+
+    def build_function(self, symbol, func_ast):
+        params = func_ast.params
+        func_type = ir.FunctionType(ir.IntType(64), [NATIVE_STATE.as_pointer()] + [ir.IntType(64)] * len(params))
+        function = ir.Function(self.module, func_type, name=symbol)
+        function.args[0].name = "state"
+        self.current_function = (func_ast.name, function)
+
+        builder = self.start_function(function)
+        self.guard_stack(builder)
+        # A call costs a unit of fuel, as in the interpreter, so recursion
+        # without loops still checks in.
+        self.charge_budget(builder, self.budget_counter(builder))
+
+        named_vars = {}
+        args = function.args[1:]
+        for i, arg in enumerate(args):
+            arg.name = params[i]
+            named_vars[arg.name] = self.entry_alloca(builder, arg.name, arg)
+        for i in self.array_params:
+            self.bind_array(builder, params[i], args[i])
+
+        self.compile_statements(func_ast.body, builder, named_vars)
+        if not builder.block.is_terminated:
+            # Falling off the end returns 0, as in the interpreter.
+            builder.ret(ir.Constant(ir.IntType(64), 0))
+
+    def guard_stack(self, builder):
+        # Functions may recurse, so each one checks where the stack has got
+        # to. The first to run sets the limit NATIVE_STACK_BYTES below its
+        # own frame; one beyond it reports the error and returns early.
+        i64 = ir.IntType(64)
+        frame_address = self.declare_function("llvm.frameaddress.p0i8", ir.IntType(8).as_pointer(), [ir.IntType(32)])
+        here = builder.ptrtoint(builder.call(frame_address, [ir.Constant(ir.IntType(32), 0)]), i64, name="stack")
+        limit_ptr = self.state_field(builder, STATE_STACK_LIMIT)
+        limit = builder.load(limit_ptr, name="stack_limit")
+        first_block = builder.append_basic_block("stack_first")
+        check_block = builder.append_basic_block("stack_check")
+        overflow_block = builder.append_basic_block("stack_overflow")
+        ok_block = builder.append_basic_block("stack_ok")
+        branch = builder.cbranch(builder.icmp_unsigned("==", limit, ir.Constant(i64, 0)), first_block, check_block)
+        branch.set_weights([1, 1 << 20])
+
+        builder.position_at_end(first_block)
+        builder.store(builder.sub(here, ir.Constant(i64, NATIVE_STACK_BYTES)), limit_ptr)
+        builder.branch(ok_block)
+
+        builder.position_at_end(check_block)
+        branch = builder.cbranch(builder.icmp_unsigned("<", here, limit), overflow_block, ok_block)
+        branch.set_weights([1, 1 << 20])
+
+        builder.position_at_end(overflow_block)
+        builder.call(self.declare_function(STACK_OVERFLOW_SYMBOL, ir.VoidType(), []), [])
+        self.return_early(builder)
+        builder.position_at_end(ok_block)
+
+    def build_loop(self, symbol, loop_ast, var_names):
+        # void loop(state*, i64* slots): the interpreter passes the live
+        # values of var_names in, the loop runs from its header to exit, and
+        # the updated values are written back through the same array. The
+        # slot after them is for the printed count of a resumable loop.
+        i64 = ir.IntType(64)
+        func_type = ir.FunctionType(ir.VoidType(), [NATIVE_STATE.as_pointer(), i64.as_pointer()])
+        function = ir.Function(self.module, func_type, name=symbol)
+        state, slots = function.args
+        state.name, slots.name = "state", "slots"
+
+        builder = self.start_function(function)
+
+        named_vars = {}
+        slot_ptrs = []
+        values = []
+        for i, name in enumerate(var_names):
+            ptr = builder.gep(slots, [ir.Constant(ir.IntType(32), i)], name=f"{name}_slot")
+            slot_ptrs.append(ptr)
+            values.append(builder.load(ptr))
+            named_vars[name] = self.entry_alloca(builder, name, values[-1])
+        for i in self.array_params:
+            self.bind_array(builder, var_names[i], values[i])
+
+        if self.contains_return(loop_ast.body):
+            raise Exception("Cannot compile loop containing 'return'")
+        if self.writes_arrays(loop_ast):
+            # Stores cannot be redone, so the loop cannot be rerun from where
+            # it was entered when it bails out. Instead each iteration starts
+            # with a checkpoint of the variables and logs the old value of
+            # every element it overwrites; a bail-out undoes the iteration and
+            # hands the checkpoint back, and the interpreter carries on from
+            # the loop header. The log holds one entry per store, so stores
+            # must not sit in inner loops.
+            if any(node.tag == OP_WHILE and self.writes_arrays(node.body) for node in walk(loop_ast.body)):
+                raise Exception("Cannot compile loop whose inner loops write to arrays")
+            self.resumable = ResumableLoop(loop_ast, function.append_basic_block("checkpoint"),
+                                           function.append_basic_block("resume"),
+                                           self.entry_alloca(builder, "scratch"))
+        self.compile_while(loop_ast, builder, named_vars)
+
+        for name, ptr in zip(var_names, slot_ptrs):
+            builder.store(builder.load(named_vars[name]), ptr)
+        builder.ret_void()
+        if self.resumable is not None:
+            self.build_resume(slots, var_names, named_vars, slot_ptrs)
+
+    def build_resume(self, slots, var_names, named_vars, slot_ptrs):
+        # Fills in the checkpoint and bail-out blocks of a resumable loop.
+        # Only a failed guard is undone and handed back: after any other
+        # error the interpreter stops where native code did.
+        i64 = ir.IntType(64)
+        loop = self.resumable
+        variables = [i for i in range(len(var_names)) if i not in self.array_params]
+        entry = loop.checkpoint.function.entry_basic_block
+        builder = ir.IRBuilder(entry)
+        builder.position_before(entry.terminator)
+        saved = {}
+        for i in variables:
+            saved[i] = builder.alloca(i64, name=f"{var_names[i]}_saved")
+        saved_printed = builder.alloca(i64, name="printed_saved")
+
+        builder = ir.IRBuilder(loop.checkpoint)
+        for i in variables:
+            builder.store(builder.load(named_vars[var_names[i]]), saved[i])
+        builder.store(builder.load(self.state_field(builder, STATE_PRINTED)), saved_printed)
+        for where, _ in loop.stores:
+            builder.store(loop.scratch, where)
+        builder.branch(loop.iteration)
+
+        builder = ir.IRBuilder(loop.resume)
+        undo = builder.append_basic_block("undo")
+        leave = builder.append_basic_block("leave")
+        failed = builder.load(self.state_field(builder, STATE_FAILED), name="failed")
+        builder.cbranch(builder.icmp_signed("==", failed, ir.Constant(i64, FAILED_DEOPT)), undo, leave)
+        builder.position_at_end(leave)
+        builder.ret_void()
+        builder.position_at_end(undo)
+        for where, old in reversed(loop.stores):
+            builder.store(builder.load(old), builder.load(where))
+        for i in variables:
+            builder.store(builder.load(saved[i]), slot_ptrs[i])
+        builder.store(builder.load(saved_printed), builder.gep(slots, [ir.Constant(ir.IntType(32), len(var_names))]))
+        builder.ret_void()
+
+    def build_batch(self, symbol, func_ast):
+        # void batch(state*, i64** inputs, i64* out, i64 n) computes
+        # out[i] = f(inputs[0][i], inputs[1][i], ...) for i in [0, n), with
+        # f emitted into the same module so the optimizer can inline it.
+        body_symbol = f"{symbol}_body"
+        self.build_function(body_symbol, func_ast)
+        body_function = self.module.globals[body_symbol]
+        body_function.linkage = "internal"
+
+        i64 = ir.IntType(64)
+        i32 = ir.IntType(32)
+        func_type = ir.FunctionType(ir.VoidType(), [NATIVE_STATE.as_pointer(), i64.as_pointer().as_pointer(),
+                                                    i64.as_pointer(), i64])
+        function = ir.Function(self.module, func_type, name=symbol)
+        state, inputs, out, count = function.args
+        state.name, inputs.name, out.name, count.name = "state", "inputs", "out", "n"
+
+        builder = self.start_function(function)
+        columns = [builder.load(builder.gep(inputs, [ir.Constant(i32, p)]), name=f"column{p}")
+                   for p in range(len(func_ast.params))]
+        index = self.entry_alloca(builder, "i")
+
+        loop_cond = builder.append_basic_block("batch_cond")
+        loop_body = builder.append_basic_block("batch_body")
+        loop_end = builder.append_basic_block("batch_end")
+        budget = self.enter_budget(builder)
+        builder.branch(loop_cond)
+        builder.position_at_end(loop_cond)
+        self.charge_budget(builder, budget)
+        i = builder.load(index, name="i")
+        builder.cbranch(builder.icmp_signed("<", i, count), loop_body, loop_end)
+
+        builder.position_at_end(loop_body)
+        args = [builder.load(builder.gep(column, [i])) for column in columns]
+        self.spill_budget(builder)
+        result = builder.call(body_function, [state] + args, name="result")
+        self.reload_budget(builder)
+        builder.store(result, builder.gep(out, [i]))
+        builder.store(builder.add(i, ir.Constant(i64, 1)), index)
+        builder.branch(loop_cond)
+
+        builder.position_at_end(loop_end)
+        self.leave_budget(builder, budget)
+        builder.ret_void()
+
+    def bind_array(self, builder, name, handle):
+        # handle is the address of the array's descriptor. Native code never
+        # assigns array variables, so its data pointer and length are only
+        # loaded once, where the function starts.
+        i32 = ir.IntType(32)
+        descriptor = builder.inttoptr(handle, ARRAY_DESCRIPTOR.as_pointer(), name=f"{name}_descriptor")
+        zero, one = ir.Constant(i32, 0), ir.Constant(i32, 1)
+        data = builder.load(builder.gep(descriptor, [zero, zero]), name=f"{name}_data")
+        length = builder.load(builder.gep(descriptor, [zero, one]), name=f"{name}_len")
+        self.array_vars[name] = (data, length)
 
-            func_type = ir.FunctionType(ir.IntType(64), [ir.IntType(64)] * len(params))
-            function = ir.Function(self.module, func_type, name=func_name)
+    def element_pointer(self, name, index, builder):
+        # Bounds-checked GEP into the array's own memory. An index outside
+        # it (negative ones too, compared unsigned) reports the error the
+        # interpreter would raise and returns early.
+        if name not in self.array_vars:
+            raise Exception(f"'{name}' is not an array parameter")
+        data, length = self.array_vars[name]
+        i64 = ir.IntType(64)
+        error_block = builder.append_basic_block(f"{name}_out_of_bounds")
+        ok_block = builder.append_basic_block(f"{name}_in_bounds")
+        in_bounds = builder.icmp_unsigned("<", index, length, name=f"{name}_in_bounds")
+        branch = builder.cbranch(in_bounds, ok_block, error_block)
+        branch.set_weights([1 << 20, 1])
+        builder.position_at_end(error_block)
+        builder.call(self.declare_function(INDEX_ERROR_SYMBOL, ir.VoidType(), [i64, i64]), [index, length])
+        self.return_early(builder)
+        builder.position_at_end(ok_block)
+        return builder.gep(data, [index], name=f"{name}_element")
 
-            block = function.append_basic_block(name="entry")
-            builder = ir.IRBuilder(block)
+    def contains_return(self, stmts):
+        return any(node.tag == OP_RETURN for node in walk(stmts))
 
-            named_vars = {}
-            for i, arg in enumerate(function.args):
-                arg.name = params[i]
-                named_vars[arg.name] = arg
+    def start_function(self, function):
+        # The entry block only holds allocas and a branch to the body, so
+        # new variables can be added to it at any point during codegen.
+        entry = function.append_basic_block(name="entry")
+        body = function.append_basic_block(name="body")
+        ir.IRBuilder(entry).branch(body)
+        return ir.IRBuilder(body)
 
-            retval = self.compile_statements(func_ast["body"], builder, named_vars)
-            builder.ret(retval)
+    def entry_alloca(self, builder, name, init=None):
+        entry = builder.function.entry_basic_block
+        entry_builder = ir.IRBuilder(entry)
+        entry_builder.position_before(entry.terminator)
+        alloca = entry_builder.alloca(ir.IntType(64), name=name)
+        if init is None:
+            entry_builder.store(ir.Constant(ir.IntType(64), 0), alloca)
+        else:
+            builder.store(init, alloca)
+        return alloca
 
-            self.compile_ir()
+    def evict(self):
+        while len(self.cache) > self.max_cached_functions:
+            _, entry = self.cache.popitem(last=False)
+            self.remove_entry(entry)
+
+    def remove_entry(self, entry):
+        # Interpreters still holding the entry see callable=None and
+        # recompile instead of jumping into removed code.
+        entry.callable = None
+        retire(self, entry)
+        # Code that calls the removed function directly has to go too.
+        for key, other in list(self.cache.items()):
+            if entry in other.links and self.cache.pop(key, None) is not None:
+                self.remove_entry(other)
+
+    def remove_code(self, entry):
+        try:
+            self.engine.remove(entry.module)
         except Exception as e:
-            print(f"[Function Compile Error] Failed to compile function '{func_ast.get('name', '?')}': {e}")
-            raise
+            print(f"[Evict Error] Failed to remove '{entry.symbol}': {e}")
+
+    def cache_info(self):
+        with self.lock:
+            return {
+                "size": len(self.cache),
+                "max_size": self.max_cached_functions,
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "disk_hits": self.disk_hits,
+            }
 
     def compile_statements(self, stmts, builder, named_vars):
-        retval = None
         for stmt in stmts:
-            if stmt["type"] == "return":
-                retval = self.compile_expr(stmt["expr"], builder, named_vars)
+            if builder.block.is_terminated:
+                # Everything after a return in the same block is dead.
+                break
+
+            t = stmt.tag
+            if t == OP_RETURN:
+                value = self.compile_expr(stmt.expr, builder, named_vars)
+                self.spill_budget(builder)
+                builder.ret(value)
 
-            elif stmt["type"] == "assign":
-                var_name = stmt["var"]
-                val = self.compile_expr(stmt["expr"], builder, named_vars)
+            elif t == OP_ASSIGN:
+                var_name = stmt.var
+                if var_name in self.array_vars:
+                    raise Exception(f"Cannot assign to array '{var_name}' in native code")
+                val = self.compile_expr(stmt.expr, builder, named_vars)
                 if var_name not in named_vars:
-                    alloca = builder.alloca(ir.IntType(64), name=var_name)
-                    named_vars[var_name] = alloca
+                    named_vars[var_name] = self.entry_alloca(builder, var_name)
                 builder.store(val, named_vars[var_name])
 
-            elif stmt["type"] == "while":
+            elif t == OP_INDEX_ASSIGN:
+                index = self.compile_expr(stmt.index, builder, named_vars)
+                val = self.compile_expr(stmt.expr, builder, named_vars)
+                ptr = self.element_pointer(stmt.var, index, builder)
+                if self.resumable is not None:
+                    self.log_store(builder, ptr)
+                builder.store(val, ptr)
+
+            elif t == OP_PRINT:
+                val = self.compile_expr(stmt.expr, builder, named_vars)
+                builder.call(self.declare_print(), [val])
+                printed = self.state_field(builder, STATE_PRINTED)
+                builder.store(builder.add(builder.load(printed), ir.Constant(ir.IntType(64), 1)), printed)
+
+            elif t == OP_IF:
+                self.compile_if(stmt, builder, named_vars)
+
+            elif t == OP_WHILE:
                 self.compile_while(stmt, builder, named_vars)
 
             else:
-                raise Exception(f"Unsupported statement type: {stmt['type']}")
-        return retval
-    
+                raise Exception(f"Unsupported statement type: {stmt.type}")
+
+    def compile_if(self, stmt, builder, named_vars):
+        then_block = builder.append_basic_block("if_then")
+        else_block = None
+        if stmt.else_body is not None:
+            else_block = builder.append_basic_block("if_else")
+        merge_block = builder.append_basic_block("if_end")
+        cond_val = self.compile_expr(stmt.cond, builder, named_vars)
+        zero = ir.Constant(ir.IntType(64), 0)
+        cond = builder.icmp_signed("!=", cond_val, zero, name="if_cond")
+        builder.cbranch(cond, then_block, else_block or merge_block)
+
+        builder.position_at_end(then_block)
+        self.compile_statements(stmt.body, builder, named_vars)
+        if not builder.block.is_terminated:
+            builder.branch(merge_block)
+
+        if else_block is not None:
+            builder.position_at_end(else_block)
+            self.compile_statements(stmt.else_body, builder, named_vars)
+            if not builder.block.is_terminated:
+                builder.branch(merge_block)
+
+        builder.position_at_end(merge_block)
+
     def compile_while(self, stmt, builder, named_vars):
         loop_cond = builder.append_basic_block("loop_cond")
         loop_body = builder.append_basic_block("loop_body")
         loop_end = builder.append_basic_block("loop_end")
+        budget = self.enter_budget(builder)
         builder.branch(loop_cond)
         builder.position_at_end(loop_cond)
-        cond_val = self.compile_expr(stmt["cond"], builder, named_vars)
+        self.charge_budget(builder, budget)
+        if self.resumable is not None and stmt is self.resumable.loop:
+            self.take_checkpoint(builder)
+        cond_val = self.compile_expr(stmt.cond, builder, named_vars)
         zero = ir.Constant(ir.IntType(64), 0)
         cond = builder.icmp_signed("!=", cond_val, zero, name="while_cond")
         builder.cbranch(cond, loop_body, loop_end)
         builder.position_at_end(loop_body)
-        self.compile_statements(stmt["body"], builder, named_vars)
-        builder.branch(loop_cond)
+        self.compile_statements(stmt.body, builder, named_vars)
+        if not builder.block.is_terminated:
+            builder.branch(loop_cond)
         builder.position_at_end(loop_end)
+        self.leave_budget(builder, budget)
+
+    def take_checkpoint(self, builder):
+        # Top of an iteration of a resumable loop. A callee that failed
+        # returned 0 and let the iteration carry on, so that is checked
+        # here before the checkpoint is overwritten.
+        loop = self.resumable
+        failed = builder.load(self.state_field(builder, STATE_FAILED), name="failed")
+        loop.iteration = builder.append_basic_block("iteration")
+        branch = builder.cbranch(builder.icmp_signed("!=", failed, ir.Constant(ir.IntType(64), 0)),
+                                 loop.resume, loop.checkpoint)
+        branch.set_weights([1, 1 << 20])
+        builder.position_at_end(loop.iteration)
+
+    def log_store(self, builder, ptr):
+        # Notes the element a resumable loop is about to overwrite and its
+        # old value. Until the store runs, its entry points at scratch.
+        loop = self.resumable
+        n = len(loop.stores)
+        entry = builder.function.entry_basic_block
+        entry_builder = ir.IRBuilder(entry)
+        entry_builder.position_before(entry.terminator)
+        where = entry_builder.alloca(ptr.type, name=f"store{n}_ptr")
+        entry_builder.store(loop.scratch, where)
+        old = self.entry_alloca(builder, f"store{n}_old")
+        builder.store(ptr, where)
+        builder.store(builder.load(ptr), old)
+        loop.stores.append((where, old))
+
+    def enter_budget(self, builder):
+        # Each loop counts down in a local copy of the state's countdown,
+        # taken over from the loop around it. Calls hand the count to the
+        # callee and take back what it left (spill_budget, reload_budget),
+        # so the function and everything it calls share one countdown.
+        self.spill_budget(builder)
+        budget = self.entry_alloca(builder, "budget", builder.load(self.budget_counter(builder)))
+        self.budgets.append(budget)
+        return budget
+
+    def charge_budget(self, builder, budget):
+        # Count one iteration; when the countdown runs out, call back into
+        # the interpreter and return early (0 / void) if it says to abort.
+        i64 = ir.IntType(64)
+        zero = ir.Constant(i64, 0)
+        left = builder.sub(builder.load(budget), ir.Constant(i64, 1), name="budget_left")
+        builder.store(left, budget)
+        check_block = builder.append_basic_block("budget_check")
+        abort_block = builder.append_basic_block("budget_abort")
+        ok_block = builder.append_basic_block("budget_ok")
+        branch = builder.cbranch(builder.icmp_signed("<=", left, zero), check_block, ok_block)
+        branch.set_weights([1, NATIVE_BUDGET_INTERVAL])
+
+        builder.position_at_end(check_block)
+        check = self.declare_function(BUDGET_CHECK_SYMBOL, i64, [NATIVE_STATE.as_pointer()])
+        builder.store(left, self.budget_counter(builder))
+        aborted = builder.call(check, [builder.function.args[0]], name="aborted")
+        builder.store(builder.load(self.budget_counter(builder)), budget)
+        branch = builder.cbranch(builder.icmp_signed("!=", aborted, zero), abort_block, ok_block)
+        branch.set_weights([1, NATIVE_BUDGET_INTERVAL])
+
+        builder.position_at_end(abort_block)
+        self.return_early(builder)
+        builder.position_at_end(ok_block)
+
+    def return_early(self, builder):
+        # Leaves the function without writing anything back; the caller
+        # sees native_error and ignores the result. Resumable loops leave
+        # through their bail-out block.
+        if self.resumable is not None:
+            builder.branch(self.resumable.resume)
+            return
+        return_type = builder.function.function_type.return_type
+        if isinstance(return_type, ir.VoidType):
+            builder.ret_void()
+        else:
+            builder.ret(ir.Constant(return_type, 0))
+
+    def deopt_block(self, builder):
+        # One bail-out block per function: report the failed guard and
+        # return early.
+        block = self.deopt_blocks.get(builder.function)
+        if block is None:
+            block = self.deopt_blocks[builder.function] = builder.function.append_basic_block("deopt")
+            deopt_builder = ir.IRBuilder(block)
+            deopt_builder.call(self.declare_function(DEOPT_SYMBOL, ir.VoidType(), []), [])
+            self.return_early(deopt_builder)
+        return block
+
+    def guard(self, builder, failed, name):
+        # Continues in a fresh block when failed is false, bails out
+        # otherwise.
+        ok_block = builder.append_basic_block(f"{name}_ok")
+        branch = builder.cbranch(failed, self.deopt_block(builder), ok_block)
+        branch.set_weights([1, 1 << 20])
+        builder.position_at_end(ok_block)
+
+    def compile_checked(self, builder, op, left, right, name):
+        # The interpreter has big ints, so i64 arithmetic that overflows
+        # has to be redone there.
+        pair = op(left, right)
+        self.guard(builder, builder.extract_value(pair, 1), name)
+        return builder.extract_value(pair, 0, name=name)
+
+    def leave_budget(self, builder, budget):
+        self.budgets.pop()
+        builder.store(builder.load(budget), self.budget_counter(builder))
+        self.reload_budget(builder)
+
+    def spill_budget(self, builder):
+        # Writes the innermost loop's countdown back to the state, before
+        # a call or a return.
+        if self.budgets:
+            builder.store(builder.load(self.budgets[-1]), self.budget_counter(builder))
+
+    def reload_budget(self, builder):
+        if self.budgets:
+            builder.store(builder.load(self.budget_counter(builder)), self.budgets[-1])
+
+    def budget_counter(self, builder):
+        # The countdown in the state the running function was passed.
+        return self.state_field(builder, STATE_BUDGET)
+
+    def state_field(self, builder, field):
+        i32 = ir.IntType(32)
+        return builder.gep(builder.function.args[0], [ir.Constant(i32, 0), ir.Constant(i32, field)])
+
+    def compile_call(self, expr, builder, named_vars):
+        func_name = expr.name
+        callee = None
+        takes = ()
+        if self.current_function is not None and func_name == self.current_function[0]:
+            callee = self.current_function[1]
+            takes = self.array_params
+        elif func_name in self.links:
+            linked = self.links[func_name]
+            callee = self.declare_function(linked.symbol, ir.IntType(64),
+                                           [NATIVE_STATE.as_pointer()] + [ir.IntType(64)] * linked.nargs)
+            takes = linked.arrays
+        if any(i >= len(expr.args) for i in takes):
+            raise Exception(f"Call to '{func_name}' is missing an array argument")
+        args = []
+        for i, arg in enumerate(expr.args):
+            # Arrays are passed on as the descriptor address they came in as.
+            if arg.tag == OP_VARIABLE and arg.name in self.array_vars:
+                if i not in takes:
+                    raise Exception(f"Cannot pass array '{arg.name}' to '{func_name}' in native code")
+                args.append(builder.load(named_vars[arg.name], name=arg.name))
+            elif i in takes:
+                raise Exception(f"'{func_name}' takes an array as argument {i + 1}")
+            else:
+                args.append(self.compile_expr(arg, builder, named_vars))
+        self.spill_budget(builder)
+        if callee is None:
+            result = self.compile_trampoline(func_name, args, builder)
+        else:
+            # Missing arguments are 0 and extra ones are dropped, as in the
+            # interpreter; they have already been evaluated for side effects.
+            nparams = len(callee.args) - 1
+            args = (args + [ir.Constant(ir.IntType(64), 0)] * nparams)[:nparams]
+            result = builder.call(callee, [builder.function.args[0]] + args, name=f"call_{func_name}")
+        self.reload_budget(builder)
+        return result
+
+    def compile_trampoline(self, func_name, args, builder):
+        i64 = ir.IntType(64)
+        i32 = ir.IntType(32)
+        entry = builder.function.entry_basic_block
+        entry_builder = ir.IRBuilder(entry)
+        entry_builder.position_before(entry.terminator)
+        slots = entry_builder.alloca(ir.ArrayType(i64, max(len(args), 1)), name=f"{func_name}_args")
+        for i, arg in enumerate(args):
+            builder.store(arg, builder.gep(slots, [ir.Constant(i32, 0), ir.Constant(i32, i)]))
+        args_ptr = builder.gep(slots, [ir.Constant(i32, 0), ir.Constant(i32, 0)])
+
+        name_global = self.module.globals.get(f"name.{func_name}")
+        if name_global is None:
+            data = bytearray(func_name.encode("utf-8") + b"\0")
+            name_type = ir.ArrayType(ir.IntType(8), len(data))
+            name_global = ir.GlobalVariable(self.module, name_type, name=f"name.{func_name}")
+            name_global.linkage = "private"
+            name_global.global_constant = True
+            name_global.initializer = ir.Constant(name_type, data)
+        name_ptr = name_global.gep([ir.Constant(i32, 0), ir.Constant(i32, 0)])
+
+        trampoline = self.declare_function(CALL_SYMBOL, i64, [ir.IntType(8).as_pointer(), i64.as_pointer(), i64])
+        return builder.call(trampoline, [name_ptr, args_ptr, ir.Constant(i64, len(args))],
+                            name=f"call_{func_name}")
+
+    def declare_print(self):
+        return self.declare_function(PRINT_SYMBOL, ir.VoidType(), [ir.IntType(64)])
+
+    def declare_function(self, symbol, return_type, arg_types):
+        func = self.module.globals.get(symbol)
+        if func is None:
+            func_type = ir.FunctionType(return_type, arg_types)
+            func = ir.Function(self.module, func_type, name=symbol)
+        return func
+
+    def running(self, interpreter):
+        return running(interpreter)
 
     def compile_expr(self, expr, builder, named_vars):
         try:
-            t = expr["type"]
+            t = expr.tag
 
-            if t == "number":
-                return ir.Constant(ir.IntType(64), expr["value"])
+            if t == OP_NUMBER:
+                if not INT64_MIN <= expr.value <= INT64_MAX:
+                    raise Exception(f"Constant {expr.value} does not fit in 64 bits")
+                return ir.Constant(ir.IntType(64), expr.value)
 
-            elif t == "variable":
-                var_name = expr["name"]
+            elif t == OP_VARIABLE:
+                var_name = expr.name
+                if var_name in self.array_vars:
+                    raise Exception(f"Array '{var_name}' can only be indexed, measured or passed on "
+                                    f"in native code")
                 if var_name not in named_vars:
-                    raise Exception(f"Unknown variable '{var_name}'")
-                return named_vars[var_name]
+                    # Unassigned variables read as 0, as in the interpreter.
+                    named_vars[var_name] = self.entry_alloca(builder, var_name)
+                return builder.load(named_vars[var_name], name=var_name)
 
-            elif t == "binary_op":
-                left = self.compile_expr(expr["left"], builder, named_vars)
-                right = self.compile_expr(expr["right"], builder, named_vars)
-                op = expr["op"]
+            elif t == OP_BINARY_OP:
+                left = self.compile_expr(expr.left, builder, named_vars)
+                right = self.compile_expr(expr.right, builder, named_vars)
+                op = expr.op
                 if op == "+":
-                    return builder.add(left, right, name="addtmp")
+                    return self.compile_checked(builder, builder.sadd_with_overflow, left, right, "addtmp")
                 elif op == "-":
-                    return builder.sub(left, right, name="subtmp")
+                    return self.compile_checked(builder, builder.ssub_with_overflow, left, right, "subtmp")
                 elif op == "*":
-                    return builder.mul(left, right, name="multmp")
+                    return self.compile_checked(builder, builder.smul_with_overflow, left, right, "multmp")
                 elif op == "/":
-                    return builder.sdiv(left, right, name="divtmp")
+                    return self.compile_divide(left, right, builder)
+                elif op in ("==", "!=", "<", ">", "<=", ">="):
+                    cmp = builder.icmp_signed(op, left, right, name="cmptmp")
+                    return builder.zext(cmp, ir.IntType(64), name="booltmp")
                 else:
                     raise Exception(f"Unsupported binary operation '{op}'")
-            elif t == "function_call":
-                func_name = expr["name"]
-                args = [self.compile_expr(arg, builder, named_vars) for arg in expr["args"]]
-                func = self.module.globals.get(func_name)
-                if not func or not isinstance(func, ir.Function):
-                    raise Exception(f"Function '{func_name}' not defined")
+            elif t == OP_FUNCTION_CALL:
+                return self.compile_call(expr, builder, named_vars)
 
-                return builder.call(func, args, name=f"call_{func_name}")
+            elif t == OP_INDEX:
+                index = self.compile_expr(expr.index, builder, named_vars)
+                return builder.load(self.element_pointer(expr.var, index, builder), name=f"{expr.var}_item")
+
+            elif t == OP_LENGTH:
+                array = expr.expr
+                if array.tag != OP_VARIABLE or array.name not in self.array_vars:
+                    raise Exception("len() of something other than an array parameter")
+                return self.array_vars[array.name][1]
+
+            elif t == OP_NEW_ARRAY:
+                raise Exception("Cannot allocate arrays in native code")
 
             else:
-                raise Exception(f"Unsupported expression type '{t}'")
+                raise Exception(f"Unsupported expression type '{expr.type}'")
         except Exception as e:
             print(f"[Expression Error] {e}")
             raise
 
-    def get_callable(self, func_name):
-        try:
-            func_ptr = self.engine.get_function_address(func_name)
+    def compile_divide(self, left, right, builder):
+        # Match the interpreter: x / 0 == 0 and the quotient is floored like
+        # Python's //. The divisor is replaced before sdiv so that neither
+        # 0 nor -1 can trap; INT64_MIN / -1 does not fit and bails out.
+        i64 = ir.IntType(64)
+        zero = ir.Constant(i64, 0)
+        one = ir.Constant(i64, 1)
+        minus_one = ir.Constant(i64, -1)
+        is_zero = builder.icmp_signed("==", right, zero)
+        is_minus_one = builder.icmp_signed("==", right, minus_one)
+        too_big = builder.and_(is_minus_one, builder.icmp_signed("==", left, ir.Constant(i64, INT64_MIN)))
+        self.guard(builder, too_big, "div")
+        safe = builder.select(builder.or_(is_zero, is_minus_one), one, right)
+        quot = builder.sdiv(left, safe, name="divtmp")
+        rem = builder.srem(left, safe)
+        signs_differ = builder.icmp_signed("<", builder.xor(rem, safe), zero)
+        needs_floor = builder.and_(builder.icmp_signed("!=", rem, zero), signs_differ)
+        quot = builder.sub(quot, builder.zext(needs_floor, i64))
+        quot = builder.select(is_minus_one, builder.neg(left), quot)
+        return builder.select(is_zero, zero, quot, name="floordiv")
 
-            if func_ptr == 0:
-                raise Exception(f"Function '{func_name}' not found in JIT")
+    def get_callable(self, func_ptr, nargs):
+        return native_function_type(nargs)(func_ptr)
 
-            def make_callable(nargs):
-                FUNC_TYPE = ctypes.CFUNCTYPE(ctypes.c_longlong, *([ctypes.c_longlong] * nargs))
-                return FUNC_TYPE(func_ptr)
+    def get_batch_callable(self, func_ptr, nargs):
+        column = ctypes.POINTER(ctypes.c_int64)
+        return ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.POINTER(column), column, ctypes.c_int64)(func_ptr)
 
-            return make_callable(5)
-        except Exception as e:
-            print(f"[Callable Error] Failed to get callable for '{func_name}': {e}")
-            raise
+    def get_loop_callable(self, func_ptr, nargs):
+        native = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int64))(func_ptr)
+
+        def run_loop(state, values):
+            slots = (ctypes.c_int64 * (len(values) + 1))(*values)
+            native(state, slots)
+            return list(slots)
+        return run_loop
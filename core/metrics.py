@@ -0,0 +1,134 @@
+import threading
+
+# Histogram bucket upper bounds, in seconds.
+SECONDS_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 0.01, 0.1, 1.0, 10.0)
+
+# Label sets per metric beyond which new ones are folded into "_other", so
+# user-chosen function names cannot grow the output without bound.
+MAX_SERIES = 200
+
+METRICS = {
+    "jit_parse_seconds_total": ("counter", "Time spent tokenizing and parsing programs."),
+    "jit_parse_cache_total": ("counter", "Parse cache lookups by result."),
+    "jit_optimize_seconds_total": ("counter", "Time spent in the AST optimizer."),
+    "jit_run_seconds_total": ("counter", "Time spent running programs in the interpreter and native code."),
+    "jit_runs_total": ("counter", "Programs and batches run, by kind and outcome."),
+    "jit_compile_seconds": ("histogram", "Time to compile one function, loop or batch kernel."),
+    "jit_compile_cache_total": ("counter", "JIT compile requests by where the code came from."),
+    "jit_compile_failures_total": ("counter", "Functions, loops or kernels that failed to compile."),
+    "jit_calls_total": ("counter", "Function calls made from the interpreter, by the tier that ran them."),
+    "jit_deopts_total": ("counter", "Native calls and loops that bailed out to the interpreter."),
+    "jit_loops_compiled_total": ("counter", "Hot loops compiled for on-stack replacement."),
+    "jit_sessions_closed_total": ("counter", "Sessions closed by the client, expired or evicted to save memory."),
+    "jit_function_call_seconds": ("histogram",
+                                  "Mean time per call of a function (callees included) in one run, weighted by calls."),
+}
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+def format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metrics:
+    # Process-wide counters and histograms, rendered in the Prometheus text
+    # format. Worker processes drain() theirs after every job and the web
+    # process merge()s what comes back.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        # (name, labels) -> [count per bucket..., count above the last, sum]
+        self.histograms = {}
+        self.series = {}
+
+    def key(self, name, labels):
+        key = (name, label_key(labels))
+        if key not in self.counters and key not in self.histograms:
+            if self.series.get(name, 0) >= MAX_SERIES:
+                key = (name, tuple((label, "_other") for label, _ in key[1]))
+                if key in self.counters or key in self.histograms:
+                    return key
+            self.series[name] = self.series.get(name, 0) + 1
+        return key
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            key = self.key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, count=1, **labels):
+        # Records count observations of value.
+        with self.lock:
+            key = self.key(name, labels)
+            buckets = self.histograms.get(key)
+            if buckets is None:
+                buckets = self.histograms[key] = [0] * (len(SECONDS_BUCKETS) + 2)
+            i = 0
+            while i < len(SECONDS_BUCKETS) and value > SECONDS_BUCKETS[i]:
+                i += 1
+            buckets[i] += count
+            buckets[-1] += value * count
+
+    def drain(self):
+        # Returns everything recorded so far as plain data and starts over.
+        with self.lock:
+            snapshot = {"counters": self.counters, "histograms": self.histograms}
+            self.counters = {}
+            self.histograms = {}
+            self.series = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        for (name, labels), value in snapshot["counters"].items():
+            self.inc(name, value, **dict(labels))
+        with self.lock:
+            for (name, labels), buckets in snapshot["histograms"].items():
+                key = self.key(name, dict(labels))
+                mine = self.histograms.get(key)
+                if mine is None:
+                    self.histograms[key] = list(buckets)
+                else:
+                    for i, value in enumerate(buckets):
+                        mine[i] += value
+
+    def render(self, gauges=()):
+        # gauges: extra (name, help, value) triples, e.g. for the pool.
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(buckets) for key, buckets in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                continue
+            for (metric, labels), buckets in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                total = 0
+                for bound, count in zip(SECONDS_BUCKETS, buckets):
+                    total += count
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', repr(bound))])} {total}")
+                total += buckets[-2]
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {total}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(buckets[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {total}")
+        for name, help_text, value in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Metrics()
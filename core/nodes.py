@@ -0,0 +1,219 @@
+# Integer opcode tags; code that walks the tree dispatches on node.tag.
+(OP_NUMBER, OP_VARIABLE, OP_BINARY_OP, OP_FUNCTION_CALL, OP_ASSIGN, OP_PRINT,
+ OP_IF, OP_WHILE, OP_FUNCTION_DEF, OP_RETURN, OP_PROGRAM, OP_NEW_ARRAY, OP_INDEX,
+ OP_INDEX_ASSIGN, OP_LENGTH) = range(15)
+
+class Node:
+    __slots__ = ()
+
+class Number(Node):
+    __slots__ = ("value",)
+    tag = OP_NUMBER
+    type = "number"
+    def __init__(self, value):
+        self.value = value
+    def __repr__(self):
+        return f"Number({self.value})"
+
+class Variable(Node):
+    __slots__ = ("name",)
+    tag = OP_VARIABLE
+    type = "variable"
+    def __init__(self, name):
+        self.name = name
+    def __repr__(self):
+        return f"Variable({self.name})"
+
+class BinaryOp(Node):
+    __slots__ = ("op", "left", "right")
+    tag = OP_BINARY_OP
+    type = "binary_op"
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+    def __repr__(self):
+        return f"BinaryOp({self.op}, {self.left}, {self.right})"
+
+class Assign(Node):
+    __slots__ = ("var", "expr")
+    tag = OP_ASSIGN
+    type = "assign"
+    def __init__(self, var, expr):
+        self.var = var
+        self.expr = expr
+    def __repr__(self):
+        return f"Assign({self.var}, {self.expr})"
+
+class Print(Node):
+    __slots__ = ("expr",)
+    tag = OP_PRINT
+    type = "print"
+    def __init__(self, expr):
+        self.expr = expr
+    def __repr__(self):
+        return f"Print({self.expr})"
+
+class If(Node):
+    __slots__ = ("cond", "body", "else_body")
+    tag = OP_IF
+    type = "if"
+    def __init__(self, cond, body, else_body=None):
+        self.cond = cond
+        self.body = body
+        self.else_body = else_body
+    def __repr__(self):
+        return f"If({self.cond}, {self.body}, Else: {self.else_body})"
+
+class While(Node):
+    __slots__ = ("cond", "body")
+    tag = OP_WHILE
+    type = "while"
+    def __init__(self, cond, body):
+        self.cond = cond
+        self.body = body
+    def __repr__(self):
+        return f"While({self.cond}, {self.body})"
+
+class FunctionDef(Node):
+    __slots__ = ("name", "params", "body")
+    tag = OP_FUNCTION_DEF
+    type = "function_def"
+    def __init__(self, name, params, body):
+        self.name = name
+        self.params = params
+        self.body = body
+    def __repr__(self):
+        return f"FunctionDef({self.name}, {self.params}, {self.body})"
+
+class FunctionCall(Node):
+    __slots__ = ("name", "args")
+    tag = OP_FUNCTION_CALL
+    type = "function_call"
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+    def __repr__(self):
+        return f"FunctionCall({self.name}, {self.args})"
+
+class Return(Node):
+    __slots__ = ("expr",)
+    tag = OP_RETURN
+    type = "return"
+    def __init__(self, expr):
+        self.expr = expr
+    def __repr__(self):
+        return f"Return({self.expr})"
+
+class Program(Node):
+    __slots__ = ("body",)
+    tag = OP_PROGRAM
+    type = "program"
+    def __init__(self, body):
+        self.body = body
+    def __repr__(self):
+        return f"Program({self.body})"
+
+class NewArray(Node):
+    __slots__ = ("size",)
+    tag = OP_NEW_ARRAY
+    type = "new_array"
+    def __init__(self, size):
+        self.size = size
+    def __repr__(self):
+        return f"NewArray({self.size})"
+
+class Index(Node):
+    __slots__ = ("var", "index")
+    tag = OP_INDEX
+    type = "index"
+    def __init__(self, var, index):
+        self.var = var
+        self.index = index
+    def __repr__(self):
+        return f"Index({self.var}, {self.index})"
+
+class IndexAssign(Node):
+    __slots__ = ("var", "index", "expr")
+    tag = OP_INDEX_ASSIGN
+    type = "index_assign"
+    def __init__(self, var, index, expr):
+        self.var = var
+        self.index = index
+        self.expr = expr
+    def __repr__(self):
+        return f"IndexAssign({self.var}, {self.index}, {self.expr})"
+
+class Length(Node):
+    __slots__ = ("expr",)
+    tag = OP_LENGTH
+    type = "length"
+    def __init__(self, expr):
+        self.expr = expr
+    def __repr__(self):
+        return f"Length({self.expr})"
+
+def to_dict(node):
+    # The JSON form of a tree, {"type": ..., <field>: ...} for every node,
+    # as returned by /run.
+    if isinstance(node, list):
+        return [to_dict(item) for item in node]
+    if isinstance(node, Node):
+        result = {"type": node.type}
+        for field in node.__slots__:
+            result[field] = to_dict(getattr(node, field))
+        return result
+    return node
+
+def walk(node):
+    # Every node under node (a node or a list of them), in no particular order.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, Node):
+            yield node
+            for field in node.__slots__:
+                value = getattr(node, field)
+                if isinstance(value, (list, Node)):
+                    stack.append(value)
+
+def iter_tree_lines(node):
+    # The indented text view shown in the UI, one line at a time. An explicit
+    # stack keeps it linear in the size of the tree and safe for deep ones;
+    # finished lines go on the stack as str, subtrees as (indent, value).
+    spacings = [""]
+    stack = [(0, node)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        entry = pop()
+        if entry.__class__ is str:
+            yield entry
+            continue
+        indent, value = entry
+        while len(spacings) <= indent + 1:
+            spacings.append(spacings[-1] + "  ")
+        spacing = spacings[indent]
+        child = indent + 1
+        if isinstance(value, Node):
+            fields = value.__slots__
+            for field in reversed(fields):
+                push((child, getattr(value, field)))
+                push(f"{spacing}{field}:\n")
+            push((child, value.type))
+            push(f"{spacing}type:\n")
+        elif isinstance(value, dict):
+            for key, item in reversed(list(value.items())):
+                push((child, item))
+                push(f"{spacing}{key}:\n")
+        elif isinstance(value, list):
+            for i in range(len(value) - 1, -1, -1):
+                push((child, value[i]))
+                push(f"{spacing}- item {i}:\n")
+        else:
+            yield f"{spacing}{value}\n"
+
+def render_tree(node):
+    return "".join(iter_tree_lines(node))
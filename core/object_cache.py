@@ -0,0 +1,103 @@
+import os
+import re
+import shutil
+import stat
+import tempfile
+
+# Names of the per-version directories ObjectCache makes; nothing else under
+# the root is ever removed.
+VERSION_DIR = re.compile(r"v\d+-llvm\d+(\.\d+)*")
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "jit-compiler")
+
+def check_private(path):
+    # Objects found here are linked into the process, so nobody but the
+    # current user may be able to put them there.
+    info = os.stat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise NotADirectoryError(f"'{path}' is not a directory")
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"'{path}' is not owned by the current user")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"'{path}' is writable by other users")
+
+class ObjectCache:
+    def __init__(self, directory, version, max_bytes=64 * 1024 * 1024):
+        if not VERSION_DIR.fullmatch(version):
+            raise ValueError(f"Invalid cache version '{version}'")
+        self.root = directory
+        self.version = version
+        self.directory = os.path.join(directory, version)
+        self.max_bytes = max_bytes
+        # The mode only applies to the last directory makedirs creates, so
+        # the root is made on its own first.
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        check_private(self.root)
+        check_private(self.directory)
+        self.remove_stale_versions()
+
+    def remove_stale_versions(self):
+        # Objects built by another compiler or LLVM version are never valid.
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name != self.version and VERSION_DIR.fullmatch(name) and os.path.isdir(path) \
+                    and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".o")
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def store(self, key, data):
+        # Write to a temp file in the same directory and rename it into
+        # place, so other workers never read a partially written object.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.enforce_limit()
+
+    def enforce_limit(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".o"):
+                continue
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, entry.path))
+            total += info.st_size
+        # Least recently used objects go first; load() refreshes mtime.
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        check_private(self.directory)
@@ -0,0 +1,335 @@
+import os
+
+from core.interpreter import BINARY_OPS, INT64_MAX, INT64_MIN
+from core.nodes import (
+    Node, Number, Variable, BinaryOp, Assign, Print, If, While, FunctionDef, FunctionCall, Return, Program,
+    NewArray, Index, IndexAssign, Length,
+    OP_NUMBER, OP_VARIABLE, OP_BINARY_OP, OP_FUNCTION_CALL, OP_ASSIGN, OP_PRINT, OP_IF, OP_WHILE,
+    OP_FUNCTION_DEF, OP_RETURN, OP_NEW_ARRAY, OP_INDEX, OP_INDEX_ASSIGN, OP_LENGTH,
+)
+
+# Set JIT_OPTIMIZE=0 to run programs exactly as parsed.
+OPTIMIZE = os.environ.get("JIT_OPTIMIZE", "1") != "0"
+
+COMPARISONS_OF_SELF = {"==": 1, "!=": 0, "<": 0, ">": 0, "<=": 1, ">=": 1}
+
+def scope_walk(node):
+    # Like nodes.walk, but does not enter function definitions, whose
+    # bodies have variables of their own.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, Node):
+            yield node
+            if node.tag == OP_FUNCTION_DEF:
+                continue
+            for field in node.__slots__:
+                value = getattr(node, field)
+                if isinstance(value, (list, Node)):
+                    stack.append(value)
+
+def assigned_names(node):
+    return {n.var for n in scope_walk(node) if n.tag == OP_ASSIGN}
+
+def read_names(node):
+    names = set()
+    for n in scope_walk(node):
+        if n.tag == OP_VARIABLE:
+            names.add(n.name)
+        elif n.tag == OP_INDEX or n.tag == OP_INDEX_ASSIGN:
+            names.add(n.var)
+    return names
+
+# Expressions with effects: calls (output, fuel, errors), and array
+# operations, which can fail and read memory that changes.
+EFFECT_TAGS = frozenset((OP_FUNCTION_CALL, OP_NEW_ARRAY, OP_INDEX, OP_LENGTH))
+
+# Expressions whose value is always an integer, if they do not fail.
+INT_TAGS = frozenset((OP_NUMBER, OP_BINARY_OP, OP_INDEX, OP_LENGTH))
+
+# Known integers in an env (name -> value) whose value is not known.
+INTEGER = object()
+
+def cannot_fail(expr, ints):
+    # Arithmetic and comparisons fail on arrays, so expr can only be
+    # dropped or moved if it has no effects and every variable it reads is
+    # in ints, the names known to hold integers.
+    for n in scope_walk(expr):
+        if n.tag in EFFECT_TAGS or (n.tag == OP_VARIABLE and n.name not in ints):
+            return False
+    return True
+
+def integer_names(node):
+    # Variables that every assignment in node gives an integer.
+    names = {}
+    for n in scope_walk(node):
+        if n.tag == OP_ASSIGN:
+            names[n.var] = names.get(n.var, True) and n.expr.tag in INT_TAGS
+    return {name for name, always in names.items() if always}
+
+def optimize(program):
+    # Returns an optimized copy of program, which is left untouched: parsed
+    # ASTs are cached and shared.
+    return Program(Optimizer().scope(program.body, top_level=True))
+
+class Optimizer:
+    # Constant folding and propagation, algebraic identities, dead branch
+    # and unused assignment removal, and loop-invariant hoisting. Nothing
+    # the program prints, returns or spends in fuel may change.
+    def __init__(self):
+        self.temps = 0
+
+    def scope(self, body, params=(), top_level=False):
+        # One function body, or the top level. Every scope starts with
+        # nothing known: parameters and the top level's inputs may be
+        # arrays, and what is known outside cannot leak in.
+        body, _ = self.block(body, {})
+        return self.remove_unused(body, params, top_level)
+
+    def block(self, stmts, env):
+        # Optimizes stmts with env (name -> known value, or INTEGER) updated
+        # as it goes. Returns (statements, whether the block always returns).
+        result = []
+        for stmt in stmts:
+            if self.stmt(stmt, env, result):
+                return result, True
+        return result, False
+
+    def stmt(self, stmt, env, out):
+        # Appends the optimized stmt to out; True if it always returns.
+        t = stmt.tag
+        if t == OP_ASSIGN:
+            value = self.expr(stmt.expr, env)
+            if value.tag == OP_NUMBER:
+                env[stmt.var] = value.value
+            elif self.is_integer(value, env):
+                env[stmt.var] = INTEGER
+            else:
+                env.pop(stmt.var, None)
+            out.append(stmt if value is stmt.expr else Assign(stmt.var, value))
+        elif t == OP_PRINT:
+            value = self.expr(stmt.expr, env)
+            out.append(stmt if value is stmt.expr else Print(value))
+        elif t == OP_RETURN:
+            value = self.expr(stmt.expr, env)
+            out.append(stmt if value is stmt.expr else Return(value))
+            return True
+        elif t == OP_IF:
+            cond = self.expr(stmt.cond, env)
+            if cond.tag == OP_NUMBER:
+                # Only one branch can run; its statements take the place of
+                # the if, as blocks have no scope of their own.
+                taken = stmt.body if cond.value else stmt.else_body or []
+                for inner in taken:
+                    if self.stmt(inner, env, out):
+                        return True
+                return False
+            removable = cannot_fail(cond, env)
+            then_env = dict(env)
+            body, then_returns = self.block(stmt.body, then_env)
+            else_env = dict(env)
+            else_body, else_returns = self.block(stmt.else_body or [], else_env)
+            if then_returns and else_returns:
+                merged = {}
+            elif then_returns:
+                merged = else_env
+            elif else_returns:
+                merged = then_env
+            else:
+                merged = {name: value if else_env[name] == value else INTEGER
+                          for name, value in then_env.items() if name in else_env}
+            env.clear()
+            env.update(merged)
+            if not body and not else_body and removable:
+                return False
+            out.append(If(cond, body, else_body if else_body else None))
+            return then_returns and else_returns
+        elif t == OP_WHILE:
+            # The body may run any number of times, so nothing it assigns is
+            # known inside the loop or after it, beyond being an integer if
+            # it was one before and every assignment keeps it one.
+            ints = integer_names(stmt)
+            for name in assigned_names(stmt):
+                if name in env and name in ints:
+                    env[name] = INTEGER
+                else:
+                    env.pop(name, None)
+            cond = self.expr(stmt.cond, env)
+            if cond.tag == OP_NUMBER and not cond.value:
+                return False
+            body, _ = self.block(stmt.body, dict(env))
+            self.hoist(While(cond, body), out, env)
+        elif t == OP_INDEX_ASSIGN:
+            index = self.expr(stmt.index, env)
+            value = self.expr(stmt.expr, env)
+            if index is stmt.index and value is stmt.expr:
+                out.append(stmt)
+            else:
+                out.append(IndexAssign(stmt.var, index, value))
+        elif t == OP_FUNCTION_DEF:
+            out.append(FunctionDef(stmt.name, stmt.params, Optimizer().scope(stmt.body, stmt.params)))
+        else:
+            out.append(stmt)
+        return False
+
+    def expr(self, expr, env):
+        t = expr.tag
+        if t == OP_VARIABLE:
+            value = env.get(expr.name)
+            return expr if value is None or value is INTEGER else Number(value)
+        elif t == OP_BINARY_OP:
+            return self.binary_op(expr, env)
+        elif t == OP_FUNCTION_CALL:
+            args = [self.expr(arg, env) for arg in expr.args]
+            if all(new is old for new, old in zip(args, expr.args)):
+                return expr
+            return FunctionCall(expr.name, args)
+        elif t == OP_INDEX:
+            index = self.expr(expr.index, env)
+            return expr if index is expr.index else Index(expr.var, index)
+        elif t == OP_NEW_ARRAY:
+            size = self.expr(expr.size, env)
+            return expr if size is expr.size else NewArray(size)
+        elif t == OP_LENGTH:
+            value = self.expr(expr.expr, env)
+            return expr if value is expr.expr else Length(value)
+        return expr
+
+    def binary_op(self, expr, env):
+        op = expr.op
+        left = self.expr(expr.left, env)
+        right = self.expr(expr.right, env)
+        if left.tag == OP_NUMBER and right.tag == OP_NUMBER:
+            value = BINARY_OPS[op](left.value, right.value)
+            # Larger constants would keep the function out of the JIT.
+            if INT64_MIN <= value <= INT64_MAX:
+                return Number(value)
+        else:
+            simplified = self.identity(op, left, right, env)
+            if simplified is not None:
+                return simplified
+        if left is expr.left and right is expr.right:
+            return expr
+        return BinaryOp(op, left, right)
+
+    def is_integer(self, expr, env):
+        return expr.tag in INT_TAGS or (expr.tag == OP_VARIABLE and expr.name in env)
+
+    def identity(self, op, left, right, env):
+        # x + 0, x * 1, x / 1, x * 0, x - x, x == x and friends. An operand
+        # is only kept on its own if it is an integer (an array would have
+        # made the operation fail), and only dropped if it cannot fail.
+        lvalue = left.value if left.tag == OP_NUMBER else None
+        rvalue = right.value if right.tag == OP_NUMBER else None
+        if op == "+":
+            if lvalue == 0 and self.is_integer(right, env):
+                return right
+            if rvalue == 0 and self.is_integer(left, env):
+                return left
+        elif op == "-":
+            if rvalue == 0 and self.is_integer(left, env):
+                return left
+        elif op == "*":
+            if lvalue == 1 and self.is_integer(right, env):
+                return right
+            if rvalue == 1 and self.is_integer(left, env):
+                return left
+            if (lvalue == 0 and cannot_fail(right, env)) or (rvalue == 0 and cannot_fail(left, env)):
+                return Number(0)
+        elif op == "/":
+            if rvalue == 1 and self.is_integer(left, env):
+                return left
+            # x / 0 is 0, and so is 0 / x.
+            if (rvalue == 0 and cannot_fail(left, env)) or (lvalue == 0 and cannot_fail(right, env)):
+                return Number(0)
+        if left.tag == OP_VARIABLE and right.tag == OP_VARIABLE and left.name == right.name \
+                and left.name in env:
+            if op == "-":
+                return Number(0)
+            if op in COMPARISONS_OF_SELF:
+                return Number(COMPARISONS_OF_SELF[op])
+        return None
+
+    def hoist(self, loop, out, env):
+        # Computes the loop's invariant subexpressions (arithmetic on known
+        # integers the loop does not assign) once, into temporaries
+        # assigned just before it. Evaluating them when the loop runs zero
+        # times is harmless since they cannot fail.
+        assigned = assigned_names(loop)
+        hoisted = {}
+        def invariant(expr):
+            if expr.tag == OP_BINARY_OP:
+                return invariant(expr.left) and invariant(expr.right)
+            if expr.tag == OP_VARIABLE:
+                return expr.name not in assigned and expr.name in env
+            return expr.tag == OP_NUMBER
+        def rewrite(expr):
+            t = expr.tag
+            if t == OP_BINARY_OP:
+                if invariant(expr):
+                    key = repr(expr)
+                    temp = hoisted.get(key)
+                    if temp is None:
+                        # Not a valid identifier, so it cannot clash with
+                        # the program's own names.
+                        temp = hoisted[key] = f"licm${self.temps}"
+                        self.temps += 1
+                        out.append(Assign(temp, expr))
+                    return Variable(temp)
+                left, right = rewrite(expr.left), rewrite(expr.right)
+                if left is expr.left and right is expr.right:
+                    return expr
+                return BinaryOp(expr.op, left, right)
+            if t == OP_FUNCTION_CALL:
+                args = [rewrite(arg) for arg in expr.args]
+                if all(new is old for new, old in zip(args, expr.args)):
+                    return expr
+                return FunctionCall(expr.name, args)
+            return expr
+        def rewrite_block(stmts):
+            return [rewrite_stmt(stmt) for stmt in stmts]
+        def rewrite_stmt(stmt):
+            t = stmt.tag
+            if t == OP_ASSIGN:
+                return Assign(stmt.var, rewrite(stmt.expr))
+            if t == OP_PRINT:
+                return Print(rewrite(stmt.expr))
+            if t == OP_RETURN:
+                return Return(rewrite(stmt.expr))
+            if t == OP_IF:
+                else_body = rewrite_block(stmt.else_body) if stmt.else_body is not None else None
+                return If(rewrite(stmt.cond), rewrite_block(stmt.body), else_body)
+            if t == OP_WHILE:
+                return While(rewrite(stmt.cond), rewrite_block(stmt.body))
+            return stmt
+        out.append(While(rewrite(loop.cond), rewrite_block(loop.body)))
+
+    def remove_unused(self, body, params=(), top_level=False):
+        # Drops assignments to variables the scope never reads whose value
+        # cannot fail. Repeated, since each removal can leave another
+        # variable unread. The top level's arrays are part of /run's
+        # response, so there only constants, which cannot be arrays, go.
+        while True:
+            reads = read_names(body)
+            ints = integer_names(body) - set(params)
+            removed = [False]
+            def prune(stmts):
+                result = []
+                for stmt in stmts:
+                    t = stmt.tag
+                    if t == OP_ASSIGN and stmt.var not in reads and cannot_fail(stmt.expr, ints) \
+                            and (not top_level or stmt.expr.tag == OP_NUMBER):
+                        removed[0] = True
+                        continue
+                    if t == OP_IF:
+                        else_body = prune(stmt.else_body) if stmt.else_body is not None else None
+                        stmt = If(stmt.cond, prune(stmt.body), else_body)
+                    elif t == OP_WHILE:
+                        stmt = While(stmt.cond, prune(stmt.body))
+                    result.append(stmt)
+                return result
+            body = prune(body)
+            if not removed[0]:
+                return body
@@ -0,0 +1,267 @@
+import ctypes
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from core.arrays import index_error
+
+# What the interpreter and native code share at run time: the callbacks
+# compiled code makes, its fuel countdown, and access to the engine. Nothing
+# here needs LLVM, which is only imported once something gets hot enough to
+# compile (see get_shared_jit).
+
+PRINT_SYMBOL = "jit_print_i64"
+CALL_SYMBOL = "jit_call_interpreter"
+BUDGET_CHECK_SYMBOL = "jit_check_budget"
+DEOPT_SYMBOL = "jit_deopt"
+INDEX_ERROR_SYMBOL = "jit_index_error"
+STACK_OVERFLOW_SYMBOL = "jit_stack_overflow"
+
+# Compiled loops call back into the interpreter to charge fuel and check the
+# deadline once every NATIVE_BUDGET_INTERVAL iterations, or sooner when less
+# fuel than that is left.
+NATIVE_BUDGET_INTERVAL = 1 << 16
+
+# Stack native functions may use below the first native frame on a thread
+# (threads get 8 MB on Linux by default). Recursion deeper than that fails
+# like deep recursion in the interpreter, instead of crashing the process.
+NATIVE_STACK_BYTES = 4 << 20
+
+class NativeState(ctypes.Structure):
+    # Per-interpreter state native code works with, passed by address as
+    # the hidden first argument of every compiled function, loop and batch
+    # kernel. budget is the fuel countdown shared by the interpreter's
+    # native loops: each keeps a local copy in a register and writes it
+    # back before calls and when it exits; callbacks zero it to make loops
+    # check in. seed (not seen by native code) is what the countdown last
+    # started from, so seed - budget iterations have run since. failed
+    # says why native code has to stop (FAILED_DEOPT or FAILED_ERROR), and
+    # printed counts the lines native code and its callees have printed.
+    # stack_limit is the lowest stack address native functions may use,
+    # set by the first one to run after running() has zeroed it.
+    _fields_ = [("budget", ctypes.c_int64), ("failed", ctypes.c_int64), ("printed", ctypes.c_int64),
+                ("stack_limit", ctypes.c_uint64)]
+
+    def __init__(self):
+        super().__init__(NATIVE_BUDGET_INTERVAL, 0, 0, 0)
+        self.seed = NATIVE_BUDGET_INTERVAL
+
+    def reseed(self, budget):
+        self.budget = self.seed = budget
+
+    def clear(self, budget):
+        # Once the interpreter has dealt with a failure. The countdown was
+        # zeroed to stop native code, not because it ran out, so the work
+        # since the last check is not charged; a deopt redoes it anyway.
+        self.failed = 0
+        self.reseed(budget)
+
+FAILED_DEOPT = 1
+FAILED_ERROR = 2
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+OPT_LEVELS = (0, 1, 2, 3)
+DEFAULT_OPT_LEVEL = 2
+
+# Starting estimate of compile time: a fixed cost per function plus a cost
+# per AST node. Measured compiles rescale it per optimization level.
+COMPILE_BASE_SECONDS = 0.004
+COMPILE_NODE_SECONDS = 0.0003
+
+def estimate_compile_time(size, scale=1.0):
+    # Seconds to compile a function of size AST nodes.
+    return (COMPILE_BASE_SECONDS + COMPILE_NODE_SECONDS * size) * scale
+
+# The Interpreter currently running native code on this thread; runtime
+# callbacks from compiled code are routed to it.
+runtime_state = threading.local()
+
+class Deoptimized(Exception):
+    # Parked in Interpreter.native_error when compiled code fails a guard
+    # (a result that does not fit in 64 bits). The interpreter then reruns
+    # the call or loop from where native code was entered.
+    pass
+
+def park(interpreter, error):
+    # Errors cannot unwind through native frames, so they are parked on the
+    # interpreter and re-raised once the outermost native call returns. The
+    # first one wins; running native loops are made to check in (and abort)
+    # right away.
+    state = interpreter.native_state
+    if interpreter.native_error is None:
+        interpreter.native_error = error
+        state.failed = FAILED_DEOPT if error.__class__ is Deoptimized else FAILED_ERROR
+    state.budget = 0
+
+@ctypes.CFUNCTYPE(None, ctypes.c_int64)
+def jit_print(value):
+    interpreter = getattr(runtime_state, "interpreter", None)
+    # Once native code has failed, what it prints is thrown away anyway.
+    if interpreter is not None and interpreter.native_error is None:
+        interpreter.output.append(str(value))
+
+@ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int64), ctypes.c_int64)
+def jit_call_interpreter(name, args, nargs):
+    # Trampoline for calls to functions that are not compiled (yet).
+    interpreter = getattr(runtime_state, "interpreter", None)
+    if interpreter is None or interpreter.native_error is not None:
+        return 0
+    state = interpreter.native_state
+    printed = state.printed
+    mark = len(interpreter.output)
+    try:
+        result = interpreter.call_function(name.decode("utf-8"), args[:nargs])
+    except Exception as e:
+        park(interpreter, e)
+        return 0
+    # What the callee printed counts as printed by the caller, whatever
+    # native code it ran in turn.
+    state.printed = printed + len(interpreter.output) - mark
+    if result.__class__ is not int or not INT64_MIN <= result <= INT64_MAX:
+        # A big integer, or an array: the interpreter has to take over.
+        park(interpreter, Deoptimized(f"Result of '{name.decode('utf-8')}' does not fit in 64 bits"))
+        return 0
+    return result
+
+@ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.POINTER(NativeState))
+def jit_check_budget(state):
+    # Returns 1 when native code must abort; the reason is parked on the
+    # interpreter like trampoline errors. The state is the one the native
+    # code was entered with, so its countdown covers this interpreter's
+    # loops alone, and only the iterations they ran are charged to it.
+    state = state.contents
+    interpreter = getattr(runtime_state, "interpreter", None)
+    if interpreter is None:
+        state.reseed(NATIVE_BUDGET_INTERVAL)
+        return 0
+    if interpreter.native_error is not None:
+        state.budget = 0
+        return 1
+    try:
+        interpreter.settle_native()
+    except Exception as e:
+        park(interpreter, e)
+        return 1
+    return 0
+
+@ctypes.CFUNCTYPE(None)
+def jit_deopt():
+    interpreter = getattr(runtime_state, "interpreter", None)
+    if interpreter is not None:
+        park(interpreter, Deoptimized("Integer overflow in native code"))
+
+@ctypes.CFUNCTYPE(None, ctypes.c_int64, ctypes.c_int64)
+def jit_index_error(index, length):
+    # An array access out of bounds: the same error the interpreter raises.
+    interpreter = getattr(runtime_state, "interpreter", None)
+    if interpreter is not None:
+        park(interpreter, index_error(index, length))
+
+@ctypes.CFUNCTYPE(None)
+def jit_stack_overflow():
+    interpreter = getattr(runtime_state, "interpreter", None)
+    if interpreter is not None:
+        park(interpreter, RecursionError("maximum recursion depth exceeded in native code"))
+
+def runtime_symbols():
+    # What compiled code may call outside itself, by symbol.
+    return {
+        PRINT_SYMBOL: ctypes.cast(jit_print, ctypes.c_void_p).value,
+        CALL_SYMBOL: ctypes.cast(jit_call_interpreter, ctypes.c_void_p).value,
+        BUDGET_CHECK_SYMBOL: ctypes.cast(jit_check_budget, ctypes.c_void_p).value,
+        DEOPT_SYMBOL: ctypes.cast(jit_deopt, ctypes.c_void_p).value,
+        INDEX_ERROR_SYMBOL: ctypes.cast(jit_index_error, ctypes.c_void_p).value,
+        STACK_OVERFLOW_SYMBOL: ctypes.cast(jit_stack_overflow, ctypes.c_void_p).value,
+    }
+
+# Code removed from an engine while native code may still be executing it.
+# Each call to running() has its own list of the entries retired while it was
+# inside; an entry is unloaded as soon as the last of those calls has left,
+# whatever other threads entered since.
+class Retired:
+    def __init__(self, jit, entry, holders):
+        self.jit = jit
+        self.entry = entry
+        self.holders = holders
+
+inside = {}
+next_visit = itertools.count()
+active_lock = threading.Lock()
+
+@contextmanager
+def running(interpreter):
+    # Native print and trampoline calls made on this thread are routed
+    # to this interpreter (its output buffer and call_function).
+    previous = getattr(runtime_state, "interpreter", None)
+    runtime_state.interpreter = interpreter
+    if previous is not interpreter:
+        interpreter.native_state.reseed(interpreter.native_allowance())
+        # This may be another thread, with another stack.
+        interpreter.native_state.stack_limit = 0
+    visit = next(next_visit)
+    with active_lock:
+        inside[visit] = []
+    try:
+        yield
+        # Whatever native loops ran since they last checked in.
+        if interpreter.native_error is None:
+            interpreter.settle_native()
+    finally:
+        runtime_state.interpreter = previous
+        released = []
+        with active_lock:
+            for retired in inside.pop(visit):
+                retired.holders -= 1
+                if not retired.holders:
+                    released.append(retired)
+        # Nothing can reach this code any more: callables are gone and code
+        # calling it directly was retired along with it.
+        for retired in released:
+            with retired.jit.lock:
+                retired.jit.remove_code(retired.entry)
+
+def retire(jit, entry):
+    # Removes entry's code from jit now if no native code is running, or
+    # once every call to running() that might be executing it has left.
+    # Called with jit.lock held.
+    with active_lock:
+        if inside and jit.engine.unmaps_code:
+            retired = Retired(jit, entry, len(inside))
+            for held in inside.values():
+                held.append(retired)
+            return
+    jit.remove_code(entry)
+
+# Hot functions and loops are compiled on a background thread while the
+# interpreter keeps running them; JIT_BACKGROUND_COMPILE=0 compiles them
+# inline instead.
+BACKGROUND_COMPILE = os.environ.get("JIT_BACKGROUND_COMPILE", "1") != "0"
+
+_shared_jit = None
+_shared_jit_lock = threading.Lock()
+_compile_executor = None
+
+def get_shared_jit(create=True):
+    # One engine per worker process; every Interpreter reuses it so hot
+    # functions compiled by earlier requests stay available. Importing
+    # llvmlite and starting LLVM happen here, on first use; with
+    # create=False this returns None until then.
+    global _shared_jit
+    with _shared_jit_lock:
+        if _shared_jit is None and create:
+            from core.jit_compiler import JITCompiler
+            _shared_jit = JITCompiler()
+        return _shared_jit
+
+def get_compile_executor():
+    # One compiler thread per process: compiles hold the engine lock anyway,
+    # and LLVM releases the GIL while it optimizes and emits code.
+    global _compile_executor
+    with _shared_jit_lock:
+        if _compile_executor is None:
+            _compile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jit-compile")
+        return _compile_executor
@@ -0,0 +1,161 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from core.interpreter import Interpreter, parse_code
+from core.metrics import registry
+from core.nodes import walk
+from core.optimizer import OPTIMIZE
+
+# Rough memory per AST node of a session: the node itself, its lowered
+# closures, frames and profiles (about 320 bytes measured), rounded up.
+NODE_BYTES = 400
+
+class SessionNotFound(Exception):
+    pass
+
+class SessionStoreFull(Exception):
+    pass
+
+class Session:
+    # A program compiled once and kept around, with its interpreter, so its
+    # functions can be called many times and stay hot between calls.
+    def __init__(self, session_id, interpreter, program_size):
+        self.id = session_id
+        self.interpreter = interpreter
+        self.program_size = program_size
+        self.size = self.measure()
+        # Interpreters are not thread-safe: calls on one session take turns.
+        self.lock = threading.Lock()
+        self.created = self.last_used = time.monotonic()
+        self.calls = 0
+
+    def measure(self):
+        # The program's estimate plus the memory of the arrays its top level
+        # holds, each counted once however many variables refer to it.
+        arrays = {id(array): array for array in self.interpreter.get_arrays().values()}
+        return self.program_size + 8 * sum(array.length for array in arrays.values())
+
+    def functions(self):
+        return {name: list(func.params) for name, func in self.interpreter.functions.items()}
+
+    def call(self, func_name, args, fuel=None, timeout=None):
+        # Returns (result, printed lines) of one call.
+        interpreter = self.interpreter
+        with self.lock:
+            # Cleared in place: the program's print statements hold on to
+            # the list.
+            del interpreter.output[:]
+            interpreter.reset_budget(fuel, timeout)
+            with interpreter.metered("call"):
+                result = interpreter.call(func_name, args)
+            self.calls += 1
+            return result, list(interpreter.output)
+
+class SessionStore:
+    # Sessions by id, least recently used first. Sessions idle for longer
+    # than ttl seconds are dropped, and the least recently used ones are
+    # evicted when their estimated size would exceed max_bytes.
+    def __init__(self, ttl=600.0, max_bytes=256 << 20):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sessions = OrderedDict()
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def create(self, code, opt_level=None, fuel=None, timeout=None, tiering=None):
+        # Runs the program's top level, which defines its functions, and
+        # returns (session, printed lines).
+        ast = parse_code(code, OPTIMIZE)
+        size = len(code) + NODE_BYTES * sum(1 for _ in walk(ast.body))
+        if size > self.max_bytes:
+            raise SessionStoreFull(f"Program needs about {size} bytes, more than the "
+                                   f"{self.max_bytes} allowed for sessions")
+        interpreter = Interpreter(ast, opt_level=opt_level, fuel=fuel, timeout=timeout, tiering=tiering)
+        with interpreter.metered("session"):
+            output = list(interpreter.run())
+        session = Session(secrets.token_hex(16), interpreter, size)
+        if session.size > self.max_bytes:
+            raise SessionStoreFull(f"Program holds about {session.size} bytes, more than the "
+                                   f"{self.max_bytes} allowed for sessions")
+        with self.lock:
+            self.expire()
+            self.sessions[session.id] = session
+            self.used += session.size
+            self.make_room()
+        return session, output
+
+    def call(self, session, func_name, args, fuel=None, timeout=None):
+        # Session.call, after which the session's size is taken again and
+        # least recently used sessions are evicted if the store is over
+        # max_bytes; one that outgrew it on its own goes too.
+        try:
+            return session.call(func_name, args, fuel, timeout)
+        finally:
+            size = session.measure()
+            with self.lock:
+                if session.id in self.sessions:
+                    self.used += size - session.size
+                    session.size = size
+                    self.make_room()
+
+    def make_room(self):
+        while self.used > self.max_bytes:
+            self.remove(next(iter(self.sessions)), "evicted")
+
+    def get(self, session_id):
+        with self.lock:
+            self.expire()
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise SessionNotFound(f"Session {session_id} not found or expired")
+            session.last_used = time.monotonic()
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id):
+        with self.lock:
+            self.expire()
+            if session_id not in self.sessions:
+                raise SessionNotFound(f"Session {session_id} not found or expired")
+            self.remove(session_id, "closed")
+
+    def expire(self):
+        # Idle sessions are at the front, so this stops at the first live one.
+        cutoff = time.monotonic() - self.ttl
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_used > cutoff:
+                break
+            self.remove(session_id, "expired")
+
+    def remove(self, session_id, reason):
+        # A call still running on the session finishes; later ones fail.
+        session = self.sessions.pop(session_id)
+        self.used -= session.size
+        registry.inc("jit_sessions_closed_total", reason=reason)
+
+    def stats(self):
+        with self.lock:
+            self.expire()
+            return {"sessions": len(self.sessions), "bytes": self.used, "max_bytes": self.max_bytes,
+                    "ttl": self.ttl}
+
+_sessions = None
+_sessions_lock = threading.Lock()
+
+def get_sessions():
+    global _sessions
+    with _sessions_lock:
+        if _sessions is None:
+            ttl = float(os.environ.get("JIT_SESSION_TTL", "600"))
+            max_bytes = int(float(os.environ.get("JIT_SESSION_MEMORY_MB", "256")) * (1 << 20))
+            _sessions = SessionStore(ttl, max_bytes)
+        return _sessions
+
+def session_stats():
+    # None until the first session has started the store.
+    with _sessions_lock:
+        return _sessions.stats() if _sessions is not None else None
@@ -0,0 +1,140 @@
+from core.nodes import OP_FUNCTION_CALL, walk
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+class FunctionProfile:
+    # What the interpreter has observed about one function definition.
+    def __init__(self, func):
+        self.params = func.params
+        self.size = 0
+        self.callees = set()
+        for node in walk(func.body):
+            self.size += 1
+            if node.tag == OP_FUNCTION_CALL:
+                self.callees.add(node.name)
+        self.calls = 0
+        self.interpreted_calls = 0
+        self.interpreted_time = 0.0
+        # Native calls are only timed until the function gets the fast path.
+        self.sampled_calls = 0
+        self.sampled_time = 0.0
+        self.loop_iterations = 0
+        # Interpreted calls of the function that have not returned yet.
+        self.depth = 0
+        # Native calls that bailed out and were redone in the interpreter.
+        self.deopts = 0
+        self.arg_first = None
+        self.arg_min = None
+        self.arg_max = None
+        self.arg_constant = None
+
+    def record_args(self, args):
+        # Missing arguments are bound as 0 and extra ones are ignored.
+        n = len(self.params)
+        if len(args) < n:
+            args = args + [0] * (n - len(args))
+        if self.arg_first is None:
+            # Arrays are recorded as None: they have no range, and are never
+            # compiled in as constants.
+            self.arg_first = [value if value.__class__ is int else None for value in args[:n]]
+            self.arg_min = list(self.arg_first)
+            self.arg_max = list(self.arg_first)
+            self.arg_constant = [value is not None for value in self.arg_first]
+            return
+        lows, highs, constant, first = self.arg_min, self.arg_max, self.arg_constant, self.arg_first
+        for i in range(n):
+            value = args[i]
+            if value.__class__ is not int:
+                constant[i] = False
+            elif lows[i] is None:
+                lows[i] = highs[i] = value
+            elif value < lows[i]:
+                lows[i] = value
+            elif value > highs[i]:
+                highs[i] = value
+            if constant[i] and value != first[i]:
+                constant[i] = False
+
+    def constant_args(self, min_calls):
+        # [(index, value)] for parameters that had the same value on every
+        # interpreted call, once there have been at least min_calls of them.
+        if not min_calls or self.interpreted_calls < min_calls or self.arg_first is None:
+            return []
+        return [
+            (i, value)
+            for i, value in enumerate(self.arg_first)
+            if self.arg_constant[i] and INT64_MIN <= value <= INT64_MAX
+        ]
+
+    def to_dict(self, tier):
+        result = {
+            "tier": tier,
+            "calls": self.calls,
+            "interpreted_calls": self.interpreted_calls,
+            "interpreted_ms": round(self.interpreted_time * 1000, 3),
+            "native_calls": self.calls - self.interpreted_calls,
+            "loop_iterations": self.loop_iterations,
+            "deopts": self.deopts,
+            "args": {},
+        }
+        if self.arg_first is not None:
+            for i, param in enumerate(self.params):
+                result["args"][param] = {
+                    "min": self.arg_min[i],
+                    "max": self.arg_max[i],
+                    "constant": self.arg_first[i] if self.arg_constant[i] else None,
+                }
+        return result
+
+class TieringPolicy:
+    # When the interpreter hands a function to the JIT. Between min_calls and
+    # max_calls a function is compiled once the interpreted time it would
+    # save pays for the estimated compile time, assuming it will be called
+    # as often again as it has been so far. A function recursing max_depth
+    # interpreted calls deep is compiled right away: it would run out of
+    # Python stack long before it returned to be counted.
+    OPTIONS = ("min_calls", "max_calls", "expected_speedup", "specialize_calls", "max_depth")
+
+    def __init__(self, min_calls=2, max_calls=1000, expected_speedup=20.0, specialize_calls=8, max_depth=50):
+        if not isinstance(min_calls, int) or min_calls < 1:
+            raise Exception("min_calls must be a positive integer")
+        if not isinstance(max_calls, int) or max_calls < min_calls:
+            raise Exception("max_calls must be an integer no smaller than min_calls")
+        if not isinstance(expected_speedup, (int, float)) or expected_speedup <= 1:
+            raise Exception("expected_speedup must be a number greater than 1")
+        if not isinstance(specialize_calls, int) or specialize_calls < 0:
+            raise Exception("specialize_calls must be a non-negative integer")
+        if not isinstance(max_depth, int) or max_depth < 1:
+            raise Exception("max_depth must be a positive integer")
+        self.min_calls = min_calls
+        self.max_calls = max_calls
+        self.expected_speedup = expected_speedup
+        # Parameters seen with one value on this many interpreted calls are
+        # compiled in as constants behind a guard; 0 turns that off.
+        self.specialize_calls = specialize_calls
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_dict(cls, options):
+        if not isinstance(options, dict):
+            raise Exception("tiering must be an object")
+        for key in options:
+            if key not in cls.OPTIONS:
+                raise Exception(f"Unknown tiering option '{key}', expected one of {cls.OPTIONS}")
+        return cls(**options)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.OPTIONS}
+
+    def should_compile(self, profile, compile_time):
+        calls = profile.calls
+        if calls < self.min_calls:
+            return False
+        if calls >= self.max_calls or profile.depth >= self.max_depth:
+            return True
+        if not profile.interpreted_calls:
+            return False
+        per_call = profile.interpreted_time / profile.interpreted_calls
+        saving = per_call * (1 - 1 / self.expected_speedup) * calls
+        return saving >= compile_time
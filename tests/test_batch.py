@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from core.interpreter import eval_batch, parse_code
+
+CODE = "def f(a, b) { return a * b; }"
+
+def test_results():
+    results, _, _ = eval_batch(parse_code(CODE), "f", [[1, 2, 3], np.array([4, 5, 6])])
+    assert results.tolist() == [4, 10, 18]
+
+@pytest.mark.parametrize("column", [[1 << 63], [-(1 << 63) - 1], [1.5], ["1"]])
+def test_inputs_must_be_int64(column):
+    with pytest.raises(Exception, match="Batch inputs must be arrays of 64-bit integers"):
+        eval_batch(parse_code(CODE), "f", [column, [1]])
+
+def test_results_that_overflow_are_reported():
+    with pytest.raises(Exception, match="'f' returned 18446744073709551616 for row 1, which does not fit in 64 bits"):
+        eval_batch(parse_code(CODE), "f", [[1, 1 << 62], [1, 4]])
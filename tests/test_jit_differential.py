@@ -0,0 +1,276 @@
+import sys
+
+import pytest
+
+from core.interpreter import RECURSION_LIMIT, Interpreter, parse_code
+from core.jit_compiler import JITCompiler
+from core.tiering import TieringPolicy
+
+# Every case runs the same calls through a purely interpreted program and one
+# whose functions are compiled after their first call, and expects the same
+# return values and printed lines from both.
+
+INT64_MAX = (1 << 63) - 1
+INT64_MIN = -(1 << 63)
+
+COMPARISONS = {
+    op: f"def cmp(a, b) {{ return a {op} b; }}"
+    for op in ("==", "!=", "<", ">", "<=", ">=")
+}
+
+PAIRS = [(0, 0), (1, 2), (2, 1), (-3, -3), (-5, 4), (4, -5), (INT64_MIN, INT64_MAX)]
+
+CASES = {
+    "if_else": ("""
+        def sign(x) {
+            if (x > 0) { return 1; } else { if (x < 0) { return 0 - 1; } else { return 0; } }
+        }
+    """, "sign", [(5,), (-5,), (0,)]),
+    "if_without_else": ("""
+        def clamp(x) {
+            y = x;
+            if (x > 10) { y = 10; }
+            return y;
+        }
+    """, "clamp", [(3,), (10,), (11,), (-20,)]),
+    "nested_branches_in_loop": ("""
+        def classify(n) {
+            s = 0;
+            i = 0;
+            while (i < n) {
+                if (i / 3 * 3 == i) { s = s + 100; } else { if (i / 2 * 2 == i) { s = s + 10; } else { s = s + 1; } }
+                i = i + 1;
+            }
+            return s;
+        }
+    """, "classify", [(0,), (1,), (17,), (100,)]),
+    "print": ("""
+        def show(a, b) {
+            print(a);
+            if (a < b) { print(b - a); } else { print(a - b); }
+            print(a * b);
+            return a + b;
+        }
+    """, "show", [(2, 3), (7, -4), (0, 0)]),
+    "print_in_loop": ("""
+        def count(n) {
+            i = 0;
+            while (i < n) { print(i); i = i + 1; }
+            return i;
+        }
+    """, "count", [(0,), (5,)]),
+    "early_return": ("""
+        def first_multiple(n, k) {
+            i = 1;
+            while (i < n) {
+                if (i / k * k == i) { return i; }
+                i = i + 1;
+            }
+            print(n);
+            return 0 - 1;
+        }
+    """, "first_multiple", [(20, 7), (5, 7), (1, 1)]),
+    "fall_off_end": ("""
+        def nothing(x) {
+            if (x > 0) { return x; }
+        }
+    """, "nothing", [(4,), (-4,)]),
+    "unassigned_variable": ("""
+        def unset(x) {
+            if (x > 0) { y = x; }
+            return y + 1;
+        }
+    """, "unset", [(3,), (-3,)]),
+    "division_by_zero": ("""
+        def div(a, b) { return a / b; }
+    """, "div", [(7, 0), (0, 0), (-7, 0)]),
+    "negative_division": ("""
+        def div(a, b) { return a / b; }
+    """, "div", [(7, 2), (-7, 2), (7, -2), (-7, -2), (-6, 3), (6, -3), (1, -1), (INT64_MIN, 1)]),
+    "recursion": ("""
+        def fib(n) {
+            if (n < 2) { return n; }
+            return fib(n - 1) + fib(n - 2);
+        }
+    """, "fib", [(0,), (1,), (15,)]),
+    "missing_and_extra_args": ("""
+        def add(a, b) { return a + b; }
+    """, "add", [(4,), (1, 2, 3)]),
+}
+
+# Native code works on 64-bit integers; these have to bail out and give the
+# interpreter's (big integer) answer.
+OVERFLOW_CASES = {
+    "add": ("def f(a, b) { return a + b; }", "f", [(INT64_MAX, 1), (INT64_MIN, -1)]),
+    "sub": ("def f(a, b) { return a - b; }", "f", [(INT64_MIN, 1), (INT64_MAX, -1)]),
+    "mul": ("def f(a, b) { return a * b; }", "f", [(INT64_MAX, 2), (1 << 40, 1 << 40)]),
+    "min_div_minus_one": ("def f(a, b) { return a / b; }", "f", [(INT64_MIN, -1)]),
+    "intermediate": ("def f(a) { return a * a / a; }", "f", [(1 << 62,)]),
+    "in_loop_after_print": ("""
+        def f(n) {
+            s = 1;
+            i = 0;
+            while (i < n) { print(s); s = s * 1000; i = i + 1; }
+            return s / 1000;
+        }
+    """, "f", [(5,), (8,)]),
+    "callee_result": ("""
+        def big(x) { return x * x; }
+        def f(x) { return big(x) - big(x) + 1; }
+    """, "f", [(1 << 40,)]),
+}
+
+NEVER = 1 << 62
+
+@pytest.fixture(scope="module")
+def jit():
+    return JITCompiler(cache_dir="")
+
+def interpreter(code, jit, compile, loop_threshold=None):
+    if compile:
+        tiering = TieringPolicy(min_calls=1, max_calls=1, specialize_calls=0)
+    else:
+        tiering = TieringPolicy(min_calls=NEVER, max_calls=NEVER)
+    interp = Interpreter(parse_code(code), jit=jit, tiering=tiering, background_compile=False)
+    if not compile:
+        interp.loop_threshold = float("inf")
+    elif loop_threshold is not None:
+        interp.loop_threshold = loop_threshold
+    interp.run()
+    return interp
+
+def run_calls(interp, func_name, calls):
+    results = []
+    for args in calls:
+        mark = len(interp.output)
+        result = interp.call(func_name, list(args))
+        results.append((result, list(interp.output[mark:])))
+    return results
+
+def run_both(code, func_name, calls, jit):
+    interpreted = interpreter(code, jit, compile=False)
+    expected = run_calls(interpreted, func_name, calls)
+    assert not interpreted.compiled_functions
+
+    native = interpreter(code, jit, compile=True)
+    # The first call is interpreted and makes the function hot.
+    native.call(func_name, list(calls[0]))
+    assert func_name in native.compiled_functions
+    actual = run_calls(native, func_name, calls)
+    assert native.profiles[func_name].sampled_calls > 0
+    return expected, actual, native
+
+@pytest.mark.parametrize("op", sorted(COMPARISONS))
+def test_comparisons(jit, op):
+    expected, actual, _ = run_both(COMPARISONS[op], "cmp", PAIRS, jit)
+    assert actual == expected
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_constructs(jit, name):
+    code, func_name, calls = CASES[name]
+    expected, actual, native = run_both(code, func_name, calls, jit)
+    assert actual == expected
+    assert native.deopts == 0
+
+@pytest.mark.parametrize("name", sorted(OVERFLOW_CASES))
+def test_overflow(jit, name):
+    code, func_name, calls = OVERFLOW_CASES[name]
+    expected, actual, native = run_both(code, func_name, calls, jit)
+    assert actual == expected
+    assert native.deopts > 0
+
+def test_loops_compiled_on_stack(jit):
+    # The same loop at top level, replaced by native code part way through.
+    code = """
+        s = 0;
+        i = 0;
+        while (i < 5000) {
+            if (i / 7 * 7 == i) { s = s - i; } else { s = s + i * 3 / 2; }
+            i = i + 1;
+        }
+        print(s);
+        print(i);
+    """
+    interpreted = interpreter(code, jit, compile=False)
+    native = interpreter(code, jit, compile=True)
+    assert native.compiled_loops == 1
+    assert native.output == interpreted.output
+
+def test_array_writing_loop_resumes_after_bailing_out(jit):
+    # The multiply overflows on every element, after the loop has compiled
+    # and stored into the array; native code undoes the iteration it was in
+    # and the interpreter picks the loop up from there.
+    code = """
+        a = array(3);
+        r = 0;
+        while (r < 101) {
+            i = 0;
+            while (i < 3) {
+                print(a[i]);
+                a[i] = (a[i] * 4611686018427387904) / 4611686018427387904 + 1;
+                i = i + 1;
+            }
+            r = r + 1;
+        }
+        print(a[0] + a[1] + a[2]);
+    """
+    interpreted = interpreter(code, jit, compile=False)
+    native = interpreter(code, jit, compile=True, loop_threshold=10)
+    assert native.output[-1] == "303"
+    assert native.output == interpreted.output
+    assert native.compiled_loops > 0 and native.deopts > 0
+    assert native.get_arrays()["a"].tolist() == interpreted.get_arrays()["a"].tolist()
+
+def test_array_writing_functions_run_their_loops_natively(jit):
+    code = """
+        def scale(a, k) {
+            i = 0;
+            while (i < len(a)) {
+                a[i] = a[i] * k / k + 1;
+                if (i == 2) { print(a[i]); }
+                i = i + 1;
+            }
+            return 0;
+        }
+        a = array(50);
+        i = 0;
+        while (i < 50) { a[i] = i + 1; i = i + 1; }
+        z = scale(a, 3);
+        z = scale(a, 4611686018427387904);
+        z = scale(a, 5);
+        print(a[49]);
+    """
+    interpreted = interpreter(code, jit, compile=False)
+    native = interpreter(code, jit, compile=True, loop_threshold=10)
+    assert native.output == interpreted.output
+    assert native.get_arrays()["a"].tolist() == interpreted.get_arrays()["a"].tolist()
+    assert "scale" not in native.compiled_functions
+    assert native.compiled_loops > 0 and native.deopts > 0
+
+SUM_DOWN = """
+    def s(n) { if (n < 1) { return 0; } return n + s(n - 1); }
+"""
+
+def test_deep_recursion_on_the_first_call(jit):
+    # Nothing has returned yet when the recursion gets deep, so the function
+    # is compiled on the way in and the rest of it runs natively.
+    interpreted = interpreter(SUM_DOWN, jit, compile=False)
+    native = Interpreter(parse_code(SUM_DOWN), jit=jit, background_compile=False)
+    native.run()
+    assert native.call("s", [120]) == interpreted.call("s", [120])
+    assert "s" in native.compiled_functions
+    assert native.call("s", [100000]) == 100000 * 100001 // 2
+
+def test_runaway_native_recursion_fails_cleanly(jit):
+    native = Interpreter(parse_code("def f(n) { return f(n + 1) + 1; }"), jit=jit, background_compile=False)
+    native.run()
+    with pytest.raises(RecursionError):
+        native.call("f", [0])
+    assert "f" in native.compiled_functions
+
+def test_interpreted_recursion_depth(jit):
+    # The tree walker the closures replaced ran about 300 calls deep.
+    assert sys.getrecursionlimit() >= RECURSION_LIMIT
+    interpreted = interpreter(SUM_DOWN, jit, compile=False)
+    assert interpreted.call("s", [400]) == 400 * 401 // 2
+    assert not interpreted.compiled_functions
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from core.interpreter import BudgetExceeded, Interpreter, parse_code
+from core.jit_compiler import JITCompiler
+from core.runtime import NATIVE_BUDGET_INTERVAL
+
+LOOP = """
+    i = 0;
+    s = 0;
+    while (i < {n}) {{ s = s + i; i = i + 1; }}
+    print(s);
+"""
+
+@pytest.fixture(scope="module")
+def jit():
+    return JITCompiler(cache_dir="")
+
+def run(jit, n, fuel):
+    interp = Interpreter(parse_code(LOOP.format(n=n)), jit=jit, fuel=fuel, background_compile=False)
+    try:
+        interp.run()
+    except BudgetExceeded as e:
+        return interp, e
+    return interp, None
+
+def test_fuel_is_charged_to_the_interpreter_running_the_loop(jit):
+    # Each interpreter's native loops count down in its own NativeState, so
+    # loops running at the same time on other threads, or aborting, do not
+    # move its countdown or get charged to it.
+    n = 40 * NATIVE_BUDGET_INTERVAL
+    results = {}
+    def worker(name, iterations, fuel):
+        results[name] = run(jit, iterations, fuel)
+    threads = [threading.Thread(target=worker, args=(f"ok{k}", n, 2 * n)) for k in range(3)]
+    threads += [threading.Thread(target=worker, args=(f"short{k}", n, n // 4)) for k in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for k in range(3):
+        interp, error = results[f"ok{k}"]
+        assert error is None
+        assert interp.output == [str(n * (n - 1) // 2)]
+        assert interp.compiled_loops == 1
+        # Native code charges whole intervals, and never more than it ran.
+        assert n - 2 * NATIVE_BUDGET_INTERVAL <= interp.fuel_used <= n + NATIVE_BUDGET_INTERVAL
+
+        interp, error = results[f"short{k}"]
+        assert error is not None and error.limit == "fuel"
+        assert interp.fuel_used <= n // 4 + 2 * NATIVE_BUDGET_INTERVAL
+
+def test_states_are_separate(jit):
+    first, _ = run(jit, 10, None)
+    second, error = run(jit, 4 * NATIVE_BUDGET_INTERVAL, NATIVE_BUDGET_INTERVAL)
+    assert error is not None
+    assert first.native_state.budget != 0
+    assert first.state_address != second.state_address
+
+@pytest.mark.parametrize("fuel", [1500, NATIVE_BUDGET_INTERVAL + 100, 100000])
+def test_native_loops_stop_at_the_fuel_limit(jit, fuel):
+    # The countdown starts from the fuel that is left when less than an
+    # interval is, and only the iterations that ran are charged.
+    interp, error = run(jit, 10 * NATIVE_BUDGET_INTERVAL, fuel)
+    assert error is not None and error.limit == "fuel"
+    assert interp.compiled_loops == 1
+    assert interp.fuel_used <= fuel and error.used <= fuel
+    assert interp.fuel_used >= fuel - 1
+
+def test_native_calls_from_a_loop_stop_at_the_fuel_limit(jit):
+    code = """
+        def f(n) { i = 0; while (i < n) { i = i + 1; } return i; }
+        k = 0;
+        while (1) { k = k + f(300); }
+    """
+    interp = Interpreter(parse_code(code), jit=jit, fuel=20000, background_compile=False)
+    with pytest.raises(BudgetExceeded):
+        interp.run()
+    assert interp.compiled_functions
+    assert interp.fuel_used <= 20000
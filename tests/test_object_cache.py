@@ -0,0 +1,26 @@
+import os
+import stat
+
+from core.object_cache import ObjectCache
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_clear_keeps_the_directory_private(tmp_path):
+    old_umask = os.umask(0o002)
+    try:
+        cache = ObjectCache(str(tmp_path / "cache"), "v1-llvm14")
+        cache.store("a", b"object")
+        cache.clear()
+    finally:
+        os.umask(old_umask)
+    assert mode(cache.directory) == 0o700
+    assert cache.load("a") is None
+
+def test_only_version_directories_are_pruned(tmp_path):
+    root = tmp_path / "cache"
+    (root / "v1-llvm14").mkdir(parents=True, mode=0o700)
+    (root / "notes").mkdir()
+    os.chmod(root, 0o700)
+    ObjectCache(str(root), "v2-llvm14")
+    assert sorted(os.listdir(root)) == ["notes", "v2-llvm14"]
@@ -0,0 +1,167 @@
+import random
+
+import pytest
+
+from core.arrays import from_json
+from core.interpreter import BudgetExceeded, Interpreter, parse_code
+from core.jit_compiler import JITCompiler
+from core.nodes import OP_ASSIGN, OP_BINARY_OP, OP_IF, OP_WHILE, walk
+from core.optimizer import optimize
+from core.tiering import TieringPolicy
+
+# A program and its optimized copy must print the same thing, end the same
+# way and leave the same arrays behind, interpreted and with the JIT.
+
+@pytest.fixture(scope="module")
+def jit():
+    return JITCompiler(cache_dir="")
+
+def random_program(rng):
+    # Small programs with constants, loops, branches and calls.
+    names = ["a", "b", "c", "i"]
+    def expr(depth=0):
+        r = rng.random()
+        if depth > 3 or r < 0.3:
+            return str(rng.choice([0, 1, 2, 3, 7, 60, 1000]))
+        if r < 0.55:
+            return rng.choice(names)
+        if r < 0.62 and depth < 2:
+            return f"f{rng.randint(0, 1)}({expr(depth + 1)})"
+        return f"({expr(depth + 1)} {rng.choice(['+', '-', '*', '/', '<', '==', '!=', '>='])} {expr(depth + 1)})"
+    def block(n, depth, in_function):
+        stmts = []
+        for _ in range(n):
+            r = rng.random()
+            if r < 0.35:
+                stmts.append(f"{rng.choice(names)} = {expr()};")
+            elif r < 0.65 and depth < 3:
+                other = f" else {{ {block(rng.randint(0, 2), depth + 1, in_function)} }}" if rng.random() < 0.5 else ""
+                stmts.append(f"if ({expr()}) {{ {block(rng.randint(0, 3), depth + 1, in_function)} }}{other}")
+            elif r < 0.8 and depth < 2:
+                v = f"w{depth}"
+                stmts.append(f"{v} = 0; while ({v} < {rng.randint(0, 12)}) "
+                             f"{{ {block(rng.randint(1, 4), depth + 1, in_function)} {v} = {v} + 1; }}")
+            elif r < 0.87 and in_function:
+                stmts.append(f"return {expr()};")
+            else:
+                stmts.append(f"print({expr()});")
+        return " ".join(stmts)
+    functions = "".join(f"def f{k}(a) {{ {block(rng.randint(1, 4), 1, True)} return {expr()}; }} " for k in range(2))
+    return functions + block(rng.randint(3, 8), 0, False)
+
+def outcome(ast, jit, hot, arrays=None):
+    # What a program prints, how it ends and the arrays it holds at the end,
+    # with or without the JIT.
+    if hot:
+        tiering = TieringPolicy(max_calls=3)
+    else:
+        tiering = TieringPolicy(min_calls=1 << 62, max_calls=1 << 62)
+    variables = {name: from_json(values) for name, values in (arrays or {}).items()}
+    interp = Interpreter(ast, jit=jit, tiering=tiering, fuel=20000, background_compile=False, variables=variables)
+    interp.loop_threshold = 30 if hot else float("inf")
+    try:
+        interp.run()
+        ending = None
+    except BudgetExceeded:
+        ending = "fuel"
+    except Exception as e:
+        # Runaway recursion is reported from wherever the stack ran out,
+        # which may be inside ctypes.
+        if "recursion" in str(e):
+            return None, "recursion", None
+        ending = str(e)
+    return list(interp.output), ending, {name: a.tolist() for name, a in interp.get_arrays().items()}
+
+def assert_equivalent(code, jit, arrays=None):
+    ast = parse_code(code)
+    optimized = optimize(ast)
+    for hot in (False, True):
+        assert outcome(optimized, jit, hot, arrays) == outcome(ast, jit, hot, arrays), code
+    return optimized
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_programs(jit, seed):
+    rng = random.Random(seed)
+    for _ in range(30):
+        assert_equivalent(random_program(rng), jit)
+
+def tags(node):
+    return [n.tag for n in walk(node)]
+
+def test_constant_folding(jit):
+    optimized = assert_equivalent("""
+        def f(x) { return x + 2 * 60 * 60 - 0; }
+        seconds = 2 * 60 * 60;
+        print(seconds * 1);
+        print(f(seconds));
+    """, jit)
+    assert OP_BINARY_OP not in tags(optimized.body[1:])
+    assert tags(optimized.body[0]).count(OP_BINARY_OP) == 1
+
+def test_dead_branches(jit):
+    optimized = assert_equivalent("""
+        debug = 0;
+        if (debug) { print(1); } else { print(2); }
+        if (debug * 5 == 1) { print(3); }
+        while (debug) { print(4); }
+    """, jit)
+    assert OP_IF not in tags(optimized) and OP_WHILE not in tags(optimized)
+
+def test_loop_invariant_hoisting(jit):
+    optimized = assert_equivalent("""
+        def f(n, k) {
+            m = k - 3;
+            i = 0;
+            s = 0;
+            while (i < n) { s = s + i * (m * m + 1); i = i + 1; }
+            return s;
+        }
+        j = 0;
+        while (j < 50) { print(f(j, j)); j = j + 1; }
+    """, jit)
+    func = optimized.body[0]
+    loop = next(stmt for stmt in func.body if stmt.tag == OP_WHILE)
+    # m * m + 1 is computed once, before the loop.
+    assert tags(loop).count(OP_BINARY_OP) == 4
+    assert any(stmt.tag == OP_ASSIGN and stmt.expr.tag == OP_BINARY_OP for stmt in func.body[:func.body.index(loop)])
+
+def test_unused_assignments(jit):
+    optimized = assert_equivalent("""
+        def g(x) { print(x); return x; }
+        def f(x) {
+            y = x + 1;
+            unused = y * 2;
+            also = unused + 1;
+            called = g(x);
+            return x;
+        }
+        print(f(5));
+    """, jit)
+    assigned = [n.var for n in walk(optimized) if n.tag == OP_ASSIGN]
+    assert "unused" not in assigned and "also" not in assigned
+    assert "called" in assigned and "y" in assigned
+
+def test_arithmetic_on_arrays_still_fails(jit):
+    # Parameters and the top level's inputs may be arrays, which make
+    # arithmetic fail, so none of it is folded, dropped or hoisted.
+    for code in [
+        "b = a + 0; print(1);",
+        "print(a - a);",
+        "print(a * 0);",
+        "print(a < a);",
+        "def f(x) { unused = x * 2; return 0; } print(f(a));",
+        "def f(x, n) { i = 0; while (i < n) { if (i > 2) { print(x * x); } i = i + 1; } return i; } print(f(a, 0));",
+        "i = 0; while (i < 3) { print(i); if (i == 2) { print(a * 2); } i = i + 1; }",
+    ]:
+        assert_equivalent(code, jit, {"a": [1, 2]})
+
+def test_top_level_arrays_are_kept(jit):
+    # /run returns every array the top level holds, read or not.
+    optimized = assert_equivalent("""
+        b = a;
+        c = b;
+        n = 3;
+        d = array(n);
+    """, jit, {"a": [1, 2, 3]})
+    assigned = [n.var for n in walk(optimized) if n.tag == OP_ASSIGN]
+    assert {"b", "c", "d"} <= set(assigned)
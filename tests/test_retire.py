@@ -0,0 +1,82 @@
+import threading
+
+from core.runtime import NATIVE_BUDGET_INTERVAL, NativeState, retire, running
+
+class Engine:
+    unmaps_code = True
+
+class FakeJIT:
+    # Records what would be unloaded instead of touching an engine.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = Engine()
+        self.removed = []
+
+    def remove_code(self, entry):
+        self.removed.append(entry)
+
+class FakeInterpreter:
+    def __init__(self):
+        self.native_state = NativeState()
+        self.native_error = None
+
+    def native_allowance(self):
+        return NATIVE_BUDGET_INTERVAL
+
+    def settle_native(self):
+        pass
+
+class Visit:
+    # Holds running() open on its own thread until left.
+    def __init__(self):
+        self.entered = threading.Event()
+        self.leave = threading.Event()
+        self.left = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+        self.entered.wait()
+
+    def run(self):
+        with running(FakeInterpreter()):
+            self.entered.set()
+            self.leave.wait()
+        self.left.set()
+
+    def exit(self):
+        self.leave.set()
+        self.thread.join()
+
+def test_removed_at_once_when_nothing_runs():
+    jit = FakeJIT()
+    with jit.lock:
+        retire(jit, "a")
+    assert jit.removed == ["a"]
+
+def test_waits_only_for_threads_inside_when_retired():
+    jit = FakeJIT()
+    first = Visit()
+    with jit.lock:
+        retire(jit, "a")
+    second = Visit()
+    with jit.lock:
+        retire(jit, "b")
+    assert jit.removed == []
+
+    # A thread that entered after "a" was retired cannot be running it, so
+    # "a" goes as soon as the first thread leaves, while the second runs on.
+    first.exit()
+    assert jit.removed == ["a"]
+    third = Visit()
+    second.exit()
+    assert jit.removed == ["a", "b"]
+    third.exit()
+    assert jit.removed == ["a", "b"]
+
+def test_nested_calls_hold_the_entry():
+    jit = FakeJIT()
+    with running(FakeInterpreter()):
+        with running(FakeInterpreter()):
+            with jit.lock:
+                retire(jit, "a")
+        assert jit.removed == []
+    assert jit.removed == ["a"]
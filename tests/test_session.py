@@ -0,0 +1,50 @@
+import pytest
+
+from core.session import SessionStore, SessionStoreFull
+
+PROGRAM = """
+    def fill(a, v) {
+        i = 0;
+        while (i < len(a)) { a[i] = v; i = i + 1; }
+        return v;
+    }
+    def nothing() { return 0; }
+    big = array(%d);
+    same = big;
+    z = fill(big, 7);
+"""
+
+def test_arrays_count_towards_the_size():
+    store = SessionStore(max_bytes=1 << 30)
+    small, _ = store.create(PROGRAM % 10)
+    large, _ = store.create(PROGRAM % 100000)
+    # Held by two variables, counted once.
+    assert small.size == small.program_size + 8 * 10
+    assert large.size == large.program_size + 8 * 100000
+    assert store.used == small.size + large.size
+
+def test_programs_holding_too_much_are_refused():
+    store = SessionStore(max_bytes=1 << 20)
+    with pytest.raises(SessionStoreFull):
+        store.create(PROGRAM % 200000)
+    assert store.used == 0 and not store.sessions
+
+def test_size_is_taken_again_after_calls():
+    store = SessionStore(max_bytes=1 << 30)
+    session, _ = store.create(PROGRAM % 1000)
+    size = session.size
+    # Stands in for a call that leaves the top level holding more.
+    session.program_size += 1 << 20
+    assert store.call(session, "nothing", [], None, None) == (0, [])
+    assert session.size == size + (1 << 20) and store.used == session.size
+
+def test_calls_that_outgrow_the_store_evict():
+    store = SessionStore(max_bytes=1 << 20)
+    first, _ = store.create(PROGRAM % 1000)
+    second, _ = store.create(PROGRAM % 1000)
+    second.program_size = (1 << 20) - first.size
+    store.call(second, "nothing", [], None, None)
+    assert list(store.sessions) == [second.id]
+    second.program_size = 1 << 21
+    store.call(second, "nothing", [], None, None)
+    assert not store.sessions and store.used == 0